@@ -1,11 +1,19 @@
 #!/usr/bin/python
+import os
 import sys
 import math
 import random
 import itertools
+import json
+import collections
 
 import yaml
 
+# Attributes of robots and bullets in the "text" protocol (in order)
+ROBOT_ATTRIBUTES = ["x", "y", "angle", "rotation", "shield", "speed", 
+                    "time_to_fire", "turret_angle", "turret_rotation"]
+BULLET_ATTRIBUTES = ["x", "y", "angle", "speed"]
+
 def debug(line):
     """Write debug line to standard error."""
     sys.stderr.write("---" + str(line) + "\n")
@@ -35,6 +43,109 @@ def read_update2(stream):
     if yamldata:
         return yaml.load("".join(yamldata))        
 
+def read_update_json(stream):
+    """Read update structure (a single line of JSON)."""
+    line = stream.readline()
+    if line:
+        return json.loads(line)
+
+def read_update_text(stream):
+    """
+    Read update structure from a single line of space-separated fields:
+    
+    id time ME N_OTHERS OTHER1 ... N_BULLETS BULLET1 ...
+    """
+    line = stream.readline()
+    if not line:
+        return
+    values = iter(line.split())
+    def _number(s):
+        try:
+            return int(s)
+        except ValueError:
+            return float(s)
+    def _get_objects(attributes, n):
+        return [dict((k, _number(next(values))) for k in attributes) 
+                for index in range(n)]
+    update_id, time = next(values), float(next(values))
+    me = _get_objects(ROBOT_ATTRIBUTES, 1)[0]
+    others = _get_objects(ROBOT_ATTRIBUTES, int(next(values)))
+    bullets = _get_objects(BULLET_ATTRIBUTES, int(next(values)))
+    return {"id": update_id, "time": time, "bullets": bullets,
+            "robots": {"me": me, "others": others}}
+
+class DeltaReader(object):
+    """
+    Read updates of the delta protocol (keyframes and deltas) and return 
+    the reconstructed state as an update structure. 
+    
+    Bullets are received only once; its current position is calculated from 
+    that position (they move in a straight line with constant speed).
+    """
+    def __init__(self):
+        self.me = None
+        self.robots = collections.OrderedDict()
+        self.bullets = collections.OrderedDict()
+
+    def __call__(self, stream):
+        line = stream.readline()
+        if not line:
+            return
+        data = json.loads(line, object_pairs_hook=collections.OrderedDict)
+        time = data["time"]
+        if data.get("keyframe"):
+            self.me = data["me"]
+            self.robots = data["robots"]
+            self.bullets = collections.OrderedDict()
+        else:
+            for name in data["removed_robots"]:
+                self.robots.pop(name, None)
+            for name, changes in data["robots"].iteritems():
+                self.robots.setdefault(name, {}).update(changes)
+            for bullet_id in data["removed_bullets"]:
+                self.bullets.pop(bullet_id, None)
+        for bullet_id, bullet in data["bullets"].iteritems():
+            self.bullets[bullet_id] = (bullet, time)
+        others = [dict(robot) for (name, robot) in self.robots.iteritems() 
+                  if name != self.me]
+        bullets = [self.get_bullet(bullet, time - bullet_time) 
+                   for (bullet, bullet_time) in self.bullets.itervalues()]
+        return {"id": data["id"], "time": time, "bullets": bullets,
+                "robots": {"me": dict(self.robots[self.me]), "others": others}}
+
+    def get_bullet(self, bullet, dt):
+        """Return bullet moved for a delta_t."""
+        alpha = bullet["angle"] * math.pi / 180.0
+        k = dt * bullet["speed"]
+        return dict(bullet, x=bullet["x"] + k * math.cos(alpha), 
+                    y=bullet["y"] - k * math.sin(alpha))
+
+READERS = {"yaml": read_update, "json": read_update_json, "text": read_update_text,
+           "delta": DeltaReader()}
+
+class BattleStream(object):
+    """
+    Stream of updates of a battle for pooled bots: the "end-battle" line 
+    is read as the end of the stream.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.ended = False
+
+    def readline(self):
+        if self.ended:
+            return ""
+        line = self.stream.readline()
+        if not line or line == "end-battle\n":
+            self.ended = True
+            return ""
+        return line
+
+    def skip(self):
+        """Skip the rest of updates of the battle."""
+        while self.readline():
+            pass
+
 def send_command(update, command=None):
     """
     Send command for your robot.
@@ -52,7 +163,44 @@ def send_command(update, command=None):
     sys.stdout.flush()
         
 def main(args, control):
-    """Main function wrapper that can be be called from the bot script."""
-    initfile, = args
+    """
+    Main function wrapper that can be be called from the bot script.
+    
+    Arguments: initfile [protocol] (yaml by default, see READERS). An
+    initfile "-" runs a pooled bot (see run_battles). If the
+    environment variable LANGBOTS_SEED is set, the random module is seeded 
+    with it (i.e. for reproducible tournaments).
+    """
+    if "LANGBOTS_SEED" in os.environ:
+        random.seed(int(os.environ["LANGBOTS_SEED"]))
+    initfile, protocol = (args + ["yaml"])[:2]
+    if initfile == "-":
+        return run_battles(protocol, control)
+    reader = READERS[protocol]
     init = yaml.load(open(initfile).read())
-    control(init, iter(lambda: read_update(sys.stdin), None))
+    control(init, iter(lambda: reader(sys.stdin), None))
+
+def run_battles(protocol, control):
+    """
+    Run battles for a pooled bot (see commands_input.BotPool).
+    
+    Each battle starts with a line "new-battle SIZE [SEED]" followed by SIZE 
+    bytes of init YAML, and ends with a line "end-battle", that the bot
+    acknowledges with the same line once it's ready for a new battle. 
+    """
+    while 1:
+        header = sys.stdin.readline()
+        if not header:
+            break
+        spline = header.split()
+        if spline[0] != "new-battle":
+            continue
+        init = yaml.load(sys.stdin.read(int(spline[1])))
+        if len(spline) > 2:
+            random.seed(int(spline[2]))
+        reader = (DeltaReader() if protocol == "delta" else READERS[protocol])
+        stream = BattleStream(sys.stdin)
+        control(init, iter(lambda: reader(stream), None))
+        stream.skip()
+        sys.stdout.write("end-battle\n")
+        sys.stdout.flush()
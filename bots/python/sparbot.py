@@ -0,0 +1,34 @@
+#!/usr/bin/python
+"""
+In-process version of simplebot (see langbots/inputmods/python_input.py):
+
+    -r name:python:bots/python/sparbot.py
+"""
+import math
+import random
+
+def init(config, robot_name):
+    """Return the control function of the robot."""
+    rnd = random.Random(robot_name)
+    state = {"started": False}
+    def control(view):
+        commands = []
+        if not state["started"]:
+            state["started"] = True
+            commands.append("set-speed 200 set-rotation-speed 30")
+        if rnd.random() < 0.01:
+            commands.append("set-speed %d set-rotation-speed %d" %
+                (rnd.randrange(-150, 150), rnd.randrange(-100, 100)))
+        me = view.me
+        if not view.others or me.time_to_fire or me.turret_rotation:
+            return commands
+        other = view.others[0]
+        
+        # Fire a bullet to the other robot
+        diff_x = other.x - me.x
+        diff_y = other.y - me.y
+        angle = (-math.atan(diff_y / diff_x) if abs(diff_x) > 0.0001 else math.pi / 2.0)
+        angle2 = (angle * 180.0 / math.pi) + (180.0 if other.x < me.x else 0.0)
+        commands.append(("rotate-turret-to-angle-and-fire", int(angle2)))
+        return commands
+    return control
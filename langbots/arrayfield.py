@@ -0,0 +1,207 @@
+#!/usr/bin/python
+import math
+
+# Third-party modules (optional, only needed for array-backed fields)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# App modules
+from langbots import lib
+from langbots import geometry
+
+def check_numpy():
+    """Raise ImportError if NumPy is not available."""
+    if numpy is None:
+        raise ImportError, "array-backed fields need the numpy module"
+
+def check_points_in_polygons(px, py, polygons):
+    """
+    Return boolean array, True where points are inside polygons (convex).
+
+    polygons is a pair (xs, ys) of arrays with the vertices on the last axis
+    (see geometry.check_point_in_polygon).
+    """
+    xs, ys = polygons
+    positive = numpy.zeros(px.shape, dtype=bool)
+    negative = numpy.zeros(px.shape, dtype=bool)
+    for index in range(xs.shape[-1]):
+        x1, y1 = xs[..., index - 1], ys[..., index - 1]
+        x2, y2 = xs[..., index], ys[..., index]
+        cp = (x2 - x1) * (py - y1) - (y2 - y1) * (px - x1)
+        positive |= (cp > 0)
+        negative |= (cp < 0)
+    return ~(positive & negative)
+
+class BulletArray(object):
+    """
+    Sequence of bullets stored as contiguous NumPy columns (x, y, speed, ...).
+
+    The direction of each bullet (cos/sin of its angle) is calculated once,
+    when the bullet is added. New bullets are buffered and joined to the
+    columns in a single step. Iterating returns Bullet structs (built lazily
+    and cached until the columns change), so the object can be used wherever
+    a list of bullets is expected. Collisions are checked on the columns
+    (see get_collisions).
+    """
+    def __init__(self, bullet_type, bullets=()):
+        check_numpy()
+        self.bullet_type = bullet_type
+        self.x = numpy.empty(0)
+        self.y = numpy.empty(0)
+        self.angle = numpy.empty(0)
+        self.speed = numpy.empty(0)
+        self.cos = numpy.empty(0)
+        self.sin = numpy.empty(0)
+        self.origin = []
+        self.id = []
+        self._pending = []
+        self._structs = None
+        self.extend(bullets)
+
+    def append(self, bullet):
+        """Add a bullet (struct) to the array."""
+        self._pending.append(bullet)
+        self._structs = None
+
+    def extend(self, bullets):
+        """Add bullets (structs) to the array."""
+        for bullet in bullets:
+            self.append(bullet)
+
+    def _flush(self):
+        """Join pending bullets to the columns."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        def _join(column, values):
+            return numpy.concatenate([column, numpy.array(values, dtype=float)])
+        angles = [bullet.angle for bullet in pending]
+        self.x = _join(self.x, [bullet.x for bullet in pending])
+        self.y = _join(self.y, [bullet.y for bullet in pending])
+        self.angle = _join(self.angle, angles)
+        self.speed = _join(self.speed, [bullet.speed for bullet in pending])
+        self.cos = _join(self.cos, [math.cos(geometry.torad(a)) for a in angles])
+        self.sin = _join(self.sin, [math.sin(geometry.torad(a)) for a in angles])
+        self.origin.extend(bullet.origin for bullet in pending)
+        self.id.extend(bullet.id for bullet in pending)
+
+    def _select(self, mask):
+        """Keep only the rows of the columns where mask is True."""
+        for name in ["x", "y", "angle", "speed", "cos", "sin"]:
+            setattr(self, name, getattr(self, name)[mask])
+        self.origin = [o for (o, keep) in zip(self.origin, mask) if keep]
+        self.id = [i for (i, keep) in zip(self.id, mask) if keep]
+        self._structs = None
+
+    def advance(self, dt, screen_size):
+        """Move all bullets a delta_t and remove those out of the screen."""
+        self._flush()
+        screen_width, screen_height = screen_size
+        k = dt * self.speed
+        self.x = self.x + k * self.cos
+        self.y = self.y - k * self.sin
+        self._structs = None
+        inside = ((self.x >= 0) & (self.x < screen_width) &
+                  (self.y >= 0) & (self.y < screen_height))
+        if not inside.all():
+            self._select(inside)
+
+    def remove(self, bullets):
+        """Remove bullets (structs previously returned by the array)."""
+        ids = set(map(id, bullets))
+        if not ids or self._structs is None:
+            return
+        mask = numpy.array([id(bullet) not in ids for bullet in self._structs],
+            dtype=bool)
+        self._select(mask)
+
+    def _get_struct(self, index):
+        """Return Bullet struct for a row (structs are cached until columns change)."""
+        if self._structs is None:
+            self._structs = [None] * len(self.origin)
+        if self._structs[index] is None:
+            self._structs[index] = self.bullet_type(x=self.x[index].item(),
+                y=self.y[index].item(), angle=self.angle[index].item(),
+                speed=self.speed[index].item(), origin=self.origin[index],
+                id=self.id[index])
+        return self._structs[index]
+
+    def _get_structs(self):
+        self._flush()
+        return [self._get_struct(index) for index in range(len(self.origin))]
+
+    def get_collisions(self, robots, polygons):
+        """
+        Return list of (bullet, robot) for bullets inside the polygon of a robot.
+
+        Give the same collisions than battlefield.check_bullet_collision for 
+        each bullet (the first robot, in order, that did not fire it), but 
+        points are tested on the columns and structs are only built for the 
+        bullets that hit.
+        """
+        self._flush()
+        hits = {}
+        for robot, polygon in zip(robots, polygons):
+            xs, ys = numpy.array(polygon).T
+            inside = check_points_in_polygons(self.x, self.y, (xs, ys))
+            for index in numpy.flatnonzero(inside).tolist():
+                if index not in hits and self.origin[index] != robot.name:
+                    hits[index] = robot
+        return [(self._get_struct(index), hits[index]) for index in sorted(hits)]
+    def __iter__(self):
+        return iter(self._get_structs())
+
+    def __len__(self):
+        return len(self.origin) + len(self._pending)
+
+    def __getitem__(self, index):
+        return self._get_structs()[index]
+
+    def __repr__(self):
+        return "<BulletArray %s>" % self._get_structs()
+
+def process_robots(robots, dt, screen_size, in_place=False):
+    """
+    Move robots a delta_t in a single batched step (see battlefield.process_robot).
+
+    Robots are collected into NumPy columns, integrated and clamped to the
+    screen limits. Return a list of new robots (the input is not modified
+    unless in_place is set).
+    """
+    check_numpy()
+    if not robots:
+        return []
+    screen_width, screen_height = screen_size
+    def _column(attr):
+        return numpy.array([getattr(robot, attr) for robot in robots], dtype=float)
+    x, y, angle = _column("x"), _column("y"), _column("angle")
+    w2, h2 = _column("width") / 2.0, _column("height") / 2.0
+    k = dt * _column("speed")
+    alpha = geometry.torad(angle)
+    new_x = x + k * numpy.cos(alpha)
+    new_x = numpy.where(new_x - w2 < 0, w2,
+        numpy.where(new_x + w2 >= screen_width, screen_width - w2, new_x))
+    new_y = y - k * numpy.sin(alpha)
+    new_y = numpy.where(new_y < h2, h2,
+        numpy.where(new_y + h2 >= screen_height, screen_height - h2, new_y))
+    new_angle = geometry.normalize_angle(angle + dt * _column("rotation"))
+    new_robots = []
+    for robot, x, y, angle in zip(robots, new_x.tolist(), new_y.tolist(),
+                                  new_angle.tolist()):
+        new_robot = (robot if in_place else lib.clone_struct(robot))
+        new_robot.x, new_robot.y, new_robot.angle = x, y, angle
+        new_robots.append(new_robot)
+    return new_robots
+
+def use_arrays(field, bullet_type):
+    """Switch field to the array-backed representation (in-place)."""
+    check_numpy()
+    if not isinstance(field.bullets, BulletArray):
+        field.bullets = BulletArray(bullet_type, field.bullets)
+    return field
+
+def is_array_field(field):
+    """Return True if field uses the array-backed representation."""
+    return isinstance(field.bullets, BulletArray)
@@ -0,0 +1,340 @@
+#!/usr/bin/python
+import math
+
+# Third-party modules (optional, only needed for batched battles)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# App modules
+from langbots import geometry
+from langbots import battlefield
+from langbots import arrayfield
+
+# Robots are stored as (battles, 2) arrays, one column for each robot of a
+# battle (in order of name). Angles not set (fire_angle, turret_final_angle)
+# are NaN. Bullets of all battles are stored as flat arrays with the index
+# of their battle and robot (origin).
+
+ROBOT_COLUMNS = ["x", "y", "width", "height", "speed", "rotation", "angle",
+                 "turret_rotation", "turret_angle", "shield", "time_to_fire",
+                 "fire_angle", "turret_final_angle"]
+BULLET_COLUMNS = ["battle", "origin", "id", "x", "y", "angle", "speed", "cos",
+                  "sin"]
+# Commands of step, applied in this order
+COMMANDS = ["set-speed", "set-rotation-speed", "set-turret-rotation-speed",
+            "rotate-turret-to-angle-and-fire", "rotate-turret-to-angle", "fire"]
+
+def check_numpy():
+    """Raise ImportError if NumPy is not available."""
+    if numpy is None:
+        raise ImportError, "batched battles need the numpy module"
+
+def get_polygons(x, y, angle, width, height):
+    """Return (xs, ys) arrays (..., 4) of polygons of robots (see create_pose)."""
+    alpha = geometry.torad(angle)
+    cos, sin = numpy.cos(alpha), numpy.sin(alpha)
+    w2 = width / 2.0
+    h2 = height / 2.0
+    wx, wy = w2*cos, w2*sin
+    hx, hy = h2*sin, h2*cos
+    xs = numpy.array([x - wx - hx, x - wx + hx, x + wx + hx, x + wx - hx])
+    ys = numpy.array([y + wy - hy, y + wy + hy, y - wy + hy, y - wy - hy])
+    return numpy.rollaxis(xs, 0, xs.ndim), numpy.rollaxis(ys, 0, ys.ndim)
+
+def check_collision_of_polygons(polygon1, polygon2):
+    """
+    Return boolean array, True where polygons (see get_polygons) collide.
+
+    Same separating axis test than geometry.get_penetration_of_polygons.
+    """
+    (xs1, ys1), (xs2, ys2) = polygon1, polygon2
+    collide = numpy.ones(xs1.shape[:-1], dtype=bool)
+    for xs, ys in [polygon1, polygon2]:
+        for index in range(4):
+            x1, y1 = xs[..., index - 1], ys[..., index - 1]
+            x2, y2 = xs[..., index], ys[..., index]
+            ax, ay = y1 - y2, x2 - x1
+            length = numpy.hypot(ax, ay)
+            valid = (length != 0)
+            length = numpy.where(valid, length, 1.0)
+            ax, ay = ax / length, ay / length
+            projections1 = xs1 * ax[..., None] + ys1 * ay[..., None]
+            projections2 = xs2 * ax[..., None] + ys2 * ay[..., None]
+            min1, max1 = projections1.min(-1), projections1.max(-1)
+            min2, max2 = projections2.min(-1), projections2.max(-1)
+            collide &= ~(valid & ((max1 < min2) | (max2 < min1)))
+    return collide
+
+check_points_in_polygons = arrayfield.check_points_in_polygons
+
+class BatchBattle(object):
+    """
+    Many independent 1v1 battles advanced together with NumPy operations.
+
+    Battles start from fields (with 2 robots) and advance delta_time on
+    each step, with the same results than battlefield.Battle. Finished
+    battles (see done) are not advanced anymore.
+    """
+    def __init__(self, fields, delta_time):
+        check_numpy()
+        self.config = fields[0].config
+        self.delta_time = delta_time
+        self.robot_names = []
+        robots = dict((name, []) for name in ROBOT_COLUMNS)
+        bullets = dict((name, []) for name in BULLET_COLUMNS)
+        for index, field in enumerate(fields):
+            names = sorted(field.robots)
+            if len(names) != 2:
+                raise ValueError, "batched battles need fields with 2 robots"
+            self.robot_names.append(names)
+            for name in ROBOT_COLUMNS:
+                robots[name].append([_get_value(getattr(field.robots[robot_name], name))
+                    for robot_name in names])
+            for bullet in field.bullets:
+                angle = geometry.torad(bullet.angle)
+                values = dict(battle=index, origin=names.index(bullet.origin),
+                    id=bullet.id, x=bullet.x, y=bullet.y, angle=bullet.angle,
+                    speed=bullet.speed, cos=math.cos(angle), sin=math.sin(angle))
+                for name in BULLET_COLUMNS:
+                    bullets[name].append(values[name])
+        for name in ROBOT_COLUMNS:
+            setattr(self, name, numpy.array(robots[name], dtype=float))
+        self.bullets = dict((name, numpy.array(values,
+                dtype=(int if name in ["battle", "origin", "id"] else float)))
+            for (name, values) in bullets.iteritems())
+        self.alive = numpy.ones(self.x.shape, dtype=bool)
+        self.battle_time = numpy.array([field.battle_time or 0.0
+            for field in fields], dtype=float)
+        self.bullets_fired = numpy.array([field.bullets_fired or 0
+            for field in fields], dtype=int)
+
+    @property
+    def done(self):
+        """Boolean array, True for finished battles."""
+        return self.alive.sum(1) <= 1
+
+    def get_winners(self):
+        """Return list of robot names of winners (None if no winner yet)."""
+        return [(names[self.alive[index].argmax()] if self.alive[index].sum() == 1
+                 else None) for (index, names) in enumerate(self.robot_names)]
+
+    def get_field(self, index):
+        """Return Field for the current state of a battle."""
+        names = self.robot_names[index]
+        robots = {}
+        for column, name in enumerate(names):
+            if not self.alive[index, column]:
+                continue
+            values = dict((attr, _get_attribute(getattr(self, attr)[index, column]))
+                for attr in ROBOT_COLUMNS)
+            values["shield"] = int(values["shield"])
+            robots[name] = battlefield.Robot(name=name, **values)
+        bullets = self.bullets
+        rows = numpy.nonzero(bullets["battle"] == index)[0]
+        field_bullets = [battlefield.Bullet(x=float(bullets["x"][row]),
+                y=float(bullets["y"][row]), angle=float(bullets["angle"][row]),
+                speed=float(bullets["speed"][row]),
+                origin=names[bullets["origin"][row]], id=int(bullets["id"][row]))
+            for row in rows[numpy.argsort(bullets["id"][rows], kind="mergesort")]]
+        return battlefield.Field(config=self.config, robots=robots,
+            bullets=field_bullets, battle_time=float(self.battle_time[index]),
+            bullets_fired=int(self.bullets_fired[index]))
+
+    def step(self, commands=None):
+        """
+        Apply commands and advance battles (not done) a delta_time.
+
+        commands is a dictionary {command: array (battles, 2)} (see COMMANDS)
+        with the argument of the command for each robot, NaN for no command
+        (booleans for "fire"). Return the done array.
+        """
+        active = ~self.done
+        with numpy.errstate(invalid="ignore"):
+            if commands:
+                self.apply_commands(commands, active)
+            self.battle_time = numpy.where(active,
+                self.battle_time + self.delta_time, self.battle_time)
+            self.process_turrets(active)
+            self.process_bullets(active)
+            self.move_robots(active)
+            self.process_hits(active)
+        return self.done
+
+    def apply_commands(self, commands, active):
+        """Apply commands (see step) to robots, as commands_input.process_command."""
+        selected = lambda values: active[:, None] & ~numpy.isnan(values)
+        for command, attr in [("set-speed", "speed"),
+                              ("set-rotation-speed", "rotation"),
+                              ("set-turret-rotation-speed", "turret_rotation")]:
+            if command in commands:
+                values = numpy.asarray(commands[command], dtype=float)
+                setattr(self, attr, numpy.where(selected(values), values,
+                    getattr(self, attr)))
+        if "rotate-turret-to-angle-and-fire" in commands:
+            values = numpy.asarray(commands["rotate-turret-to-angle-and-fire"],
+                dtype=float)
+            mask = selected(values)
+            waiting = (self.time_to_fire != 0)
+            self.turret_final_angle = numpy.where(mask & waiting &
+                numpy.isnan(self.turret_final_angle), values, self.turret_final_angle)
+            self.fire_angle = numpy.where(mask & ~waiting &
+                numpy.isnan(self.fire_angle), values, self.fire_angle)
+        if "rotate-turret-to-angle" in commands:
+            values = numpy.asarray(commands["rotate-turret-to-angle"], dtype=float)
+            self.turret_final_angle = numpy.where(selected(values) &
+                numpy.isnan(self.turret_final_angle), values, self.turret_final_angle)
+        if "fire" in commands:
+            fire = active[:, None] & numpy.asarray(commands["fire"], dtype=bool)
+            self.fire(fire & (self.time_to_fire == 0))
+        self.apply_limits()
+
+    def apply_limits(self):
+        """Limit speeds of robots (see battlefield.apply_limits)."""
+        rc = self.config["robot"]
+        max_forward, max_backward = rc["max_speed"]
+        self.speed = numpy.maximum(numpy.minimum(self.speed, max_forward),
+            -max_backward)
+        self.rotation = numpy.maximum(numpy.minimum(self.rotation,
+            rc["rotation_max_speed"]), -rc["rotation_max_speed"])
+        max_fire_rot = rc["turret_rotation_max_speed"]
+        self.turret_rotation = numpy.maximum(numpy.minimum(self.turret_rotation,
+            max_fire_rot), -max_fire_rot)
+
+    def fire(self, mask, turret_angle=None):
+        """
+        Fire bullets from the turret of robots in mask (see fire_bullet).
+        
+        turret_angle, if given, replaces the turret angle of robots.
+        """
+        battles, origins = numpy.nonzero(mask)
+        if not len(battles):
+            return
+        turret_angle = (self.turret_angle if turret_angle is None else turret_angle)
+        x, y = self.x[mask], self.y[mask]
+        angle = self.angle[mask] + turret_angle[mask]
+        alpha = geometry.torad(angle)
+        cos, sin = numpy.cos(alpha), numpy.sin(alpha)
+        turret_length = self.height[mask] / 1.5
+        # Robots of a battle fire in order of name
+        ids = self.bullets_fired[battles] + numpy.where(origins == 1, 
+            mask[battles, 0], 0)
+        self.bullets_fired += mask.sum(1)
+        new = dict(battle=battles, origin=origins, id=ids,
+            x=x + turret_length * cos, y=y - turret_length * sin, angle=angle, 
+            speed=numpy.zeros(len(battles)) + self.config["robot"]["bullet_speed"],
+            cos=cos, sin=sin)
+        self.bullets = dict((name, numpy.concatenate([self.bullets[name],
+                new[name].astype(self.bullets[name].dtype)]))
+            for name in BULLET_COLUMNS)
+        self.time_to_fire = numpy.where(mask,
+            self.config["robot"]["fire_min_interval"], self.time_to_fire)
+
+    def process_turrets(self, active):
+        """Update turrets of robots (see battlefield.process_turret)."""
+        dt = self.delta_time
+        mask = active[:, None]
+        move_to_angle = numpy.where(numpy.isnan(self.fire_angle),
+            self.turret_final_angle, self.fire_angle)
+        has_target = mask & ~numpy.isnan(move_to_angle)
+        new_turret_angle = self.turret_angle + dt * self.turret_rotation
+        move_to = geometry.torad(move_to_angle)
+        move_cos, move_sin = numpy.cos(move_to), numpy.sin(move_to)
+        old = geometry.torad(self.angle + self.turret_angle)
+        old_direction = numpy.sign(numpy.cos(old) * move_sin -
+                                   numpy.sin(old) * move_cos)
+        new = geometry.torad(self.angle + new_turret_angle)
+        new_direction = numpy.sign(numpy.cos(new) * move_sin -
+                                   numpy.sin(new) * move_cos)
+        reached = has_target & (old_direction * new_direction < 0)
+        rotating = has_target & ~reached
+        fire = (reached & ~numpy.isnan(self.fire_angle) & (self.fire_angle != 0) &
+                (self.time_to_fire == 0))
+        old_turret_angle = self.turret_angle
+        max_speed = self.config["robot"]["turret_rotation_max_speed"]
+        self.turret_rotation = numpy.where(reached, 0.0, numpy.where(rotating,
+            max_speed * new_direction, self.turret_rotation))
+        new_turret_angle = numpy.where(reached, move_to_angle - self.angle,
+            new_turret_angle)
+        self.fire_angle = numpy.where(reached, numpy.nan, self.fire_angle)
+        self.turret_final_angle = numpy.where(reached, numpy.nan,
+            self.turret_final_angle)
+        self.turret_angle = numpy.where(mask,
+            geometry.normalize_angle(new_turret_angle), self.turret_angle)
+        time_to_fire = self.time_to_fire - dt
+        self.time_to_fire = numpy.where(mask & (self.time_to_fire != 0),
+            numpy.where(time_to_fire < 0, 0.0, time_to_fire), self.time_to_fire)
+        # Bullets are fired from the turret before it was updated
+        self.fire(fire, old_turret_angle)
+        self.apply_limits()
+
+    def process_bullets(self, active):
+        """Move bullets of active battles and remove those out of the map."""
+        bullets = self.bullets
+        width, height = self.config["map"]["size"]
+        moving = active[bullets["battle"]]
+        k = self.delta_time * bullets["speed"]
+        x = numpy.where(moving, bullets["x"] + k * bullets["cos"], bullets["x"])
+        y = numpy.where(moving, bullets["y"] - k * bullets["sin"], bullets["y"])
+        bullets["x"], bullets["y"] = x, y
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        self._select_bullets(inside | ~moving)
+
+    def move_robots(self, active):
+        """Move robots and resolve collisions (see move_robots_and_process_collisions)."""
+        width, height = self.config["map"]["size"]
+        dt = self.delta_time
+        w2, h2 = self.width / 2.0, self.height / 2.0
+        k = dt * self.speed
+        alpha = geometry.torad(self.angle)
+        x = self.x + k * numpy.cos(alpha)
+        x = numpy.where(x - w2 < 0, w2, numpy.where(x + w2 >= width, width - w2, x))
+        y = self.y - k * numpy.sin(alpha)
+        y = numpy.where(y < h2, h2, numpy.where(y + h2 >= height, height - h2, y))
+        angle = geometry.normalize_angle(self.angle + dt * self.rotation)
+        new_polygons = get_polygons(x, y, angle, self.width, self.height)
+        old_polygons = get_polygons(self.x, self.y, self.angle, self.width,
+            self.height)
+        def _polygon(polygons, column):
+            xs, ys = polygons
+            return xs[:, column], ys[:, column]
+        collide = active & check_collision_of_polygons(_polygon(new_polygons, 0),
+            _polygon(new_polygons, 1))
+        # Discard changes of the culprit (or both) as the scalar engine
+        keep_first = collide & ~check_collision_of_polygons(
+            _polygon(new_polygons, 0), _polygon(old_polygons, 1))
+        keep_second = collide & ~keep_first & ~check_collision_of_polygons(
+            _polygon(old_polygons, 0), _polygon(new_polygons, 1))
+        move = numpy.array([active & ~(collide & ~keep_first),
+                            active & ~(collide & ~keep_second)]).T
+        self.x = numpy.where(move, x, self.x)
+        self.y = numpy.where(move, y, self.y)
+        self.angle = numpy.where(move, angle, self.angle)
+
+    def process_hits(self, active):
+        """Check collisions of bullets with robots and remove dead robots."""
+        bullets = self.bullets
+        battles = bullets["battle"]
+        if not len(battles):
+            return
+        targets = 1 - bullets["origin"]
+        xs, ys = get_polygons(self.x, self.y, self.angle, self.width, self.height)
+        hit = active[battles] & check_points_in_polygons(bullets["x"], bullets["y"],
+            (xs[battles, targets], ys[battles, targets]))
+        if not hit.any():
+            return
+        numpy.subtract.at(self.shield, (battles[hit], targets[hit]), 1)
+        self.alive &= ~(self.shield <= 0)
+        self._select_bullets(~hit)
+
+    def _select_bullets(self, mask):
+        if not mask.all():
+            self.bullets = dict((name, values[mask])
+                for (name, values) in self.bullets.iteritems())
+
+def _get_value(value):
+    return (numpy.nan if value is None else value)
+
+def _get_attribute(value):
+    return (None if numpy.isnan(value) else float(value))
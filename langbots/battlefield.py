@@ -1,33 +1,49 @@
 #!/usr/bin/python
 import time
 import math
+import random
 import itertools
+import collections
 
 import yaml
 
 # App modules
 from langbots import lib
 from langbots import geometry
+from langbots import arrayfield
+from langbots import broadphase
 
 # Define struct types (using a class wrapper)
-Field = lib.struct("Field", ["config", "robots", "bullets", "battle_time"])
+Field = lib.struct("Field", ["config", "robots", "bullets", "battle_time", 
+                           "bullets_fired"])
 Robot = lib.struct("Robot", ["name", "x", "y", "width", "height", "speed", 
                              "rotation", "angle", "turret_rotation", 
                              "turret_angle", "shield", "time_to_fire", 
-                             "fire_angle", "turret_final_angle"])
-Bullet = lib.struct("Bullet", ["x", "y", "angle", "speed", "origin"])
-StateChange = lib.struct("StateChange", ["update_robots", "new_bullets"])
+                             "fire_angle", "turret_final_angle"], ["pose"])
+Bullet = lib.struct("Bullet", ["x", "y", "angle", "speed", "origin", "id"])
+StateChange = lib.struct("StateChange", ["update_robots", "new_bullets"], 
+                         immutable=True)
+Pose = lib.struct("Pose", ["x", "y", "angle", "turret_angle", "polygon", 
+                           "heading", "turret", "turret_tip"], immutable=True)
+Event = lib.struct("Event", ["type", "robot", "bullet"], immutable=True)
+
+# Attributes of robots and bullets visible to bots (see Battle.observe)
+ROBOT_STATE_ATTRIBUTES = ["x", "y", "angle", "rotation", "shield", "speed", 
+                          "time_to_fire", "turret_angle", "turret_rotation"]
+BULLET_STATE_ATTRIBUTES = ["x", "y", "angle", "speed"]
 
 class AbortBattle(Exception):
     pass
 
 def add_yaml_representers():
     def _object_representer(dumper, data):    
-        mapping = dict((k, getattr(data, k)) for k in data.__slots__)
+        mapping = lib.get_data_dict(data)
         return dumper.represent_mapping(data.__class__.__name__, mapping)
     yaml.add_representer(Field, _object_representer)
     yaml.add_representer(Robot, _object_representer)
     yaml.add_representer(Bullet, _object_representer)
+    yaml.add_representer(arrayfield.BulletArray, 
+        lambda dumper, data: dumper.represent_list(list(data)))
 
 def add_yaml_constructors():
     def object_constructor(loader, node):
@@ -47,35 +63,111 @@ def create_robot(**kwargs):
         time_to_fire=0.0, fire_angle=None, turret_final_angle=None)
     return Robot(**dict(default, **kwargs))
 
-def get_polygon_for_robot(robot):
-    """Get exact polygon (points) of robot with rotation.""" 
+def get_start_positions(config, seed, count=2):
+    """
+    Return list of count (x, y, angle) start positions of robots.
+
+    Seed 0 gives the default positions (see main), other seeds random
+    (non-overlapping) positions and angles.
+    """
+    screen_width, screen_height = config["map"]["size"]
+    robot_width, robot_height = config["robot"]["size"]
+    if not seed:
+        return [(screen_width / 2.0, (1 + 3*index) * screen_height / 5.0, 0.0)
+                for index in range(count)]
+    rnd = random.Random(seed)
+    diagonal = math.hypot(robot_width, robot_height)
+    positions = []
+    while len(positions) < count:
+        x = rnd.uniform(diagonal, screen_width - diagonal)
+        y = rnd.uniform(diagonal, screen_height - diagonal)
+        if all(math.hypot(x - x0, y - y0) > 2 * diagonal
+               for (x0, y0, angle0) in positions):
+            positions.append((x, y, rnd.uniform(-180.0, 180.0)))
+    return positions
+
+def clone_field(field):
+    """Return a copy of field (robots and bullets are cloned, config is shared)."""
+    return field.replace(robots=dict((name, robot.clone()) 
+            for (name, robot) in field.robots.iteritems()),
+        bullets=[bullet.clone() for bullet in field.bullets])
+
+def get_robots(robots):
+    """Return robots (a dictionary name: robot) as a list sorted by name."""
+    return [robot for (name, robot) in sorted(robots.iteritems())]
+
+def get_pose(robot):
+    """
+    Return the (cached) pose of robot: polygon, heading and turret vectors.
+
+    heading and turret are (cos, sin) pairs of the absolute angles. The pose 
+    is recalculated only when the position or angles of the robot change.
+    """
+    pose = robot.pose
+    if (pose is None or pose.x != robot.x or pose.y != robot.y or 
+            pose.angle != robot.angle or pose.turret_angle != robot.turret_angle):
+        pose = robot.pose = create_pose(robot)
+    return pose
+
+def create_pose(robot):
+    """Return a new Pose object for robot."""
+    x, y = robot.x, robot.y
+    alpha = geometry.torad(robot.angle)
+    cos, sin = math.cos(alpha), math.sin(alpha)
+    turret_alpha = geometry.torad(robot.angle + robot.turret_angle)
+    turret_cos, turret_sin = math.cos(turret_alpha), math.sin(turret_alpha)
+    # Half-sides of the body rectangle rotated by the robot angle
     w2 = robot.width / 2.0
     h2 = robot.height / 2.0
-    alpha = geometry.torad(-robot.angle)
-    dx2 = (w2*math.cos(alpha), -w2*math.sin(-alpha)) 
-    dy2 = (h2*math.sin(-alpha), h2*math.cos(alpha))
-    center = (robot.x, robot.y)
-    p1 = geometry.sum_vectors([center, geometry.invert_vector(dx2), 
-        geometry.invert_vector(dy2)])
-    p2 = geometry.sum_vectors([center, geometry.invert_vector(dx2), dy2])
-    p3 = geometry.sum_vectors([center, dx2, dy2])
-    p4 = geometry.sum_vectors([center, dx2, geometry.invert_vector(dy2)])
-    return [p1, p2, p3, p4]
+    wx, wy = w2*cos, w2*sin
+    hx, hy = h2*sin, h2*cos
+    polygon = [(x - wx - hx, y + wy - hy), (x - wx + hx, y + wy + hy),
+               (x + wx + hx, y - wy + hy), (x + wx - hx, y - wy - hy)]
+    turret_length = robot.height / 1.5
+    turret_tip = (x + turret_length * turret_cos, y - turret_length * turret_sin)
+    return Pose(x=x, y=y, angle=robot.angle, turret_angle=robot.turret_angle,
+        polygon=polygon, heading=(cos, sin), turret=(turret_cos, turret_sin),
+        turret_tip=turret_tip)
+
+def get_polygon_for_robot(robot):
+    """Get exact polygon (points) of robot with rotation.""" 
+    return get_pose(robot).polygon
 
 def fire_bullet(robot, field):
     """Create a bullet for robot with a given speed and add it field.bullets."""
     if robot.time_to_fire:
         return
-    absolute_angle = robot.angle + robot.turret_angle
-    turret_length = robot.height / 1.5
-    x = robot.x + turret_length * math.cos(geometry.torad(absolute_angle))
-    y = robot.y - turret_length * math.sin(geometry.torad(absolute_angle))
-    bullet = Bullet(x=x, y=y, angle=absolute_angle, origin=robot.name,
-        speed=field.config["robot"]["bullet_speed"])
+    x, y = get_pose(robot).turret_tip
+    bullet = Bullet(x=x, y=y, angle=robot.angle + robot.turret_angle, 
+        origin=robot.name, speed=field.config["robot"]["bullet_speed"])
     return bullet
 
-def check_bullet_collision(robots, bullet):
-    """Return robot that collides with bullet (None if no collision)."""
+def get_spatial_hash(config):
+    """Return an empty spatial hash with cells sized for the robots in config."""
+    robot_width, robot_height = config["robot"]["size"]
+    return broadphase.SpatialHash(config["map"]["size"], 
+        math.hypot(robot_width, robot_height))
+
+def fill_spatial_hash(spatial_hash, robots):
+    """Clear spatial hash and insert robots (by index) with their bounding box."""
+    spatial_hash.clear()
+    for index, robot in enumerate(robots):
+        radius = math.hypot(robot.width, robot.height) / 2.0
+        box = ((robot.x - radius, robot.y - radius), 
+               (robot.x + radius, robot.y + radius))
+        spatial_hash.insert(index, box)
+    return spatial_hash
+
+def check_bullet_collision(robots, bullet, spatial_hash=None):
+    """
+    Return robot that collides with bullet (None if no collision).
+    
+    If spatial_hash (filled with robots) is given, only robots near the 
+    bullet are tested.
+    """
+    if spatial_hash is not None:
+        indexes = spatial_hash.query_point((bullet.x, bullet.y))
+        robots = [robots[index] for index in indexes]
     for robot in robots:
         if bullet.origin == robot.name:
             continue            
@@ -84,17 +176,18 @@ def check_bullet_collision(robots, bullet):
             #lib.debug("collision: %s - %s" % (bullet, robot))
             return robot 
 
-def process_robot(robot, dt, screen_size):
+def process_robot(robot, dt, screen_size, in_place=False):
     """Get new robot position and rotation attributes for a time-delta."""
-    new_robot = lib.clone_struct(robot)
+    new_robot = (robot if in_place else lib.clone_struct(robot))
     screen_width, screen_height = screen_size            
     body_width, body_height = robot.width, robot.height
-    new_robot.x = robot.x + dt * robot.speed * math.cos(geometry.torad(robot.angle))
+    cos, sin = get_pose(robot).heading
+    new_robot.x = robot.x + dt * robot.speed * cos
     if new_robot.x - body_width/2.0 < 0:
         new_robot.x = body_width/2.0
     elif new_robot.x + body_width/2.0 >= screen_width:
         new_robot.x = screen_width - body_width/2.0
-    new_robot.y = robot.y - dt * robot.speed * math.sin(geometry.torad(robot.angle))
+    new_robot.y = robot.y - dt * robot.speed * sin
     if new_robot.y < body_height/2.0:
         new_robot.y = body_height/2.0
     elif new_robot.y + body_height/2.0 >= screen_height:
@@ -102,18 +195,19 @@ def process_robot(robot, dt, screen_size):
     new_robot.angle = geometry.normalize_angle(robot.angle + dt * robot.rotation)    
     return new_robot
 
-def process_turret(field, robot, dt):
+def process_turret(field, robot, dt, in_place=False):
     """Get new turret position and rotation attributes for a time-delta."""
-    new_robot = lib.clone_struct(robot)
+    new_robot = (robot if in_place else lib.clone_struct(robot))
     move_to_angle = lib.first([robot.fire_angle, robot.turret_final_angle], 
         pred=lambda x: x is not None)
     new_bullets = []    
     new_turret_angle = robot.turret_angle + dt * robot.turret_rotation
     if move_to_angle is not None:
-        old_direction = geometry.get_direction_for_rotation(
-            robot.angle + robot.turret_angle, move_to_angle)
-        new_direction = geometry.get_direction_for_rotation(
-            robot.angle + new_turret_angle, move_to_angle)
+        move_to_vector = geometry.get_unit_vector(move_to_angle)
+        old_direction = geometry.get_direction_for_vectors(
+            get_pose(robot).turret, move_to_vector)
+        new_direction = geometry.get_direction_for_vectors(
+            geometry.get_unit_vector(robot.angle + new_turret_angle), move_to_vector)
         if old_direction * new_direction < 0:
             new_robot.turret_rotation = 0.0
             if robot.fire_angle:
@@ -137,17 +231,28 @@ def process_turret(field, robot, dt):
     
     return StateChange(update_robots=[new_robot], new_bullets=new_bullets)
 
-def find_collision(robots):
-    """Return first collision between robots."""
-    for robot1, robot2 in itertools.combinations(robots, 2):
+def find_collision(robots, spatial_hash=None):
+    """
+    Return first collision between robots.
+    
+    If an (empty) spatial_hash is given, only pairs of near robots are tested.
+    """
+    if spatial_hash is not None and len(robots) > 2:
+        robots = list(robots)
+        fill_spatial_hash(spatial_hash, robots)
+        pairs = ((robots[index1], robots[index2]) 
+            for (index1, index2) in spatial_hash.get_pairs())
+    else:
+        pairs = itertools.combinations(robots, 2)
+    for robot1, robot2 in pairs:
         polygon1 = get_polygon_for_robot(robot1)
         polygon2 = get_polygon_for_robot(robot2)
         if geometry.check_collision_of_polygons(polygon1, polygon2):
             return robot1, robot2
 
-def process_bullet(bullet, dt, screen_size):
+def process_bullet(bullet, dt, screen_size, in_place=False):
     """Update bullet position for a delta_t."""
-    new_bullet = lib.clone_struct(bullet)
+    new_bullet = (bullet if in_place else lib.clone_struct(bullet))
     screen_width, screen_height = screen_size
     k = dt * bullet.speed
     new_bullet.x = bullet.x + k * math.cos(geometry.torad(bullet.angle))
@@ -156,6 +261,27 @@ def process_bullet(bullet, dt, screen_size):
             new_bullet.y >= 0 and new_bullet.y < screen_height):
         return new_bullet
 
+def process_bullets(bullets, dt, screen_size, in_place=False):
+    """Update bullets for a delta_t, return only those still in the screen."""
+    if isinstance(bullets, arrayfield.BulletArray):
+        bullets.advance(dt, screen_size)
+        return bullets
+    return lib.compact(process_bullet(bullet, dt, screen_size, in_place) 
+        for bullet in bullets)
+
+def process_robots(robots, dt, screen_size, vectorized=False, in_place=False):
+    """Return new robots moved for a delta_t (see process_robot)."""
+    if vectorized:
+        return arrayfield.process_robots(robots, dt, screen_size, in_place)
+    return [process_robot(robot, dt, screen_size, in_place) for robot in robots]
+
+def remove_bullets(bullets, removed):
+    """Return bullets without those in removed."""
+    if isinstance(bullets, arrayfield.BulletArray):
+        bullets.remove(removed)
+        return bullets
+    return lib.remove_from_list(bullets, removed)
+
 def apply_limits(robot, robot_config):
     """Fix limits in robot set in robot_config dictionary."""
     rc = robot_config
@@ -169,12 +295,14 @@ def apply_limits(robot, robot_config):
     robot.turret_rotation = max(robot.turret_rotation, -max_fire_rot)
     return robot
 
-def move_robots_and_process_collisions(robots, dt, map_size):
+def move_robots_and_process_collisions(robots, dt, map_size, vectorized=False,
+                                       spatial_hash=None):
     """Return a StateChange object with new robots position and collisions resolved."""
-    changes = dict((process_robot(robot, dt, map_size), robot) 
-                   for robot in robots.values())
+    old_robots = get_robots(robots)
+    new_robots = process_robots(old_robots, dt, map_size, vectorized)
+    changes = collections.OrderedDict(zip(new_robots, old_robots))
     while changes:
-        robots = find_collision(changes.keys())
+        robots = find_collision(changes.keys(), spatial_hash)
         if not robots:
             break
         # Robots collisions should not be frequent, so we can solve it
@@ -190,6 +318,77 @@ def move_robots_and_process_collisions(robots, dt, map_size):
             del changes[new_robot2]
     return StateChange(update_robots=changes.keys(), new_bullets=[])
 
+def move_robots_and_process_collisions_in_place(robots, dt, map_size, 
+                                                vectorized=False, spatial_hash=None):
+    """
+    Move robots in-place and resolve collisions.
+    
+    Same algorithm than move_robots_and_process_collisions, but only the 
+    previous position of robots is saved to roll back those that collide.
+    """
+    moved = get_robots(robots)
+    previous = dict((robot.name, (robot.x, robot.y, robot.angle)) for robot in moved)
+    process_robots(moved, dt, map_size, vectorized, in_place=True)
+    def _get_previous(robot):
+        x, y, angle = previous[robot.name]
+        return robot.replace(x=x, y=y, angle=angle)
+    def _restore(robot):
+        robot.x, robot.y, robot.angle = previous[robot.name]
+        moved.remove(robot)
+    while moved:
+        robots = find_collision(moved, spatial_hash)
+        if not robots:
+            break
+        robot1, robot2 = robots
+        if not find_collision([robot1, _get_previous(robot2)]):
+            _restore(robot2)
+        elif not find_collision([_get_previous(robot1), robot2]):
+            _restore(robot1)
+        else:
+            _restore(robot1)
+            _restore(robot2)
+    return StateChange(update_robots=moved, new_bullets=[])
+
+def get_quiet_time(field):
+    """
+    Return a lower bound of the time until a robot may collide with another
+    robot or be hit by a bullet if no commands are applied (None if never).
+
+    Robots are bounded by circles and keep their speeds. Bullets that robots
+    with a pending fire_angle may fire (see process_turret) are included. 
+    """
+    robots = get_robots(field.robots)
+    screen_width, screen_height = field.config["map"]["size"]
+    bullet_speed = field.config["robot"]["bullet_speed"]
+    radius = dict((robot.name, math.hypot(robot.width, robot.height) / 2.0)
+        for robot in robots)
+    times = []
+    def _add(distance, speed):
+        if distance <= 0:
+            times.append(0.0)
+        elif speed > 0:
+            times.append(distance / speed)
+    for robot in robots:
+        if not (robot.width / 2.0 <= robot.x <= screen_width - robot.width / 2.0 and
+                robot.height / 2.0 <= robot.y <= screen_height - robot.height / 2.0):
+            # Robots out of limits jump when moved
+            return 0.0
+    for robot1, robot2 in itertools.combinations(robots, 2):
+        distance = math.hypot(robot1.x - robot2.x, robot1.y - robot2.y)
+        _add(distance - radius[robot1.name] - radius[robot2.name],
+             abs(robot1.speed) + abs(robot2.speed))
+    for robot in robots:
+        for bullet in field.bullets:
+            if bullet.origin != robot.name:
+                _add(math.hypot(bullet.x - robot.x, bullet.y - robot.y) - 
+                     radius[robot.name], bullet.speed + abs(robot.speed))
+        for shooter in robots:
+            if shooter is not robot and shooter.fire_angle is not None:
+                distance = math.hypot(shooter.x - robot.x, shooter.y - robot.y)
+                _add(distance - shooter.height / 1.5 - radius[robot.name],
+                     bullet_speed + abs(shooter.speed) + abs(robot.speed))
+    return (min(times) if times else None)
+
 def apply_state_change(field, state_change):
     """UPDATE: Apply state changes to field.robots and field.bullets."""
     if not state_change:
@@ -200,83 +399,281 @@ def apply_state_change(field, state_change):
             apply_limits(new_robot, field.config["robot"]) 
     for bullet in state_change.new_bullets:
         if bullet:
+            # Bullets get a unique id (number of bullets fired in the battle)
+            bullet.id = field.bullets_fired or 0
+            field.bullets_fired = bullet.id + 1
             field.bullets.append(bullet) 
             field.robots[bullet.origin].time_to_fire = \
                 field.config["robot"]["fire_min_interval"]
       
-def play(battle_stream, draw_callbacks):
-    """Replay a saved battle."""
-    itime = time.time()
-    def get_battle_time():
-        return time.time() - itime
-    while 1:
-        field = read_yaml_block(battle_stream)
-        if not field:
-            break
-        while field.battle_time > get_battle_time():
-            time.sleep(0.005)
-        for draw_callback in draw_callbacks:
-            draw_callback(field)
+def play(stream, draw_callbacks, speed=1.0):
+    """Replay a saved battle (binary replay or YAML dump, see replay.Player)."""
+    from langbots import replay
+    player = replay.Player(replay.open_replay(stream), draw_callbacks, speed)
+    return player.play()
 
-# This is the only "impure" function allowed to change state of field 
-def run(field, input_callbacks, draw_callbacks, delta_time=None):
+# Battle is the only "impure" code allowed to change state of field 
+class Battle(object):
     """
-    Run main battlefield loop: input + update + draw callbacks.
+    A battle that is stepped from external code (see run).
     
-    Return the robot which won the battle (may be None). 
-    """
-    battle_start = time.time()
-    itime = battle_start
-    map_size = field.config["map"]["size"]
-    field.battle_time = 0.0
+    The battle updates field (in-place). Each step processes the commands 
+    of robots (in order of name), advances the battle a delta_time (real 
+    time if not given) and returns (observations, events, done):
     
-    while len(field.robots) > 1:
-        # Draw
-        for draw_callback in draw_callbacks:
-            draw_callback(field)
+      observations: dictionary {robot_name: observation} for living robots 
+        (see observe).
+      events: list of Event (type, robot, bullet id): "fire", "exit" (a 
+        bullet left the map), "hit" and "destroyed" (robot).
+      done: True when only one robot (or none) is left.
+    """
+    def __init__(self, field, delta_time=None, in_place=False):
+        self.initial_field = clone_field(field)
+        self.delta_time = delta_time
+        self.in_place = in_place
+        self.spatial_hash = get_spatial_hash(field.config)
+        self._start(field)
+
+    def _start(self, field):
+        self.field = field
+        self.field.battle_time = 0.0
+        self.vectorized = arrayfield.is_array_field(field)
+        self.battle_start = self.itime = time.time()
+        self.bullets_fired = field.bullets_fired or 0
+
+    def reset(self, seed=None):
+        """
+        Restart the battle from the initial field and return observations.
+
+        With a seed, robots (in order of name) are placed on the start 
+        positions for the seed (see get_start_positions).
+        """
+        field = clone_field(self.initial_field)
+        if self.vectorized:
+            arrayfield.use_arrays(field, Bullet)
+        if seed is not None:
+            robots = get_robots(field.robots)
+            positions = get_start_positions(field.config, seed, len(robots))
+            for robot, (x, y, angle) in zip(robots, positions):
+                robot.x, robot.y, robot.angle = x, y, angle
+        self._start(field)
+        return self.observe()
+
+    def clone(self):
+        """Return an independent copy of the battle (in the same state)."""
+        battle = object.__new__(Battle)
+        battle.__dict__.update(self.__dict__)
+        battle.field = clone_field(self.field)
+        if self.vectorized:
+            arrayfield.use_arrays(battle.field, Bullet)
+        battle.spatial_hash = get_spatial_hash(self.field.config)
+        return battle
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["spatial_hash"]
+        # Real-time clocks are saved as elapsed times
+        now = time.time()
+        state["battle_start"] = now - self.battle_start
+        state["itime"] = now - self.itime
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        now = time.time()
+        self.battle_start = now - state["battle_start"]
+        self.itime = now - state["itime"]
+        self.spatial_hash = get_spatial_hash(self.field.config)
+
+    @property
+    def done(self):
+        return len(self.field.robots) <= 1
+
+    @property
+    def winner(self):
+        """Return the robot which won the battle (may be None)."""
+        robots = self.field.robots
+        return (robots.values()[0] if len(robots) == 1 else None)
+
+    def observe(self):
+        """
+        Return dictionary {robot_name: observation} of living robots.
+
+        An observation is a dictionary with the state a bot gets: time, me,
+        others (dictionaries of ROBOT_STATE_ATTRIBUTES) and bullets 
+        (dictionaries of BULLET_STATE_ATTRIBUTES). Dictionaries are shared
+        between observations, do not modify them.
+        """
+        field = self.field
+        robots = [(robot.name, lib.get_data_dict(robot, 
+            accept=ROBOT_STATE_ATTRIBUTES)) for robot in get_robots(field.robots)]
+        bullets = [lib.get_data_dict(bullet, accept=BULLET_STATE_ATTRIBUTES)
+            for bullet in field.bullets]
+        return dict((name, {"time": field.battle_time, "me": data, 
+                "others": [other for (other_name, other) in robots 
+                           if other_name != name], 
+                "bullets": bullets})
+            for (name, data) in robots)
+
+    def step(self, commands_by_robot=None):
+        """
+        Apply commands and advance the battle one step.
         
-        ### Input         
-        for robot_name, input_callback in input_callbacks.iteritems():
-            if robot_name in field.robots:
-                robot = field.robots[robot_name]
-                state_changes = input_callback(itime, field, robot)
-                for state_change in (state_changes or []):
-                    apply_state_change(field, state_change)
+        commands_by_robot is a dictionary {robot_name: commands}, commands 
+        as returned by in-process bots (see inputmods/python_input).
+        """
+        # Imported here, input modules depend on this module
+        from langbots.inputmods import commands_input, python_input
+        for robot_name, commands in sorted((commands_by_robot or {}).iteritems()):
+            for command in python_input.get_commands(commands):
+                robot = self.field.robots.get(robot_name)
+                if robot:
+                    self.apply(commands_input.process_command(self.field, 
+                        robot, command))
+        events = []
+        self.advance(events)
+        return self.observe(), events, self.done
+    
+    def skip(self, ticks):
+        """
+        Advance ticks time-deltas, with the same results than calling
+        advance ticks times (delta_time must be fixed). Return the number of
+        ticks advanced (less than ticks if the battle is done), no events.
 
-        ### Update                
-        if delta_time:
-            dt = delta_time
+        While no robot can collide with another robot or be hit by a bullet
+        (see get_quiet_time) ticks only move turrets, bullets and robots.
+        """
+        if not self.delta_time:
+            raise ValueError, "time skipping needs a fixed delta time"
+        advanced = 0
+        while advanced < ticks and not self.done:
+            quiet_time = get_quiet_time(self.field)
+            # One tick of margin for rounding errors
+            quiet_ticks = (ticks - advanced if quiet_time is None else 
+                min(ticks - advanced, int(quiet_time / self.delta_time) - 1))
+            if quiet_ticks > 0:
+                for tick in xrange(quiet_ticks):
+                    self._advance_quiet()
+                self.bullets_fired = self.field.bullets_fired or 0
+                advanced += quiet_ticks
+            else:
+                self.advance()
+                advanced += 1
+        return advanced
+
+    def _advance_quiet(self):
+        """Advance a time-delta when no collisions can happen (in-place)."""
+        field = self.field
+        dt = self.delta_time
+        map_size = field.config["map"]["size"]
+        field.battle_time += dt
+        for robot in get_robots(field.robots):
+            apply_state_change(field, process_turret(field, robot, dt, in_place=True))
+        field.bullets = process_bullets(field.bullets, dt, map_size, in_place=True)
+        process_robots(get_robots(field.robots), dt, map_size, self.vectorized,
+            in_place=True)
+
+    def apply(self, state_change):
+        """Apply a state change to the field."""
+        apply_state_change(self.field, state_change)
+
+    def advance(self, events=None):
+        """
+        Advance the battle a time-delta (update phase). 
+        
+        If a list events is given, events of the step are appended to it.
+        """
+        field = self.field
+        map_size = field.config["map"]["size"]
+        spatial_hash = self.spatial_hash
+        if self.delta_time:
+            dt = self.delta_time
             field.battle_time += dt
         else:
             new_time = time.time()
-            dt, itime = (new_time - itime), new_time
-            field.battle_time = new_time - battle_start
+            dt, self.itime = (new_time - self.itime), new_time
+            field.battle_time = new_time - self.battle_start
 
         # Update turrets
-        for robot in field.robots.itervalues():
-            state_changes = process_turret(field, robot, dt)
+        for robot in get_robots(field.robots):
+            state_changes = process_turret(field, robot, dt, self.in_place)
             apply_state_change(field, state_changes)
                             
         # Update bullets
-        field.bullets = lib.compact(process_bullet(bullet, dt, map_size)
-            for bullet in field.bullets)
+        if events is not None:
+            previous_ids = set(bullet.id for bullet in field.bullets)
+            events.extend(Event(type="fire", robot=bullet.origin, bullet=bullet.id)
+                for bullet in field.bullets if bullet.id >= self.bullets_fired)
+        self.bullets_fired = field.bullets_fired or 0
+        field.bullets = process_bullets(field.bullets, dt, map_size, self.in_place)
+        if events is not None:
+            left = previous_ids.difference(bullet.id for bullet in field.bullets)
+            events.extend(Event(type="exit", bullet=id) for id in sorted(left))
                             
         # Update position of robots with control of collisions
-        state_change = move_robots_and_process_collisions(field.robots, dt, map_size)
+        move_robots = (move_robots_and_process_collisions_in_place 
+            if self.in_place else move_robots_and_process_collisions)
+        state_change = move_robots(field.robots, dt, map_size, self.vectorized, 
+            spatial_hash)
         apply_state_change(field, state_change)
                   
-        # Check collision between bullets and robots
+        # Check collision between bullets and robots (on the columns of 
+        # array-backed bullets, see arrayfield.BulletArray.get_collisions)
         def _get_collisions():
+            robots = get_robots(field.robots)
+            if isinstance(field.bullets, arrayfield.BulletArray):
+                return field.bullets.get_collisions(robots, 
+                    map(get_polygon_for_robot, robots))
+            fill_spatial_hash(spatial_hash, robots)
+            collisions = []
             for bullet in field.bullets:
-                robot = check_bullet_collision(field.robots.values(), bullet)
+                robot = check_bullet_collision(robots, bullet, spatial_hash)
                 if robot:
-                    yield (bullet, robot)
-        collisions = dict(_get_collisions())
-        for bullet, robot in collisions.iteritems():
+                    collisions.append((bullet, robot))
+            return collisions
+        collisions = _get_collisions()
+        for bullet, robot in collisions:
             robot.shield -= 1
-            if robot.shield <= 0: 
+            if events is not None:
+                events.append(Event(type="hit", robot=robot.name, bullet=bullet.id))
+            if robot.shield <= 0 and robot.name in field.robots: 
                 # Robot is dead
                 del field.robots[robot.name]
-        field.bullets = lib.remove_from_list(field.bullets, collisions.keys())
+                if events is not None:
+                    events.append(Event(type="destroyed", robot=robot.name))
+        field.bullets = remove_bullets(field.bullets, 
+            [bullet for (bullet, robot) in collisions])
+
+def run(field, input_callbacks, draw_callbacks, delta_time=None, in_place=False):
+    """
+    Run main battlefield loop: input + update + draw callbacks.
+    
+    If field uses the array-backed representation (see arrayfield.use_arrays), 
+    bullets and robots are integrated with vectorized (NumPy) operations.
+    With in_place, robots and bullets are updated in-place instead of 
+    being replaced by new objects every tick (same results).
+    
+    Robots and input callbacks are processed in order of robot name, so with 
+    a fixed delta_time the same inputs always give the same battle (see 
+    commandlog).
+    
+    Return the robot which won the battle (may be None). 
+    """
+    battle = Battle(field, delta_time, in_place)
+    while not battle.done:
+        # Draw
+        for draw_callback in draw_callbacks:
+            draw_callback(field)
+        
+        ### Input         
+        for robot_name, input_callback in sorted(input_callbacks.iteritems()):
+            if robot_name in field.robots:
+                robot = field.robots[robot_name]
+                state_changes = input_callback(battle.itime, field, robot)
+                for state_change in (state_changes or []):
+                    battle.apply(state_change)
+
+        ### Update                
+        battle.advance()
             
     return field.robots and field.robots.values()[0]
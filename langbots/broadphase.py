@@ -0,0 +1,51 @@
+#!/usr/bin/python
+import math
+
+class SpatialHash(object):
+    """
+    Uniform grid over the map used as collisions broadphase.
+
+    Items (usually indexes in a list of robots) are inserted with their
+    bounding box and stored in all the cells it overlaps. Only items sharing
+    a cell may collide, so the narrow-phase tests (in geometry) are run only
+    for those. Positions out of the map are clamped to the border cells.
+    """
+    def __init__(self, map_size, cell_size):
+        width, height = map_size
+        self.cell_size = float(cell_size)
+        self.columns = max(1, int(math.ceil(width / self.cell_size)))
+        self.rows = max(1, int(math.ceil(height / self.cell_size)))
+        self.cells = {}
+
+    def clear(self):
+        """Remove all items."""
+        self.cells = {}
+
+    def _get_cell_coordinates(self, x, y):
+        column = min(max(int(x // self.cell_size), 0), self.columns - 1)
+        row = min(max(int(y // self.cell_size), 0), self.rows - 1)
+        return column, row
+
+    def insert(self, item, box):
+        """Insert item with bounding box ((xmin, ymin), (xmax, ymax))."""
+        (xmin, ymin), (xmax, ymax) = box
+        column1, row1 = self._get_cell_coordinates(xmin, ymin)
+        column2, row2 = self._get_cell_coordinates(xmax, ymax)
+        for row in xrange(row1, row2 + 1):
+            for column in xrange(column1, column2 + 1):
+                self.cells.setdefault(row * self.columns + column, []).append(item)
+
+    def query_point(self, point):
+        """Return items (in insertion order) whose cells contain point."""
+        column, row = self._get_cell_coordinates(*point)
+        return self.cells.get(row * self.columns + column, [])
+
+    def get_pairs(self):
+        """Return sorted list of pairs (item1, item2) of items sharing a cell."""
+        pairs = set()
+        for items in self.cells.itervalues():
+            if len(items) > 1:
+                for index, item1 in enumerate(items):
+                    for item2 in items[index+1:]:
+                        pairs.add((item1, item2))
+        return sorted(pairs)
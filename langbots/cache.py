@@ -0,0 +1,111 @@
+#!/usr/bin/python
+import os
+import json
+import hashlib
+
+# Third-party modules
+import yaml
+
+# Modules whose source defines the result of a battle (and its replay file)
+ENGINE_MODULES = ["lib", "geometry", "broadphase", "arrayfield", "battlefield",
+                  "inputmods/commands_input", "commandlog", "replay"]
+
+# Results are evicted down to this fraction of the maximum size of a cache
+EVICT_RATIO = 0.9
+
+def get_file_hash(path):
+    """Return SHA-1 (hex) of the contents of a file."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as stream:
+        for data in iter(lambda: stream.read(1<<16), ""):
+            digest.update(data)
+    return digest.hexdigest()
+
+def get_engine_version():
+    """Return version of the engine (hash of the source of ENGINE_MODULES)."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha1()
+    for module in ENGINE_MODULES:
+        digest.update(get_file_hash(os.path.join(directory, module + ".py")))
+    return digest.hexdigest()
+
+def get_key(data):
+    """Return key (hex) for data (JSON-serializable)."""
+    return hashlib.sha1(json.dumps(data, sort_keys=True)).hexdigest()
+
+class ResultCache(object):
+    """
+    Content-addressed cache of results stored in a local directory.
+
+    Each result is a YAML file named by its key. When the total size
+    exceeds max_size (bytes), least recently used results are removed down
+    to EVICT_RATIO of max_size. The total size is scanned on the first put
+    and then kept as results are stored, so the directory is only listed
+    again when it has to be evicted.
+    """
+    def __init__(self, directory, max_size=64<<20):
+        self.directory = directory
+        self.max_size = max_size
+        self.size = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key + ".yml")
+
+    def get(self, key):
+        """Return data stored for key (None if not found)."""
+        path = self._get_path(key)
+        try:
+            with open(path) as stream:
+                data = yaml.safe_load(stream.read())
+        except (IOError, yaml.YAMLError):
+            return
+        # Modification time is used as last access time (see evict)
+        os.utime(path, None)
+        return data
+
+    def put(self, key, data):
+        """Store data (YAML-serializable) for key."""
+        path = self._get_path(key)
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        contents = yaml.safe_dump(data, default_flow_style=False)
+        with open(temp_path, "w") as stream:
+            stream.write(contents)
+        try:
+            old_size = os.stat(path).st_size
+        except OSError:
+            old_size = 0
+        os.rename(temp_path, path)
+        if self.size is not None:
+            self.size += len(contents) - old_size
+        if self.size is None or self.size > self.max_size:
+            self.evict()
+
+    def get_entries(self):
+        """Return list of (last access time, size, path) of stored results."""
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".yml"):
+                path = os.path.join(self.directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Remove least recently used results if size is over max_size."""
+        entries = sorted(self.get_entries())
+        size = sum(entry_size for (mtime, entry_size, path) in entries)
+        target_size = (self.max_size * EVICT_RATIO 
+                       if size > self.max_size else size)
+        while entries and size > target_size:
+            mtime, entry_size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= entry_size
+        self.size = size
@@ -0,0 +1,194 @@
+#!/usr/bin/python
+import os
+import sys
+import math
+
+# Third-party modules (optional, only needed for columnar export)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# App modules
+from langbots import geometry
+from langbots import battlefield
+from langbots import replay
+from langbots import compression
+
+# Columns of a battle (arrays indexed by tick, robots are columns of the 2D
+# robot arrays in the order of robot_names, NaN when the robot is dead):
+#
+#   time, robot_names, robot_x, robot_y, robot_angle, robot_turret_angle,
+#   robot_shield,
+#   spawn_id, spawn_tick, spawn_time, spawn_x, spawn_y, spawn_angle,
+#   spawn_speed, spawn_origin (index in robot_names),
+#   despawn_id, despawn_tick, despawn_time, despawn_x, despawn_y (last
+#   position seen), despawn_hit (False if the bullet left the map)
+#
+# Bullets removed in the tick they were fired (never seen in a frame, i.e.
+# point-blank hits) are spawned and despawned on the same tick with NaN
+# position. Their origin is the robot whose time_to_fire was reset on that
+# tick (-1 if it can't be told, i.e. the shooter died on the same tick) and
+# hit is estimated from its turret tip on the previous frame (True when the
+# origin is unknown).
+#
+# Saved as a .npz file or a directory of .npy files (which can be
+# memory-mapped, see load).
+
+ROBOT_COLUMNS = ["x", "y", "angle", "turret_angle", "shield"]
+SPAWN_COLUMNS = ["id", "tick", "time", "x", "y", "angle", "speed", "origin"]
+DESPAWN_COLUMNS = ["id", "tick", "time", "x", "y", "hit"]
+INTEGER_COLUMNS = ["spawn_id", "spawn_tick", "spawn_origin", "despawn_id",
+                   "despawn_tick"]
+
+def check_numpy():
+    """Raise ImportError if NumPy is not available."""
+    if numpy is None:
+        raise ImportError, "columnar export needs the numpy module"
+
+class ColumnarWriter(object):
+    """Collect fields (frames of a battle) as columns."""
+    def __init__(self):
+        check_numpy()
+        self.robot_names = None
+        self.map_size = None
+        self.time = []
+        self.robots = dict((name, []) for name in ROBOT_COLUMNS)
+        self.spawn = dict((name, []) for name in SPAWN_COLUMNS)
+        self.despawn = dict((name, []) for name in DESPAWN_COLUMNS)
+        self.bullets = {}
+        self.bullets_fired = 0
+        self.previous_robots = {}
+
+    def write(self, field):
+        """Add a frame."""
+        if self.robot_names is None:
+            self.robot_names = sorted(field.robots)
+            self.map_size = field.config["map"]["size"]
+        tick = len(self.time)
+        dt = (field.battle_time - self.time[-1] if self.time else 0.0)
+        self.time.append(field.battle_time)
+        nan = float("nan")
+        for name in ROBOT_COLUMNS:
+            self.robots[name].append([(getattr(field.robots[robot_name], name)
+                if robot_name in field.robots else nan)
+                for robot_name in self.robot_names])
+        bullets = {}
+        seen = set(bullet.id for bullet in field.bullets)
+        new_ids = range(self.bullets_fired, field.bullets_fired or 0)
+        # Robots fire (and get new bullet ids) in order of name
+        shooters = [name for name in self.robot_names 
+            if name in field.robots and name in self.previous_robots and
+            field.robots[name].time_to_fire > self.previous_robots[name].time_to_fire]
+        origins = (dict(zip(new_ids, shooters))
+                   if len(shooters) == len(new_ids) else {})
+        for id in new_ids:
+            if id not in seen:
+                # Bullets are fired with the state of the robot before the tick
+                robot = self.previous_robots.get(origins.get(id))
+                bullet_speed = field.config["robot"]["bullet_speed"]
+                hit = (self.is_hit(battlefield.get_pose(robot).turret_tip,
+                    robot.angle + robot.turret_angle, bullet_speed, dt)
+                    if robot else True)
+                values = dict(id=id, tick=tick, time=field.battle_time, x=nan,
+                    y=nan, angle=nan, speed=nan, hit=hit,
+                    origin=(self.robot_names.index(robot.name) if robot else -1))
+                for name in SPAWN_COLUMNS:
+                    self.spawn[name].append(values[name])
+                for name in DESPAWN_COLUMNS:
+                    self.despawn[name].append(values[name])
+        self.bullets_fired = field.bullets_fired or 0
+        self.previous_robots = dict((name, robot.clone())
+            for (name, robot) in field.robots.iteritems())
+        for bullet in field.bullets:
+            if bullet.id is None:
+                raise ValueError, "columnar export needs bullets with id"
+            bullets[bullet.id] = bullet
+            if bullet.id not in self.bullets:
+                values = dict(id=bullet.id, tick=tick, time=field.battle_time,
+                    x=bullet.x, y=bullet.y, angle=bullet.angle, speed=bullet.speed,
+                    origin=self.robot_names.index(bullet.origin))
+                for name in SPAWN_COLUMNS:
+                    self.spawn[name].append(values[name])
+        for id in sorted(set(self.bullets) - set(bullets)):
+            bullet = self.bullets[id]
+            values = dict(id=id, tick=tick, time=field.battle_time, x=bullet.x,
+                y=bullet.y, hit=self.is_hit((bullet.x, bullet.y), bullet.angle,
+                bullet.speed, dt))
+            for name in DESPAWN_COLUMNS:
+                self.despawn[name].append(values[name])
+        self.bullets = bullets
+
+    def is_hit(self, position, angle, speed, dt):
+        """Return True if a removed bullet would still be inside the map (hit a robot)."""
+        x, y = position
+        k = dt * speed
+        x += k * math.cos(geometry.torad(angle))
+        y -= k * math.sin(geometry.torad(angle))
+        width, height = self.map_size
+        return (0 <= x < width and 0 <= y < height)
+
+    def get_columns(self):
+        """Return dictionary {column_name: array}."""
+        columns = {"time": numpy.array(self.time, dtype=float),
+                   "robot_names": numpy.array(self.robot_names or [])}
+        nrobots = len(self.robot_names or [])
+        for name, values in self.robots.iteritems():
+            columns["robot_" + name] = numpy.array(values, dtype=float).reshape(
+                len(self.time), nrobots)
+        for prefix, events in [("spawn", self.spawn), ("despawn", self.despawn)]:
+            for name, values in events.iteritems():
+                key = prefix + "_" + name
+                dtype = (int if key in INTEGER_COLUMNS else
+                         bool if key == "despawn_hit" else float)
+                columns[key] = numpy.array(values, dtype=dtype)
+        return columns
+
+    def save(self, path):
+        """Save columns to path (.npz file or directory of .npy files)."""
+        save_columns(self.get_columns(), path)
+
+def save_columns(columns, path):
+    if path.endswith(".npz"):
+        numpy.savez(path, **columns)
+        return
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for name, array in columns.iteritems():
+        numpy.save(os.path.join(path, name + ".npy"), array)
+
+def load(path, mmap=True):
+    """
+    Return dictionary {column_name: array} for a saved battle.
+
+    Directories of .npy files are memory-mapped (unless mmap is False), so
+    columns are only read from disk when accessed.
+    """
+    check_numpy()
+    if path.endswith(".npz"):
+        data = numpy.load(path)
+        return dict((name, data[name]) for name in data.files)
+    mmap_mode = ("r" if mmap else None)
+    return dict((filename[:-len(".npy")],
+                 numpy.load(os.path.join(path, filename), mmap_mode=mmap_mode))
+                for filename in os.listdir(path) if filename.endswith(".npy"))
+
+def export_replay(battle_replay, path):
+    """Export a replay (see replay.open_replay) to path."""
+    writer = ColumnarWriter()
+    for field in battle_replay:
+        writer.write(field)
+    writer.save(path)
+
+def main(args):
+    """Export replay files (binary, YAML dump, compressed) to columnar files."""
+    if len(args) != 2:
+        sys.stderr.write("usage: columnar.py REPLAY OUTPUT(.npz|directory)\n")
+        return 2
+    battlefield.add_yaml_constructors()
+    replay_path, output_path = args
+    export_replay(replay.open_replay(compression.open_file(replay_path)),
+        output_path)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
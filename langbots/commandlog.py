@@ -0,0 +1,131 @@
+#!/usr/bin/python
+import time
+
+# Third-party modules
+import yaml
+
+# App modules
+from langbots import battlefield
+from langbots.inputmods import commands_input
+
+# A command log stores the initial field, the (fixed) delta time and the
+# commands processed for each robot, so the battle can be re-simulated
+# (battlefield.run is deterministic for a fixed delta time). Format:
+#
+#   # langbots command log
+#   YAML block {"delta_time": ..., "field": Field} followed by an empty line
+#   one line per command: battle_time robot_name command [args]
+
+HEADER = "# langbots command log\n"
+
+def is_command_log(stream):
+    """Return True if stream (seekable) contains a command log."""
+    position = stream.tell()
+    header = stream.readline()
+    stream.seek(position)
+    return header == HEADER
+
+class CommandLogWriter(object):
+    """Write the commands of a battle to a command log stream."""
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write_header(self, field, delta_time):
+        """Write initial field and delta time (call it before the battle starts)."""
+        if not delta_time:
+            raise ValueError, "command logs need a fixed delta time"
+        data = yaml.dump({"delta_time": delta_time, "field": field},
+            default_flow_style=False)
+        self.stream.write(HEADER + data.strip() + "\n\n")
+
+    def write(self, field, robot_name, command):
+        """Write command (list of strings) processed for robot on this loop."""
+        self.stream.write(" ".join([repr(field.battle_time), robot_name] +
+            command) + "\n")
+
+    def close(self):
+        self.stream.close()
+
+def read_command_log(stream):
+    """
+    Read a command log and return tuple (field, delta_time, commands).
+
+    commands is a dictionary {(battle_time, robot_name): [command, ...]}.
+    """
+    if stream.readline() != HEADER:
+        raise ValueError, "not a command log"
+    header = battlefield.read_yaml_block(stream)
+    commands = {}
+    for line in stream:
+        spline = line.split()
+        if spline:
+            battle_time, robot_name, command = float(spline[0]), spline[1], spline[2:]
+            commands.setdefault((battle_time, robot_name), []).append(command)
+    return header["field"], header["delta_time"], commands
+
+def get_input_callback(robot_name, commands):
+    """Return an input callback that replays the commands logged for robot."""
+    def _input_callback(loop_id, field, new_robot):
+        for command in commands.get((field.battle_time, robot_name), []):
+            yield commands_input.process_command(field, new_robot, list(command))
+    return _input_callback
+
+def play(field, delta_time, commands, draw_callbacks, realtime=True, speed=1.0,
+         start_time=None, start_tick=None):
+    """
+    Re-simulate a battle (see read_command_log) and return the winner.
+
+    With realtime, frames are drawn at speed times the pace of the battle.
+    Frames before start_time (or frame number start_tick) are simulated but
+    not drawn.
+    """
+    input_callbacks = dict((robot_name, get_input_callback(robot_name, commands))
+        for robot_name in field.robots)
+    state = {"tick": -1}
+    def _draw(field):
+        state["tick"] += 1
+        if (start_time is not None and field.battle_time < start_time or
+                start_tick is not None and state["tick"] < start_tick):
+            return
+        if realtime:
+            state.setdefault("start", (time.time(), field.battle_time))
+            start_clock, start_battle_time = state["start"]
+            delay = ((field.battle_time - start_battle_time) / speed - 
+                     (time.time() - start_clock))
+            if delay > 0:
+                time.sleep(delay)
+        for draw_callback in draw_callbacks:
+            draw_callback(field)
+    return battlefield.run(field, input_callbacks, [_draw], delta_time)
+
+def simulate(field, delta_time, commands, max_time=None):
+    """
+    Re-simulate a battle headless and return the winner (None on max_time).
+
+    Time is skipped between logged commands (see battlefield.Battle.skip),
+    with the same results than play.
+    """
+    battle = battlefield.Battle(field, delta_time)
+    times = sorted(set(battle_time for (battle_time, robot_name) in commands
+        if max_time is None or battle_time < max_time))
+    if max_time is not None:
+        times.append(max_time)
+    index = 0
+    while not battle.done:
+        if max_time is not None and field.battle_time >= max_time:
+            return
+        for robot_name in sorted(field.robots):
+            for command in commands.get((field.battle_time, robot_name), []):
+                battle.apply(commands_input.process_command(field, 
+                    field.robots[robot_name], list(command)))
+        while index < len(times) and times[index] <= field.battle_time:
+            index += 1
+        if index == len(times):
+            battle.skip(1000)
+            continue
+        # Battle time is accumulated, count the ticks to the next command
+        ticks, battle_time = 1, field.battle_time + delta_time
+        while battle_time < times[index]:
+            ticks, battle_time = ticks + 1, battle_time + delta_time
+        battle.skip(ticks)
+    return battle.winner
@@ -0,0 +1,223 @@
+#!/usr/bin/python
+import bz2
+import zlib
+import struct
+import bisect
+
+# Third-party modules (optional, only needed for lzma compression)
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# Chunked compressed files:
+#
+#   header: MAGIC + method (1 byte)
+#   chunks: compressed size (uint32), raw size (uint32) + compressed data
+#
+# Each chunk is compressed independently, so readers can seek to any raw
+# offset decompressing only the chunk that contains it. Writers only cut
+# chunks between writes (i.e. between frames of a dump).
+
+MAGIC = "LBZ1"
+CHUNK = struct.Struct("<II")
+
+def _get_lzma():
+    if lzma is None:
+        raise ImportError, "lzma compression needs the lzma module"
+    return lzma
+
+METHODS = {
+    "zlib": ("z", lambda data, level: zlib.compress(data, level),
+             zlib.decompress, 6),
+    "bz2": ("b", lambda data, level: bz2.compress(data, level),
+            bz2.decompress, 9),
+    "lzma": ("x", lambda data, level: _get_lzma().compress(data, preset=level),
+             lambda data: _get_lzma().decompress(data), 6),
+}
+DECOMPRESSORS = dict((code, decompress) for (code, compress, decompress, level)
+                     in METHODS.itervalues())
+
+def parse_compression(spec):
+    """Return (method, level) for a string method[:level] (e.g. zlib:9)."""
+    spline = spec.split(":")
+    method = spline[0]
+    if method not in METHODS:
+        raise ValueError, "compression method not available: %s" % method
+    level = (int(spline[1]) if len(spline) > 1 else METHODS[method][3])
+    return method, level
+
+def is_compressed(stream):
+    """Return True if stream (seekable) is a chunked compressed file."""
+    position = stream.tell()
+    header = stream.read(len(MAGIC))
+    stream.seek(position)
+    return header == MAGIC
+
+def open_file(filename, mode="r", compression=None):
+    """
+    Open a file, transparently (de)compressed.
+
+    On read, compressed files are detected by its header. On write, data
+    is compressed if compression (method[:level]) is given.
+    """
+    if "w" in mode:
+        stream = open(filename, "wb")
+        if not compression:
+            return stream
+        method, level = parse_compression(compression)
+        return ChunkedWriter(stream, method, level)
+    stream = open(filename, "rb")
+    return (ChunkedReader(stream) if is_compressed(stream) else stream)
+
+class ChunkedWriter(object):
+    """File-like object that writes compressed chunks to a stream."""
+    def __init__(self, stream, method="zlib", level=None, chunk_size=1<<18):
+        code, self.compress, _, default_level = METHODS[method]
+        self.level = (default_level if level is None else level)
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.buffer_size = 0
+        self.stream.write(MAGIC + code)
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= self.chunk_size:
+            self.write_chunk()
+
+    def write_chunk(self):
+        """Compress and write buffered data as a chunk."""
+        if not self.buffer:
+            return
+        data = "".join(self.buffer)
+        compressed = self.compress(data, self.level)
+        self.stream.write(CHUNK.pack(len(compressed), len(data)) + compressed)
+        self.buffer, self.buffer_size = [], 0
+
+    def flush(self):
+        """Flush written chunks (data in the current chunk is kept)."""
+        self.stream.flush()
+
+    def close(self):
+        self.write_chunk()
+        self.stream.close()
+
+class ChunkedReader(object):
+    """
+    Seekable file-like object that reads a chunked compressed stream.
+
+    Offsets (tell/seek) refer to the uncompressed data.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        header = stream.read(len(MAGIC) + 1)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError, "not a chunked compressed file"
+        self.decompress = DECOMPRESSORS[header[len(MAGIC):]]
+        self.chunks_offset = stream.tell()
+        self.chunks = None
+        self.data = ""
+        self.data_offset = 0
+        self.position = 0
+
+    def get_chunks(self):
+        """Return list of (raw offset, file offset) of chunks (scanned once)."""
+        if self.chunks is None:
+            position = self.stream.tell()
+            self.stream.seek(0, 2)
+            file_size = self.stream.tell()
+            self.chunks = []
+            raw_offset = 0
+            self.stream.seek(self.chunks_offset)
+            while 1:
+                file_offset = self.stream.tell()
+                header = self.stream.read(CHUNK.size)
+                if len(header) < CHUNK.size:
+                    break
+                compressed_size, raw_size = CHUNK.unpack(header)
+                if file_offset + CHUNK.size + compressed_size > file_size:
+                    # Truncated file (interrupted writer), see _read_chunk
+                    break
+                self.chunks.append((raw_offset, file_offset))
+                raw_offset += raw_size
+                self.stream.seek(compressed_size, 1)
+            self.chunks.append((raw_offset, None))
+            self.stream.seek(position)
+        return self.chunks
+
+    def _read_chunk(self):
+        """Read next chunk from stream (return False at the end)."""
+        header = self.stream.read(CHUNK.size)
+        if len(header) < CHUNK.size:
+            return False
+        compressed_size, raw_size = CHUNK.unpack(header)
+        compressed = self.stream.read(compressed_size)
+        if len(compressed) < compressed_size:
+            # Truncated file (interrupted writer)
+            return False
+        self.data_offset += len(self.data)
+        self.data = self.decompress(compressed)
+        self.position = 0
+        return True
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self.position >= len(self.data) and not self._read_chunk():
+                break
+            end = (len(self.data) if size < 0 else
+                   min(len(self.data), self.position + size))
+            parts.append(self.data[self.position:end])
+            if size > 0:
+                size -= end - self.position
+            self.position = end
+        return "".join(parts)
+
+    def readline(self):
+        parts = []
+        while 1:
+            if self.position >= len(self.data) and not self._read_chunk():
+                break
+            end = self.data.find("\n", self.position)
+            if end >= 0:
+                parts.append(self.data[self.position:end+1])
+                self.position = end + 1
+                break
+            parts.append(self.data[self.position:])
+            self.position = len(self.data)
+        return "".join(parts)
+
+    def __iter__(self):
+        return iter(self.readline, "")
+
+    def tell(self):
+        return self.data_offset + self.position
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.tell()
+        elif whence == 2:
+            offset += self.get_chunks()[-1][0]
+        if self.data_offset <= offset <= self.data_offset + len(self.data):
+            self.position = offset - self.data_offset
+            return
+        chunks = self.get_chunks()
+        index = max(bisect.bisect_right([raw for (raw, _) in chunks], offset) - 1, 0)
+        raw_offset, file_offset = chunks[index]
+        if file_offset is None:
+            # Seek to the end of the data
+            self.stream.seek(0, 2)
+            self.data, self.data_offset, self.position = "", raw_offset, 0
+            return
+        self.stream.seek(file_offset)
+        self.data, self.data_offset = "", raw_offset
+        self._read_chunk()
+        self.position = offset - raw_offset
+
+    def close(self):
+        self.stream.close()
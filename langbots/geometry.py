@@ -32,10 +32,18 @@ def normalize_angle(angle):
     """Return angle between (-180.0, 180.0]."""
     return ((angle - 180.0) % 360.0) - 180.0
 
+def get_unit_vector(angle):
+    """Return unit vector (cos, sin) for angle in degrees."""
+    alpha = torad(angle)
+    return (math.cos(alpha), math.sin(alpha))
+
 def get_direction_for_rotation(start_angle, end_angle):
     """Get optimal rotate direction to go from start to end angle."""
-    start = [math.cos(torad(start_angle)), math.sin(torad(start_angle))]
-    end = [math.cos(torad(end_angle)), math.sin(torad(end_angle))]
+    return get_direction_for_vectors(get_unit_vector(start_angle), 
+                                     get_unit_vector(end_angle))
+
+def get_direction_for_vectors(start, end):
+    """Get optimal rotate direction to go from start to end unit vectors."""
     return cmp(cross_product(start, end), 0.0)
 
 def may_overlap(points1, points2):
@@ -47,8 +55,61 @@ def may_overlap(points1, points2):
                max(x_points2) < min(x_points1) or
                max(y_points2) < min(y_points1))
 
+def get_penetration_of_polygons(polygon1, polygon2):
+    """
+    Return (depth, axis) of penetration of two convex polygons (None if no collision).
+    
+    Use the separating axis theorem: polygons do not collide if there is an
+    edge normal where the projections of both polygons do not overlap. axis 
+    is the unit vector of minimum overlap, pointing from polygon1 to polygon2;
+    moving polygon2 depth units along it separates the polygons. 
+    """
+    min_depth = None
+    min_ax = min_ay = 0.0
+    for polygon in (polygon1, polygon2):
+        x1, y1 = polygon[-1]
+        for x2, y2 in polygon:
+            ax, ay = y1 - y2, x2 - x1
+            x1, y1 = x2, y2
+            length = math.hypot(ax, ay)
+            if not length:
+                continue
+            ax, ay = ax / length, ay / length
+            min1 = max1 = polygon1[0][0]*ax + polygon1[0][1]*ay
+            for x, y in polygon1:
+                projection = x*ax + y*ay
+                if projection < min1:
+                    min1 = projection
+                elif projection > max1:
+                    max1 = projection
+            min2 = max2 = polygon2[0][0]*ax + polygon2[0][1]*ay
+            for x, y in polygon2:
+                projection = x*ax + y*ay
+                if projection < min2:
+                    min2 = projection
+                elif projection > max2:
+                    max2 = projection
+            if max1 < min2 or max2 < min1:
+                return
+            if max1 - min2 <= max2 - min1:
+                depth = max1 - min2
+            else:
+                depth, ax, ay = max2 - min1, -ax, -ay
+            if min_depth is None or depth < min_depth:
+                min_depth, min_ax, min_ay = depth, ax, ay
+    return min_depth, (min_ax, min_ay)
+
 def check_collision_of_polygons(polygon1, polygon2):
     """Return True if polygons collide (both must be convex)."""
+    return get_penetration_of_polygons(polygon1, polygon2) is not None
+
+def check_collision_of_polygons_by_triangles(polygon1, polygon2):
+    """
+    Return True if polygons collide (both must be convex).
+    
+    Old implementation using triangle decomposition, it misses collisions 
+    where no vertex is inside the other polygon. Kept for benchmarks.
+    """
     if not may_overlap(polygon1, polygon2):
         return False
     get = get_triangles_for_polygon
@@ -76,8 +137,20 @@ def get_triangles_for_polygon(polygon):
      
 def check_point_in_polygon(point, polygon):
     """Return True if point is inside polygon (must be convex)."""
-    return any(check_point_in_triangle(point, triangle) for triangle in
-               get_triangles_for_polygon(polygon))
+    # The point is inside if it's on the same side of all edges
+    px, py = point
+    positive = negative = False
+    x1, y1 = polygon[-1]
+    for x2, y2 in polygon:
+        cp = (x2 - x1) * (py - y1) - (y2 - y1) * (px - x1)
+        if cp > 0:
+            positive = True
+        elif cp < 0:
+            negative = True
+        if positive and negative:
+            return False
+        x1, y1 = x2, y2
+    return True
                  
 def check_point_in_triangle(point, triangle):
     """Check if point is in triangle using the cross-product test."""
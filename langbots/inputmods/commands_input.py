@@ -1,6 +1,13 @@
 #!/usr/bin/python
+import os
 import sys
+import time
+import errno
+import fcntl
+import json
+import select
 import subprocess
+import collections
 
 # Third-party modules
 import yaml
@@ -9,37 +16,204 @@ import yaml
 from langbots import lib
 from langbots import battlefield
 
-def get_state(field, my_robot):
-    """Return a string containing Yaml representation of field."""
+ROBOT_ATTRIBUTES = battlefield.ROBOT_STATE_ATTRIBUTES
+BULLET_ATTRIBUTES = battlefield.BULLET_STATE_ATTRIBUTES
+
+def get_state_data(field, my_robot):
+    """Return a dictionary with the state of field for my_robot."""
     is_my_robot = lambda r: r.name == my_robot.name
     my_robots, other_robots = lib.partition(is_my_robot, field.robots.values())
     if len(my_robots) != 1:
-        raise ValueError, "Robot name not found: %s" % my_robot_name
+        raise ValueError, "Robot name not found: %s" % my_robot.name
     my_robot = my_robots[0]
     gd = lambda struct, accept: lib.get_data_dict(struct, accept=accept)
-    robot_gd = lambda struct: gd(struct, ["x", "y", "angle", "rotation", "shield", 
-        "speed", "time_to_fire", "turret_angle", "turret_rotation"])
-    data = {
+    robot_gd = lambda struct: gd(struct, ROBOT_ATTRIBUTES)
+    return {
         "id": str(field.battle_time),
         "time": field.battle_time,
         "robots": {
             "me": robot_gd(my_robot),
             "others": map(robot_gd, other_robots),
         },
-        "bullets": [gd(bullet, ["x", "y", "angle", "speed"]) for bullet in field.bullets],
+        "bullets": [gd(bullet, BULLET_ATTRIBUTES) for bullet in field.bullets],
     }
-    return yaml.dump(data, default_flow_style=False)                
 
-def send_state(field, stream, robot):
+# State encoders build the state from fragments: each robot is encoded once
+# (as "me" and as one of the "others") and bullets are encoded as a whole.
+
+class YamlEncoder(object):
+    """Encode state as a YAML block (ends with an empty line)."""
+    def robot(self, data):
+        item = yaml.dump([data], default_flow_style=False)
+        me = "".join("    " + line[2:] for line in item.splitlines(True))
+        other = "".join("  " + line for line in item.splitlines(True))
+        return me, other
+
+    def bullets(self, data):
+        return yaml.dump({"bullets": data}, default_flow_style=False)
+
+    def state(self, update_id, battle_time, me, others, bullets):
+        robots = ("robots:\n  me:\n" + me + 
+                  ("  others:\n" + "".join(others) if others else "  others: []\n"))
+        return "".join([bullets, 
+            yaml.dump({"id": update_id}, default_flow_style=False), robots,
+            yaml.dump({"time": battle_time}, default_flow_style=False), "\n"])
+
+class JsonEncoder(object):
+    """Encode state as a single line of compact JSON."""
+    def robot(self, data):
+        encoded = json.dumps(data, separators=(",", ":"))
+        return encoded, encoded
+
+    def bullets(self, data):
+        return json.dumps(data, separators=(",", ":"))
+
+    def state(self, update_id, battle_time, me, others, bullets):
+        return '{"id":%s,"time":%s,"robots":{"me":%s,"others":[%s]},"bullets":%s}\n' % (
+            json.dumps(update_id), json.dumps(battle_time), me, ",".join(others), 
+            bullets)
+
+class TextEncoder(object):
+    """
+    Encode state as a single line of space-separated fields:
+    
+    id time ME N_OTHERS OTHER1 ... N_BULLETS BULLET1 ...
+    
+    Robots are ROBOT_ATTRIBUTES values and bullets BULLET_ATTRIBUTES values.
+    """
+    def robot(self, data):
+        encoded = " ".join(repr(data[k]) for k in ROBOT_ATTRIBUTES)
+        return encoded, encoded
+
+    def bullets(self, data):
+        return " ".join([str(len(data))] + [repr(bullet[k]) 
+            for bullet in data for k in BULLET_ATTRIBUTES])
+
+    def state(self, update_id, battle_time, me, others, bullets):
+        return " ".join([update_id, repr(battle_time), me, str(len(others))] + 
+                        others + [bullets]) + "\n"
+
+class DeltaEncoder(object):
+    """
+    Encode state as a single line of compact JSON with only the changes 
+    since the previous loop (or a full keyframe):
+    
+    keyframe: {"id", "time", "keyframe": 1, "me": name, 
+               "robots": {name: robot}, "bullets": {id: bullet}}
+    delta: {"id", "time", "robots": {name: changed attributes}, 
+            "removed_robots": [name], "bullets": {id: new bullet}, 
+            "removed_bullets": [id]}
+            
+    Bullets are sent only once, they move in a straight line so bots can 
+    calculate their position (see bots/python/lib.py).
+    """
+    def keyframe(self, update_id, battle_time, me, robots, bullets):
+        return self._encode({"id": update_id, "time": battle_time, "keyframe": 1, 
+            "me": me, "robots": robots, "bullets": bullets})
+
+    def delta(self, update_id, battle_time, previous_robots, robots, 
+              previous_bullets, bullets):
+        changed_robots = collections.OrderedDict()
+        for name, robot in robots.iteritems():
+            previous_robot = previous_robots.get(name, {})
+            changes = dict((k, v) for (k, v) in robot.iteritems() 
+                           if previous_robot.get(k) != v)
+            if changes:
+                changed_robots[name] = changes
+        return self._encode({"id": update_id, "time": battle_time, 
+            "robots": changed_robots, 
+            "removed_robots": [name for name in previous_robots 
+                               if name not in robots],
+            "bullets": collections.OrderedDict((id, bullet) for (id, bullet) 
+                in bullets.iteritems() if id not in previous_bullets),
+            "removed_bullets": [id for id in previous_bullets if id not in bullets]})
+
+    def _encode(self, data):
+        return json.dumps(data, separators=(",", ":")) + "\n"
+
+PROTOCOLS = {"yaml": YamlEncoder(), "json": JsonEncoder(), "text": TextEncoder(),
+             "delta": DeltaEncoder()}
+
+class SharedState(object):
+    """
+    State of field for a loop to be sent to many bots.
+    
+    The parts shared by all bots (robots and bullets) are encoded only once 
+    (for each protocol); the state of a bot joins them with its "me" part.
+    The delta protocol needs the SharedState of the previous loop.
+    """
+    def __init__(self, field, previous=None):
+        self.field = field
+        self.update_id = str(field.battle_time)
+        self.parts = {}
+        self.delta_data = None
+        self.previous = previous
+        if previous:
+            # Only the data of the previous loop is needed, break the chain
+            previous.previous = None
+
+    def get_delta_data(self):
+        """Return (robots, bullets) dictionaries for the delta protocol."""
+        if self.delta_data is None:
+            robots = collections.OrderedDict((robot.name, lib.get_data_dict(robot, 
+                accept=ROBOT_ATTRIBUTES)) for robot in self.field.robots.values())
+            bullets = collections.OrderedDict((str(bullet.id), lib.get_data_dict(bullet, 
+                accept=BULLET_ATTRIBUTES)) for bullet in self.field.bullets)
+            self.delta_data = robots, bullets
+        return self.delta_data
+
+    def get_delta(self, my_robot, keyframe=False):
+        """Return state for my_robot in the delta protocol (keyframe if needed)."""
+        encoder = PROTOCOLS["delta"]
+        update_id, battle_time = self.update_id, self.field.battle_time
+        robots, bullets = self.get_delta_data()
+        if keyframe or not self.previous or self.previous.delta_data is None:
+            return encoder.keyframe(update_id, battle_time, my_robot.name, 
+                robots, bullets)
+        if "delta" not in self.parts:
+            previous_robots, previous_bullets = self.previous.get_delta_data()
+            self.parts["delta"] = encoder.delta(update_id, battle_time,
+                previous_robots, robots, previous_bullets, bullets)
+        return self.parts["delta"]
+
+    def get_parts(self, protocol):
+        """Return (robots, bullets) encoded parts for protocol."""
+        if protocol not in self.parts:
+            encoder = PROTOCOLS[protocol]
+            robots = collections.OrderedDict((robot.name, 
+                    encoder.robot(lib.get_data_dict(robot, accept=ROBOT_ATTRIBUTES)))
+                for robot in self.field.robots.values())
+            bullets = encoder.bullets([lib.get_data_dict(bullet, 
+                accept=BULLET_ATTRIBUTES) for bullet in self.field.bullets])
+            self.parts[protocol] = robots, bullets
+        return self.parts[protocol]
+
+    def get(self, my_robot, protocol="yaml"):
+        """Return a string containing the state for my_robot."""
+        if protocol == "delta":
+            return self.get_delta(my_robot, keyframe=True)
+        robots, bullets = self.get_parts(protocol)
+        if my_robot.name not in robots:
+            raise ValueError, "Robot name not found: %s" % my_robot.name
+        me = robots[my_robot.name][0]
+        others = [other for (name, (_, other)) in robots.iteritems() 
+                  if name != my_robot.name]
+        return PROTOCOLS[protocol].state(str(self.field.battle_time), 
+            self.field.battle_time, me, others, bullets)
+
+def get_state(field, my_robot, protocol="yaml"):
+    """Return a string containing the representation of field for the protocol."""
+    return SharedState(field).get(my_robot, protocol)
+
+def send_state(field, stream, robot, protocol="yaml", shared_state=None):
     """Send field state to bot input stream."""
-    data = get_state(field, robot)
-    stream.write(data.rstrip() + "\n\n")
+    stream.write((shared_state or SharedState(field)).get(robot, protocol))
     stream.flush()
 
-def get_input_callback(input_stream, output_stream):
+def get_input_callback(input_stream, output_stream, protocol="yaml"):
     """Return a function callback to be called from main loop."""
     def _input_callback(loop_id, field, new_robot):
-        send_state(field, input_stream, new_robot)
+        send_state(field, input_stream, new_robot, protocol)
         while 1:
             line = output_stream.readline()
             spline = line.split()
@@ -52,11 +226,306 @@ def get_input_callback(input_stream, output_stream):
                     break
     return _input_callback
 
-def init(executable):
+BotPipe = lib.struct("BotPipe", ["input_stream", "output_stream", "protocol", 
+                                 "buffer", "replies", "closed", "late_id", 
+                                 "misses", "last_id", "keyframe_age", "process"])
+
+class InputScheduler(object):
+    """
+    Send state to all bots and gather their replies in parallel.
+    
+    The first input callback called on a loop sends the state to all the
+    (living) bots and waits for their replies, multiplexing the output pipes 
+    with select. Each callback then returns the commands of its bot, so they 
+    are applied in the same order the callbacks are called. Note that all 
+    bots get the state of the field before the commands of the loop apply.
+    
+    If reply_timeout (seconds) is set (0: don't wait, only replies already
+    sent are read), bots that do not reply in time keep their previous 
+    commands and get no more states until their late reply arrives; it's 
+    then applied if apply_late_replies is set (otherwise it's dropped). 
+    Misses are counted for each bot (see get_misses).
+    
+    Bots using the delta protocol get a keyframe every keyframe_interval 
+    loops, or when they have not got the state of the previous loop.
+    
+    If a command_log (see commandlog.CommandLogWriter) is given, all commands
+    processed are written to it.
+    """
+    def __init__(self, reply_timeout=None, apply_late_replies=False, 
+                 keyframe_interval=50, command_log=None):
+        self.bots = collections.OrderedDict()
+        self.loop_id = None
+        self.reply_timeout = reply_timeout
+        self.apply_late_replies = apply_late_replies
+        self.keyframe_interval = keyframe_interval
+        self.shared_state = None
+        self.command_log = command_log
+
+    def get_input_callback(self, robot_name, input_stream, output_stream, 
+                           protocol="yaml", process=None):
+        """
+        Return a function callback to be called from main loop.
+        
+        If the process (subprocess.Popen) of the bot is given, it's 
+        terminated on close.
+        """
+        fd = output_stream.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.bots[robot_name] = BotPipe(input_stream=input_stream, 
+            output_stream=output_stream, protocol=protocol, buffer="", 
+            replies=[], closed=False, late_id=None, misses=0, last_id=None, 
+            keyframe_age=0, process=process)
+        def _input_callback(loop_id, field, new_robot):
+            if self.loop_id != field.battle_time:
+                self.loop_id = field.battle_time
+                self.exchange(field)
+            for command in self.bots[robot_name].replies:
+                if self.command_log:
+                    self.command_log.write(field, robot_name, command)
+                yield process_command(field, new_robot, command)
+        return _input_callback
+
+    def close(self, timeout=1.0):
+        """
+        Close the pipes of bots and wait for their processes to finish.
+        
+        Bots registered without a process (i.e. pooled bots, see BotPool) 
+        are left open.
+        """
+        for bot in self.bots.itervalues():
+            if not bot.process:
+                bot.closed = True
+                continue
+            for stream in [bot.input_stream, bot.output_stream]:
+                try:
+                    stream.close()
+                except IOError:
+                    pass
+            bot.closed = True
+        deadline = time.time() + timeout
+        for bot in self.bots.itervalues():
+            if not bot.process:
+                continue
+            # Bots should exit on EOF, kill those that do not
+            while bot.process.poll() is None and time.time() < deadline:
+                time.sleep(0.01)
+            if bot.process.poll() is None:
+                bot.process.kill()
+                bot.process.wait()
+
+    def get_misses(self):
+        """Return dictionary {robot_name: number of replies missed}."""
+        return dict((robot_name, bot.misses) for (robot_name, bot) in 
+                    self.bots.iteritems())
+
+    def exchange(self, field):
+        """Send state to all bots and wait for their replies."""
+        update_id = str(field.battle_time)
+        deadline = (time.time() + self.reply_timeout 
+                    if self.reply_timeout is not None else None)
+        pending, late = {}, {}
+        previous_state = self.shared_state
+        shared_state = self.shared_state = SharedState(field, previous_state)
+        for robot_name, bot in self.bots.iteritems():
+            bot.replies = []
+            if bot.closed or robot_name not in field.robots:
+                continue
+            if bot.late_id is not None:
+                if not self.read_replies(bot):
+                    late[bot.output_stream.fileno()] = bot
+                continue
+            try:
+                self.send_state(bot, field.robots[robot_name], shared_state, 
+                    previous_state)
+            except IOError:
+                bot.closed = True
+                continue
+            if not read_buffered_replies(bot, update_id):
+                pending[bot.output_stream.fileno()] = bot
+        while pending or late:
+            # When only late bots are left just check what they have sent
+            timeout = (max(0.0, deadline - time.time()) 
+                       if pending and deadline is not None 
+                       else (None if pending else 0.0))
+            readable, _, _ = select.select(pending.keys() + late.keys(), [], [], 
+                timeout)
+            if not readable:
+                break
+            for fd in readable:
+                bot = pending.get(fd) or late[fd]
+                try:
+                    data = os.read(fd, 4096)
+                except OSError, exc:
+                    if exc.errno == errno.EAGAIN:
+                        continue
+                    raise
+                if not data:
+                    bot.closed = True
+                    pending.pop(fd, None) or late.pop(fd)
+                    continue
+                bot.buffer += data
+                if fd in pending:
+                    if read_buffered_replies(bot, update_id):
+                        del pending[fd]
+                elif self.read_replies(bot):
+                    del late[fd]
+        for bot in pending.itervalues():
+            bot.late_id = update_id
+            bot.misses += 1
+
+    def send_state(self, bot, robot, shared_state, previous_state):
+        """Send state to bot."""
+        if bot.protocol == "delta":
+            keyframe = (not previous_state or 
+                        bot.last_id != previous_state.update_id or
+                        bot.keyframe_age >= self.keyframe_interval)
+            data = shared_state.get_delta(robot, keyframe)
+            bot.keyframe_age = (0 if keyframe else bot.keyframe_age + 1)
+        else:
+            data = shared_state.get(robot, bot.protocol)
+        bot.last_id = shared_state.update_id
+        bot.input_stream.write(data)
+        bot.input_stream.flush()
+
+    def read_replies(self, bot):
+        """Look for the late reply of bot (True if found)."""
+        if not read_buffered_replies(bot, bot.late_id):
+            return False
+        if not self.apply_late_replies:
+            # The late reply is the last one, previous ones have "-" id
+            bot.replies.pop()
+        bot.late_id = None
+        return True
+
+def read_buffered_replies(bot, update_id):
+    """Move command lines from bot buffer to bot.replies (True if update_id found)."""
+    while "\n" in bot.buffer:
+        line, bot.buffer = bot.buffer.split("\n", 1)
+        spline = line.split()
+        if not spline:
+            continue
+        if spline[0] == update_id or spline[0] == "-":
+            bot.replies.append(spline[1:])
+            if spline[0] == update_id:
+                return True
+    return False
+
+def init(executable, env=None):
     """Start a process for the bot and return the subprocess.Popen object."""
-    popen = subprocess.Popen(executable, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    popen = subprocess.Popen(executable, stdin=subprocess.PIPE, 
+        stdout=subprocess.PIPE, env=env)
     return popen 
 
+def read_line(fd, buffer, deadline):
+    """
+    Read from a (non-blocking) fd until buffer contains a line.
+    
+    Return tuple (line, rest of buffer). line is None on EOF or timeout.
+    """
+    while "\n" not in buffer:
+        timeout = max(0.0, deadline - time.time())
+        readable, _, _ = select.select([fd], [], [], timeout)
+        if not readable:
+            return None, buffer
+        try:
+            data = os.read(fd, 4096)
+        except OSError, exc:
+            if exc.errno == errno.EAGAIN:
+                continue
+            raise
+        if not data:
+            return None, buffer
+        buffer += data
+    line, buffer = buffer.split("\n", 1)
+    return line, buffer
+
+class BotPool(object):
+    """
+    Pool of pre-warmed bot processes reused across battles.
+    
+    Pooled bots are started with "-" instead of the config file and play
+    many battles (see bots/python/lib.py:run_battles). Each battle starts 
+    with a line "new-battle SIZE SEED" followed by SIZE bytes of the YAML 
+    config, and ends with a line "end-battle" that the bot must acknowledge
+    (with the same line) within ack_timeout seconds. Bots that crash or 
+    do not acknowledge are killed and replaced by new processes.
+    """
+    def __init__(self, ack_timeout=2.0):
+        self.ack_timeout = ack_timeout
+        self.idle = {}
+        self.keys = {}
+        self.started = 0
+        self.recycled = 0
+
+    def acquire(self, executable, protocol, config_file, seed=0, env=None):
+        """Return a process (subprocess.Popen) of the bot ready for a battle."""
+        key = (executable, protocol)
+        config = open(config_file).read()
+        idle = self.idle.setdefault(key, [])
+        while 1:
+            if idle:
+                process = idle.pop()
+            else:
+                process = init([executable, "-"] + 
+                    ([protocol] if protocol != "yaml" else []), env)
+                self.keys[process] = key
+                self.started += 1
+            try:
+                process.stdin.write("new-battle %d %d\n" % (len(config), seed) + 
+                    config)
+                process.stdin.flush()
+            except IOError:
+                self.recycle(process)
+                continue
+            return process
+
+    def release(self, process):
+        """End the battle of a process and keep it for reuse if it's healthy."""
+        fd = process.stdout.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        try:
+            process.stdin.write("end-battle\n")
+            process.stdin.flush()
+            deadline = time.time() + self.ack_timeout
+            buffer = ""
+            while 1:
+                # Discard replies sent after the last state was read
+                line, buffer = read_line(fd, buffer, deadline)
+                if line is None or line == "end-battle":
+                    break
+        except (IOError, OSError):
+            line = None
+        if line is None or buffer or process.poll() is not None:
+            self.recycle(process)
+        else:
+            self.idle[self.keys[process]].append(process)
+
+    def recycle(self, process):
+        """Kill a (crashed or misbehaving) process, it won't be reused."""
+        self.recycled += 1
+        self.keys.pop(process, None)
+        kill(process)
+
+    def close(self):
+        """Kill all idle processes."""
+        for processes in self.idle.itervalues():
+            for process in processes:
+                self.keys.pop(process, None)
+                kill(process)
+        self.idle = {}
+
+def kill(process):
+    """Close the pipes of a process and kill it."""
+    for stream in [process.stdin, process.stdout]:
+        try:
+            stream.close()
+        except IOError:
+            pass
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+
 def process_command(field, new_robot, command):
     """Return new field for robot for a string line command."""
     def _run_command(spline, new_robot, new_bullets):
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+import os
+import imp
+import copy
+
+# App modules
+from langbots.inputmods import commands_input
+
+# In-process Python bots (trusted code, no subprocess or serialization).
+# A bot is a module that defines:
+#
+#   control(view) -> commands
+#
+# or init(config, robot_name) that returns such a control function (for bots
+# that keep state). control is called on every loop with a read-only
+# FieldView and returns None, a command or a list of commands. A command is
+# a string ("set-speed 200 fire") or a tuple ("set-speed", 200); both are
+# processed as the command lines of commands_input.process_command.
+
+class ReadOnlyView(object):
+    """Read-only proxy of a struct (robot or bullet)."""
+    __slots__ = ["_struct"]
+
+    def __init__(self, struct):
+        object.__setattr__(self, "_struct", struct)
+
+    def __getattr__(self, name):
+        return getattr(self._struct, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError, "read-only view: %s" % name
+
+    def __repr__(self):
+        return "<ReadOnlyView %r>" % self._struct
+
+class FieldView(object):
+    """Read-only view of a field for a robot."""
+    __slots__ = ["time", "config", "me", "others", "bullets"]
+
+    def __init__(self, field, my_robot, config):
+        set_attribute = object.__setattr__
+        set_attribute(self, "time", field.battle_time)
+        set_attribute(self, "config", config)
+        set_attribute(self, "me", ReadOnlyView(my_robot))
+        set_attribute(self, "others", [ReadOnlyView(robot) for (name, robot)
+            in sorted(field.robots.iteritems()) if name != my_robot.name])
+        set_attribute(self, "bullets", map(ReadOnlyView, field.bullets))
+
+    def __setattr__(self, name, value):
+        raise AttributeError, "read-only view: %s" % name
+
+def load_module(path):
+    """Import a bot module from a dotted module path or a .py file."""
+    if path.endswith(".py") or os.sep in path:
+        name = os.path.splitext(os.path.basename(path))[0]
+        return imp.load_source("langbots_bot_" + name, path)
+    module = __import__(path)
+    for name in path.split(".")[1:]:
+        module = getattr(module, name)
+    return module
+
+def get_control(module, config, robot_name):
+    """Return the control function of a bot module."""
+    if hasattr(module, "init"):
+        return module.init(copy.deepcopy(config), robot_name)
+    elif hasattr(module, "control"):
+        return module.control
+    raise ValueError, "bot module has no control or init: %s" % module.__name__
+
+def get_command(command):
+    """Return command line (list of strings) for a command returned by a bot."""
+    if isinstance(command, basestring):
+        return command.split()
+    # Floats are represented exactly (as in command logs)
+    return [(repr(arg) if isinstance(arg, float) else str(arg))
+            for arg in command]
+
+def get_commands(value):
+    """Return list of command lines for the value returned by control."""
+    if value is None:
+        return []
+    elif isinstance(value, (basestring, tuple)):
+        return [get_command(value)]
+    return map(get_command, value)
+
+def get_input_callback(robot_name, control, config, command_log=None):
+    """
+    Return an input callback that calls control (in-process).
+
+    If a command_log (see commandlog.CommandLogWriter) is given, commands
+    are written to it.
+    """
+    config = copy.deepcopy(config)
+    def _input_callback(loop_id, field, new_robot):
+        view = FieldView(field, new_robot, config)
+        for command in get_commands(control(view)):
+            if command_log:
+                command_log.write(field, robot_name, command)
+            yield commands_input.process_command(field, new_robot, command)
+    return _input_callback
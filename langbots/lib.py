@@ -1,7 +1,7 @@
 import math
 import sys
-import copy
 import itertools
+import collections
 from threading import Thread
 from Queue import Queue
 
@@ -10,16 +10,69 @@ class DataType(type):
     def __new__(meta, classname, bases, classDict):
         return type.__new__(meta, classname, bases, classDict)    
 
-def struct(name, attributes):
-    """Construct a class with given attributes (struct-like object).""" 
-    def _init(self, **kwargs):
+def struct(name, attributes, private_attributes=(), immutable=False):
+    """
+    Construct a class with given attributes (struct-like object).
+    
+    The class gets a generated constructor (positional or keyword arguments, 
+    missing attributes default to None), clone() and replace(**kwargs).
+    private_attributes are extra slots (i.e. caches) that are not part of 
+    the public data of the struct (see get_data_dict). With immutable=True 
+    the struct is tuple-backed (clone returns the same object).
+    """ 
+    module = sys._getframe(1).f_globals.get("__name__", "__main__")
+    if immutable:
+        if private_attributes:
+            raise ValueError, "immutable structs cannot have private attributes"
+        return _tuple_struct(name, attributes, module)
+    all_attributes = list(attributes) + list(private_attributes)
+    template = "\n".join([
+        "def __init__(self, %s):" % "".join("%s=None, " % k for k in attributes),
+        ] + ["    self.%s = %s" % (k, k) for k in attributes] + [
+        "    self.%s = None" % k for k in private_attributes] + [
+        "    pass",
+        "def clone(self):",
+        "    new = _new(_cls)",
+        ] + ["    new.%s = self.%s" % (k, k) for k in all_attributes] + [
+        "    return new"])
+    def _replace(self, **kwargs):
+        new = self.clone()
         for key, value in kwargs.iteritems():
-            setattr(self, key, value)        
+            setattr(new, key, value)
+        return new
+    def _repr(self):
+        items = ", ".join("%s=%s" % (k, getattr(self, k)) for k in attributes)
+        return "<%s %s>" % (name, items)
+    def _getstate(self):
+        return [getattr(self, k) for k in all_attributes]
+    def _setstate(self, state):
+        for key, value in zip(all_attributes, state):
+            setattr(self, key, value)
+    cls = DataType(name, (object,), 
+        dict(__slots__=all_attributes, __module__=module, 
+             attributes=list(attributes), __repr__=_repr, replace=_replace,
+             __getstate__=_getstate, __setstate__=_setstate))
+    namespace = dict(_new=object.__new__, _cls=cls)
+    exec template in namespace
+    cls.__init__ = namespace["__init__"]
+    cls.clone = namespace["clone"]
+    return cls
+
+def _tuple_struct(name, attributes, module):
+    """Construct an immutable tuple-backed struct class."""
+    base = collections.namedtuple(name, attributes)
+    def _new(cls, *args, **kwargs):
+        if not kwargs:
+            return tuple.__new__(cls, args + (None,) * (len(attributes) - len(args)))
+        values = dict(zip(attributes, args), **kwargs)
+        return tuple.__new__(cls, [values.get(k) for k in attributes])
     def _repr(self):
         items = ", ".join("%s=%s" % (k, getattr(self, k)) for k in attributes)
         return "<%s %s>" % (name, items)
-    return DataType(name, (), 
-        dict(__slots__=attributes, __init__=_init, __repr__=_repr))
+    return DataType(name, (base,), 
+        dict(__slots__=(), __module__=module, __new__=_new, __repr__=_repr,
+             attributes=list(attributes), clone=lambda self: self, 
+             replace=base._replace))
 
 def partition(pred, it):
     """Partition element in iterator in 2 lists (true_predicate, false_predicate)."""
@@ -34,16 +87,16 @@ def compact(it, pred=bool):
 
 def clone_struct(struct):
     """Return a clone (copy) of struct."""
-    return copy.copy(struct)
+    return struct.clone()
 
 def update_struct(struct, other_struct):
     """Update struct from other_struct attributes."""
-    for key in other_struct.__slots__:
+    for key in other_struct.attributes:
         setattr(struct, key, getattr(other_struct, key))
                          
 def get_data_dict(data, accept=None, reject=None):
     """Get dictionary of (attribute, value) of struct."""
-    return dict((k, getattr(data, k)) for k in data.__slots__ 
+    return dict((k, getattr(data, k)) for k in data.attributes 
                 if (not reject or k not in reject) and (not accept or k in accept))
 
 def error(line):
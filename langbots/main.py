@@ -10,12 +10,21 @@ import yaml
 # App modules
 from langbots import lib
 from langbots import battlefield
-from langbots.inputmods import pygame_input, commands_input
-from langbots.outputmods import pygame_output, dump_output
+from langbots import arrayfield
+from langbots import replay
+from langbots import commandlog
+from langbots import compression
+from langbots.inputmods import pygame_input, commands_input, python_input
+from langbots.outputmods import pygame_output, dump_output, replay_output
+from langbots.outputmods import columnar_output
 
-def init_robots(config_file, config, robot_options):
+def init_robots(config_file, config, robot_options, command_log=None):
     input_callbacks = {}
     robots = {}
+    bots_config = config.get("bots", {})
+    scheduler = commands_input.InputScheduler(bots_config.get("reply_timeout"),
+        bots_config.get("apply_late_replies", False), 
+        bots_config.get("keyframe_interval", 50), command_log)
     screen_size = screen_width, screen_height = config["map"]["size"]
     robot_width, robot_height = config["robot"]["size"]
     default_positions = [
@@ -30,10 +39,25 @@ def init_robots(config_file, config, robot_options):
         robot = battlefield.create_robot(name=robot_name, x=x, y=y, 
             shield=config["robot"]["shield"], width=robot_width, height=robot_height)
         if inputmod == "commands":
+            # example: name:commands:bots/python/simplebot.py[:json]
             executable = modargs[0]
-            bot = commands_input.init([executable, config_file])
-            input_callback = commands_input.get_input_callback(bot.stdin, bot.stdout)
+            protocol = (modargs[1] if len(modargs) > 1 else "yaml")
+            if protocol not in commands_input.PROTOCOLS:
+                raise ValueError, "protocol not available: %s" % protocol
+            # Bots get the protocol as second argument (except for YAML)
+            bot_args = ([protocol] if protocol != "yaml" else [])
+            bot = commands_input.init([executable, config_file] + bot_args)
+            input_callback = scheduler.get_input_callback(robot.name, 
+                bot.stdin, bot.stdout, protocol, bot)
+        elif inputmod == "python":
+            # example: name:python:bots/python/sparbot.py (or a module path)
+            module = python_input.load_module(modargs[0])
+            control = python_input.get_control(module, config, robot.name)
+            input_callback = python_input.get_input_callback(robot.name, 
+                control, config, command_log)
         elif inputmod == "pygame":
+            if command_log:
+                raise ValueError, "command logs only support commands robots"
             import pygame
             controls1 = pygame_input.KeyboardControls(
                 forward=pygame.K_UP, backward=pygame.K_DOWN, 
@@ -45,10 +69,11 @@ def init_robots(config_file, config, robot_options):
             raise ValueError, "input module not available: %s" % inputmod
         robots[robot.name] = robot
         input_callbacks[robot.name] = input_callback
-    field = battlefield.Field(battle_time=0.0, config=config, robots=robots, bullets=[])
-    return field, input_callbacks
+    field = battlefield.Field(battle_time=0.0, config=config, robots=robots, 
+        bullets=[], bullets_fired=0)
+    return field, input_callbacks, scheduler
 
-def get_output_callbacks(field, output_options):
+def get_output_callbacks(field, output_options, compression_spec=None):
     output_callbacks = []
     screen_width, screen_height = field.config["map"]["size"]
     screen_size = screen_width, screen_height 
@@ -71,13 +96,30 @@ def get_output_callbacks(field, output_options):
             screen, surfaces = pygame_output.init(screen_size, robot_images, video)
             output_callback = pygame_output.get_output_callback(screen, surfaces, video)
         elif outputmod == "dump":            
+            # example: dump:battle.yaml[:queue_size] (0: write synchronously)
             filename = args[0]
-            output_callback = dump_output.get_output_callback(filename)        
+            queue_size = (int(args[1]) if len(args) > 1 else 256)
+            output_callback = dump_output.get_output_callback(filename, queue_size,
+                compression_spec)
+        elif outputmod == "replay":
+            # example: replay:battle.lbr[:keyframe_interval]
+            filename = args[0]
+            keyframe_interval = (int(args[1]) if len(args) > 1 else 100)
+            output_callback = replay_output.get_output_callback(filename, 
+                keyframe_interval, compression_spec)
+        elif outputmod == "columnar":
+            # example: columnar:battle.npz (or a directory for .npy files)
+            output_callback = columnar_output.get_output_callback(args[0])
         else:
             raise ValueError, "output module not available: %s" % outputmod
         output_callbacks.append(output_callback)
     return output_callbacks    
 
+def close_output_callbacks(output_callbacks):
+    for output_callback in output_callbacks:
+        if hasattr(output_callback, "close"):
+            output_callback.close()
+
 
 def main(args):    
     """Init the battle field and start the main loop."""
@@ -86,16 +128,33 @@ def main(args):
     Start a Language Wars battle field""" 
     parser = optparse.OptionParser(usage)
     parser.add_option('-r', '--robot', dest='robot', action="append",
-        default=[], help='Add a robot to the battlefield (name:pygame | name:commands:botpath)')
+        default=[], help='Add a robot to the battlefield (name:pygame | name:commands:botpath[:yaml|json|text|delta] | name:python:module)')
     parser.add_option('-o', '--output', dest='output', action="append",
-        default=[], help='Active output module (pygame | dump:filename)')
+        default=[], help='Active output module (pygame | dump:filename | replay:filename | columnar:path)')
     parser.add_option('-f', '--framerate', dest='frame_rate', type="int",
         default=None, help='Force framerate (for non-interactive)')
     parser.add_option('-p', '--play-battle', dest='play_battle', 
-        default=None, help='Dump file to play')
+        default=None, help='Dump, replay or command log file to play (command logs without outputs are simulated headless)')
+    parser.add_option('-l', '--command-log', dest='command_log', 
+        default=None, help='Write commands of bots to file (needs -f)')
+    parser.add_option('-z', '--compression', dest='compression', default=None, 
+        help='Compress dump, replay and command log files (zlib|bz2|lzma[:level])')
+    parser.add_option('-s', '--speed', dest='speed', type="float", default=1.0, 
+        help='Playback speed (%s-%s) for -p' % (replay.MIN_SPEED, replay.MAX_SPEED))
+    parser.add_option('-t', '--start', dest='start', default=None, 
+        help='Start playback at battle time (seconds) or tick (#number) for -p')
     parser.add_option('-c', '--field-config-file', dest='config_file', 
         default=None, help='Path to YAML config file')
+    parser.add_option('-a', '--arrays', dest='arrays', action="store_true",
+        default=False, help='Use array-backed field (vectorized update, needs NumPy)')
+    parser.add_option('-i', '--in-place', dest='in_place', action="store_true",
+        default=False, help='Update robots and bullets in-place (no per-tick copies)')
     options, args0 = parser.parse_args(args)
+    if options.compression:
+        compression.parse_compression(options.compression)
+    if not replay.MIN_SPEED <= options.speed <= replay.MAX_SPEED:
+        parser.error("speed must be between %s and %s" % 
+            (replay.MIN_SPEED, replay.MAX_SPEED))
     
     config_file = options.config_file or "config/field.yml"
     config = yaml.load(open(config_file).read())
@@ -103,15 +162,46 @@ def main(args):
     battlefield.add_yaml_representers()
 
     if options.play_battle:
-        dump = open(options.play_battle)
-        field = battlefield.read_yaml_block(dump)
+        stream = compression.open_file(options.play_battle)
+        if commandlog.is_command_log(stream):
+            field, delta, commands = commandlog.read_command_log(stream)
+            battle_replay = None
+        else:
+            battle_replay = replay.open_replay(stream)
+            field = battle_replay.get_frame(0)
     else:
-        field, input_callbacks = init_robots(config_file, config, options.robot)
+        if options.command_log and not options.frame_rate:
+            lib.error("Command logs need a fixed framerate (-f)")
+            return 1
+        command_log = (options.command_log and 
+            commandlog.CommandLogWriter(compression.open_file(options.command_log, 
+                "w", options.compression)))
+        field, input_callbacks, scheduler = init_robots(config_file, config, 
+            options.robot, command_log)
+        if options.arrays:
+            arrayfield.use_arrays(field, battlefield.Bullet)
         
-    output_callbacks = get_output_callbacks(field, options.output)            
+    output_callbacks = get_output_callbacks(field, options.output, 
+        options.compression)            
      
     if options.play_battle:
-        battlefield.play(dump, output_callbacks)
+        start = options.start or "0"
+        start_tick = (int(start[1:]) if start.startswith("#") else None)
+        start_time = (float(start) if start_tick is None else None)
+        if battle_replay is None and not output_callbacks:
+            # Headless: only the result is needed, skip time between commands
+            winner = commandlog.simulate(field, delta, commands)
+            print "winner: %s (battle time: %s)" % (winner and winner.name, 
+                field.battle_time)
+        elif battle_replay is None:
+            commandlog.play(field, delta, commands, output_callbacks, 
+                speed=options.speed, start_time=start_time, start_tick=start_tick)
+        else:
+            player = replay.Player(battle_replay, output_callbacks, options.speed)
+            player.play(start_time, start_tick)
+            if player.dropped:
+                lib.debug("Dropped frames: %d" % player.dropped)
+        close_output_callbacks(output_callbacks)
         return
     
     if not field.robots:
@@ -122,16 +212,28 @@ def main(args):
         return 1    
     
     delta = (1.0 / options.frame_rate if options.frame_rate else None)        
+    if command_log:
+        command_log.write_header(field, delta)
     try:
         start_time = time.time()
         lib.debug("Start battle (%d robots: %s)" % 
             (len(field.robots), ", ".join(field.robots))) 
-        winner = battlefield.run(field, input_callbacks, output_callbacks, delta)
+        winner = battlefield.run(field, input_callbacks, output_callbacks, delta,
+            in_place=options.in_place)
         battle_time = time.time() - start_time
         print "winner: %s (%s)" % (winner.name, battle_time)
+        misses = scheduler.get_misses()
+        if any(misses.values()):
+            lib.debug("Missed replies: %s" % ", ".join("%s=%d" % item 
+                for item in sorted(misses.items())))
     except battlefield.AbortBattle:
         lib.error("Battle aborted")
         return 1
+    finally:
+        scheduler.close()
+        close_output_callbacks(output_callbacks)
+        if command_log:
+            command_log.close()
         
 if __name__ == '__main__':
     sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,12 @@
+#!/usr/bin/python
+
+# App modules
+from langbots import columnar
+
+def get_output_callback(path):
+    """Return a callback that saves the battle as columns (see columnar)."""
+    writer = columnar.ColumnarWriter()
+    def _wrapper(field):
+        return writer.write(field)
+    _wrapper.close = lambda: writer.save(path)
+    return _wrapper
@@ -1,5 +1,7 @@
 #!/usr/bin/python
 import sys
+from threading import Thread
+from Queue import Queue, Empty
 
 # Third-party modules
 import yaml
@@ -7,13 +9,96 @@ import yaml
 # App modules
 from langbots import lib
 from langbots import battlefield
+from langbots import compression
 
-def get_output_callback(filename):
-    outputfd = open(filename, "w")
+def get_output_callback(filename, queue_size=256, compression_spec=None):
+    """
+    Return a callback that dumps each field to filename.
+    
+    With a queue_size, fields are encoded and written by a background writer 
+    (see BackgroundWriter), otherwise they are written synchronously. The
+    file is compressed if compression_spec (method[:level]) is given.
+    """
+    outputfd = compression.open_file(filename, "w", compression_spec)
+    if not queue_size:
+        def _wrapper(field):
+            return write_state(field, outputfd)
+        _wrapper.close = outputfd.close
+        return _wrapper
+    writer = BackgroundWriter(outputfd, queue_size)
     def _wrapper(field):
-        return write_state(field, outputfd)
+        return writer.put(get_snapshot(field))
+    def _close():
+        writer.close()
+        outputfd.close()
+    _wrapper.close = _close
     return _wrapper
 
-def write_state(field, stream=sys.stdout):
+def get_snapshot(field):
+    """Return a copy of field that is not changed by the engine."""
+    return battlefield.Field(config=field.config, battle_time=field.battle_time,
+        bullets_fired=field.bullets_fired, 
+        robots=dict((name, lib.clone_struct(robot)) 
+            for (name, robot) in field.robots.iteritems()),
+        bullets=[lib.clone_struct(bullet) for bullet in field.bullets])
+
+def encode_state(field):
     yamldata = yaml.dump(field, default_flow_style=False)
-    stream.write(yamldata.strip() + "\n\n")
+    return yamldata.strip() + "\n\n"
+
+def write_state(field, stream=sys.stdout):
+    stream.write(encode_state(field))
+
+class BackgroundWriter(object):
+    """
+    Encode and write fields to a stream from a background thread.
+    
+    Fields wait in a queue of queue_size fields; when it's full put blocks
+    until the writer catches up. The writer encodes all fields in the queue 
+    (up to batch_size) and writes them at once. close waits for all fields 
+    to be written. Errors in the writer are raised on the next put/close.
+    """
+    def __init__(self, stream, queue_size=256, batch_size=64):
+        self.stream = stream
+        self.batch_size = batch_size
+        self.queue = Queue(queue_size)
+        self.error = None
+        self.thread = Thread(target=self._write_loop)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def _write_loop(self):
+        closed = False
+        while not closed:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            if None in batch:
+                closed = True
+                batch = batch[:batch.index(None)]
+            if self.error:
+                continue
+            try:
+                self.stream.write("".join(map(encode_state, batch)))
+                self.stream.flush()
+            except Exception, exc:
+                self.error = exc
+
+    def _check_error(self):
+        if self.error:
+            raise self.error
+
+    def put(self, field):
+        """Add field to the queue (blocks if the queue is full)."""
+        self._check_error()
+        self.queue.put(field)
+
+    def close(self):
+        """Write pending fields and stop the writer."""
+        if self.thread.isAlive():
+            self.queue.put(None)
+            self.thread.join()
+        self._check_error()
@@ -0,0 +1,17 @@
+#!/usr/bin/python
+
+# App modules
+from langbots import replay
+from langbots import compression
+
+def get_output_callback(filename, keyframe_interval=100, compression_spec=None):
+    """Return a callback that writes the battle to a binary replay file."""
+    stream = compression.open_file(filename, "w", compression_spec)
+    writer = replay.ReplayWriter(stream, keyframe_interval)
+    def _wrapper(field):
+        return writer.write(field)
+    def _close():
+        writer.close()
+        stream.close()
+    _wrapper.close = _close
+    return _wrapper
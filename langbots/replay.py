@@ -0,0 +1,516 @@
+#!/usr/bin/python
+import math
+import time
+import bisect
+import struct
+
+# Third-party modules
+import yaml
+
+# App modules
+from langbots import battlefield
+
+# Binary replay format:
+#
+#   header: MAGIC, length (uint32) + YAML {"config": ..., "robots": [[name, w, h]]}
+#   frames: type ("K": keyframe, "D": delta), length (uint32) + payload
+#   index:  "X", number of keyframes (uint32) + (battle_time, offset) for each one
+#   trailer: index offset (uint64) + INDEX_MAGIC
+#
+# Keyframes contain the full state of robots and bullets, deltas only the
+# changed attributes of robots, removed robots and bullets, positions of
+# bullets and new bullets. Robots and bullet origins are referenced by its
+# index in the header. The index and trailer are written on close; replays
+# without them (i.e. an interrupted battle) can still be read.
+
+MAGIC = "LBRP\x01"
+INDEX_MAGIC = "LBIX"
+
+ROBOT_ATTRIBUTES = ["x", "y", "speed", "rotation", "angle", "turret_rotation",
+                    "turret_angle", "shield", "time_to_fire", "fire_angle",
+                    "turret_final_angle"]
+ROBOT_FORMATS = "ddddddd" + "i" + "ddd"
+OPTIONAL_ATTRIBUTES = ["fire_angle", "turret_final_angle"]
+
+UINT16 = struct.Struct("<H")
+UINT32 = struct.Struct("<I")
+FRAME = struct.Struct("<cI")
+FRAME_HEADER = struct.Struct("<dI")
+ROBOT = struct.Struct("<" + ROBOT_FORMATS)
+ROBOT_DELTA = struct.Struct("<HH")
+BULLET = struct.Struct("<IddddH")
+POSITION = struct.Struct("<dd")
+INDEX_ENTRY = struct.Struct("<dQ")
+TRAILER = struct.Struct("<Q4s")
+
+def _encode_optional(value):
+    return (float("nan") if value is None else value)
+
+def _decode_optional(value):
+    return (None if math.isnan(value) else value)
+
+def get_robot_values(robot):
+    """Return tuple of values of robot attributes (ROBOT_ATTRIBUTES) to encode."""
+    return (robot.x, robot.y, robot.speed, robot.rotation, robot.angle,
+            robot.turret_rotation, robot.turret_angle, robot.shield,
+            robot.time_to_fire, _encode_optional(robot.fire_angle),
+            _encode_optional(robot.turret_final_angle))
+
+def is_file_replay(stream):
+    """Return True if stream (seekable) contains a binary replay."""
+    position = stream.tell()
+    header = stream.read(len(MAGIC))
+    stream.seek(position)
+    return header == MAGIC
+
+class ReplayWriter(object):
+    """Write fields (frames of a battle) to a binary replay stream."""
+    def __init__(self, stream, keyframe_interval=100):
+        self.stream = stream
+        self.keyframe_interval = keyframe_interval
+        self.robot_indexes = None
+        self.robots = None
+        self.bullets = None
+        self.frames_since_keyframe = 0
+        self.index = []
+        self.offset = 0
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.offset += len(data)
+
+    def write_header(self, field):
+        robots = field.robots.values()
+        self.robot_indexes = dict((robot.name, index)
+            for (index, robot) in enumerate(robots))
+        header = yaml.safe_dump({"config": field.config, "robots":
+            [[robot.name, robot.width, robot.height] for robot in robots]})
+        self._write(MAGIC + UINT32.pack(len(header)) + header)
+
+    def write(self, field):
+        """Write a frame for field."""
+        if self.robot_indexes is None:
+            self.write_header(field)
+        robots = dict((self.robot_indexes[robot.name], get_robot_values(robot))
+            for robot in field.robots.itervalues())
+        bullet_ids = [bullet.id for bullet in field.bullets]
+        keyframe = (self.robots is None or
+                    self.frames_since_keyframe >= self.keyframe_interval)
+        payload = (None if keyframe else
+                   self.encode_delta(field, robots, bullet_ids))
+        if payload is None:
+            self.index.append((field.battle_time, self.offset))
+            payload = self.encode_keyframe(field, robots)
+            self.frames_since_keyframe = 0
+            frame_type = "K"
+        else:
+            self.frames_since_keyframe += 1
+            frame_type = "D"
+        self._write(FRAME.pack(frame_type, len(payload)) + payload)
+        self.robots = robots
+        self.bullets = bullet_ids
+
+    def encode_keyframe(self, field, robots):
+        parts = [FRAME_HEADER.pack(field.battle_time, field.bullets_fired or 0),
+                 UINT16.pack(len(robots))]
+        for index, values in sorted(robots.iteritems()):
+            parts.append(UINT16.pack(index) + ROBOT.pack(*values))
+        parts.append(UINT32.pack(len(field.bullets)))
+        parts.extend(self.encode_bullet(bullet) for bullet in field.bullets)
+        return "".join(parts)
+
+    def encode_bullet(self, bullet):
+        return BULLET.pack(bullet.id, bullet.x, bullet.y, bullet.angle,
+            bullet.speed, self.robot_indexes[bullet.origin])
+
+    def encode_delta(self, field, robots, bullet_ids):
+        """Return delta payload (None if a keyframe is needed)."""
+        current_ids = set(bullet_ids)
+        if None in current_ids or len(current_ids) != len(bullet_ids):
+            return
+        previous_ids = set(self.bullets)
+        old_bullets = [bullet for bullet in field.bullets if bullet.id in previous_ids]
+        new_bullets = field.bullets[len(old_bullets):]
+        # Bullets that were already in the field must come first and in order
+        if ([bullet.id for bullet in old_bullets] !=
+                [id for id in self.bullets if id in current_ids] or
+                any(bullet.id in previous_ids for bullet in new_bullets)):
+            return
+        removed_robots = [index for index in sorted(self.robots)
+                          if index not in robots]
+        parts = [FRAME_HEADER.pack(field.battle_time, field.bullets_fired or 0),
+                 UINT16.pack(len(removed_robots))]
+        parts.extend(UINT16.pack(index) for index in removed_robots)
+        changed_robots = []
+        for index, values in sorted(robots.iteritems()):
+            previous = self.robots.get(index)
+            if previous is None:
+                return
+            mask, changed = 0, []
+            for bit, (value, previous_value, format) in enumerate(
+                    zip(values, previous, ROBOT_FORMATS)):
+                # Compare with repr so NaN (None) values compare equal
+                if value != previous_value and repr(value) != repr(previous_value):
+                    mask |= 1 << bit
+                    changed.append(struct.pack("<" + format, value))
+            if mask:
+                changed_robots.append(ROBOT_DELTA.pack(index, mask) + "".join(changed))
+        parts.append(UINT16.pack(len(changed_robots)))
+        parts.extend(changed_robots)
+        removed_bullets = [id for id in self.bullets if id not in current_ids]
+        parts.append(UINT32.pack(len(removed_bullets)))
+        parts.extend(UINT32.pack(id) for id in removed_bullets)
+        parts.append(UINT32.pack(len(old_bullets)))
+        parts.extend(POSITION.pack(bullet.x, bullet.y) for bullet in old_bullets)
+        parts.append(UINT32.pack(len(new_bullets)))
+        parts.extend(self.encode_bullet(bullet) for bullet in new_bullets)
+        return "".join(parts)
+
+    def close(self):
+        """Write index and trailer (the stream is not closed)."""
+        index_offset = self.offset
+        self._write("X" + UINT32.pack(len(self.index)) + 
+            "".join(INDEX_ENTRY.pack(*entry) for entry in self.index))
+        self._write(TRAILER.pack(index_offset, INDEX_MAGIC))
+        self.stream.flush()
+
+class ReplayReader(object):
+    """
+    Read fields (frames of a battle) from a binary replay stream.
+
+    Iterate the object to get fields in order; use seek(battle_time) to jump
+    to the first frame at or after that time, or get_frame(tick) for random
+    access to frames (see get_frames).
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        if stream.read(len(MAGIC)) != MAGIC:
+            raise ValueError, "not a binary replay"
+        length, = UINT32.unpack(stream.read(UINT32.size))
+        header = yaml.safe_load(stream.read(length))
+        self.config = header["config"]
+        self.robot_info = [(name, width, height)
+                           for (name, width, height) in header["robots"]]
+        self.frames_offset = stream.tell()
+        self.end_offset = None
+        self.index = None
+        self.frames = None
+        self.next_tick = None
+        self.robots = None
+        self.bullets = None
+        self.next_field = None
+
+    def get_index(self):
+        """Return list of (battle_time, offset) of keyframes."""
+        if self.index is None:
+            self.index = self.read_index()
+        return self.index
+
+    def read_index(self):
+        position = self.stream.tell()
+        try:
+            self.stream.seek(-TRAILER.size, 2)
+            trailer = self.stream.read(TRAILER.size)
+            index_offset, magic = (TRAILER.unpack(trailer)
+                if len(trailer) == TRAILER.size else (None, None))
+            if magic == INDEX_MAGIC:
+                self.end_offset = index_offset
+                self.stream.seek(index_offset + 1)
+                count, = UINT32.unpack(self.stream.read(UINT32.size))
+                data = self.stream.read(count * INDEX_ENTRY.size)
+                return [INDEX_ENTRY.unpack_from(data, n * INDEX_ENTRY.size)
+                        for n in range(count)]
+            # No index (interrupted battle), build it scanning the frames
+            index = []
+            self.stream.seek(self.frames_offset)
+            while 1:
+                offset = self.stream.tell()
+                header = self.stream.read(FRAME.size)
+                if len(header) < FRAME.size:
+                    return index
+                frame_type, length = FRAME.unpack(header)
+                payload = self.stream.read(length)
+                if frame_type not in "KD" or len(payload) < length:
+                    return index
+                if frame_type == "K":
+                    battle_time, _ = FRAME_HEADER.unpack_from(payload)
+                    index.append((battle_time, offset))
+        finally:
+            self.stream.seek(position)
+
+    def get_frames(self):
+        """Return list of (battle_time, offset, keyframe offset) of all frames."""
+        if self.frames is None:
+            position = self.stream.tell()
+            self.frames = []
+            self.stream.seek(self.frames_offset)
+            keyframe_offset = None
+            while 1:
+                offset = self.stream.tell()
+                header = self.stream.read(FRAME.size + FRAME_HEADER.size)
+                if len(header) < FRAME.size + FRAME_HEADER.size:
+                    break
+                frame_type, length = FRAME.unpack_from(header)
+                if frame_type not in "KD":
+                    break
+                battle_time, _ = FRAME_HEADER.unpack_from(header, FRAME.size)
+                if frame_type == "K":
+                    keyframe_offset = offset
+                if keyframe_offset is not None:
+                    self.frames.append((battle_time, offset, keyframe_offset))
+                self.stream.seek(offset + FRAME.size + length)
+            self.stream.seek(position)
+        return self.frames
+
+    def get_times(self):
+        """Return list of battle times of frames."""
+        return [battle_time for (battle_time, _, _) in self.get_frames()]
+
+    def get_frame(self, tick):
+        """Return field for frame number tick."""
+        if tick != self.next_tick:
+            battle_time, offset, keyframe_offset = self.get_frames()[tick]
+            self.stream.seek(keyframe_offset)
+            self.next_field = None
+            while self.stream.tell() < offset:
+                self.read_state()
+        field = self.read_frame()
+        self.next_tick = tick + 1
+        return field
+
+    def read_frame(self):
+        """Read next frame and return the field (None at the end)."""
+        self.next_tick = None
+        if self.next_field:
+            field, self.next_field = self.next_field, None
+            return field
+        state = self.read_state()
+        if state:
+            return self.get_field(*state)
+
+    def read_state(self):
+        """Decode next frame, return (battle_time, bullets_fired) or None at the end."""
+        if self.end_offset is not None and self.stream.tell() >= self.end_offset:
+            return
+        header = self.stream.read(FRAME.size)
+        if len(header) < FRAME.size:
+            return
+        frame_type, length = FRAME.unpack(header)
+        if frame_type not in "KD":
+            # Reached the index
+            return
+        payload = self.stream.read(length)
+        if len(payload) < length:
+            return
+        if frame_type == "K":
+            return self.decode_keyframe(payload)
+        elif self.robots is None:
+            raise ValueError, "delta frame without previous keyframe"
+        return self.decode_delta(payload)
+
+    def decode_keyframe(self, payload):
+        battle_time, bullets_fired = FRAME_HEADER.unpack_from(payload)
+        offset = FRAME_HEADER.size
+        nrobots, = UINT16.unpack_from(payload, offset)
+        offset += UINT16.size
+        self.robots = {}
+        for n in range(nrobots):
+            index, = UINT16.unpack_from(payload, offset)
+            self.robots[index] = list(ROBOT.unpack_from(payload, offset + UINT16.size))
+            offset += UINT16.size + ROBOT.size
+        nbullets, = UINT32.unpack_from(payload, offset)
+        offset += UINT32.size
+        self.bullets = []
+        for n in range(nbullets):
+            self.bullets.append(list(BULLET.unpack_from(payload, offset)))
+            offset += BULLET.size
+        return battle_time, bullets_fired
+
+    def decode_delta(self, payload):
+        battle_time, bullets_fired = FRAME_HEADER.unpack_from(payload)
+        offset = FRAME_HEADER.size
+        def _read(struct_type):
+            values = struct_type.unpack_from(payload, offset)
+            return values, offset + struct_type.size
+        (nremoved,), offset = _read(UINT16)
+        for n in range(nremoved):
+            (index,), offset = _read(UINT16)
+            del self.robots[index]
+        (nchanged,), offset = _read(UINT16)
+        for n in range(nchanged):
+            (index, mask), offset = _read(ROBOT_DELTA)
+            values = self.robots[index]
+            for bit, format in enumerate(ROBOT_FORMATS):
+                if mask & (1 << bit):
+                    values[bit], = struct.unpack_from("<" + format, payload, offset)
+                    offset += struct.calcsize(format)
+        (nremoved,), offset = _read(UINT32)
+        removed = set()
+        for n in range(nremoved):
+            (id,), offset = _read(UINT32)
+            removed.add(id)
+        self.bullets = [bullet for bullet in self.bullets if bullet[0] not in removed]
+        (nmoved,), offset = _read(UINT32)
+        for bullet in self.bullets[:nmoved]:
+            (bullet[1], bullet[2]), offset = _read(POSITION)
+        (nnew,), offset = _read(UINT32)
+        for n in range(nnew):
+            values, offset = _read(BULLET)
+            self.bullets.append(list(values))
+        return battle_time, bullets_fired
+
+    def get_field(self, battle_time, bullets_fired):
+        """Return Field for current state."""
+        robots = {}
+        for index, values in self.robots.iteritems():
+            name, width, height = self.robot_info[index]
+            attributes = dict(zip(ROBOT_ATTRIBUTES, values))
+            for key in OPTIONAL_ATTRIBUTES:
+                attributes[key] = _decode_optional(attributes[key])
+            robots[name] = battlefield.Robot(name=name, width=width,
+                height=height, **attributes)
+        bullets = [battlefield.Bullet(id=id, x=x, y=y, angle=angle, speed=speed,
+                origin=self.robot_info[origin][0])
+            for (id, x, y, angle, speed, origin) in self.bullets]
+        return battlefield.Field(config=self.config, robots=robots,
+            bullets=bullets, battle_time=battle_time, bullets_fired=bullets_fired)
+
+    def seek(self, battle_time):
+        """Go to first frame with time equal or greater than battle_time."""
+        index = self.get_index()
+        if not index:
+            return
+        position = max(bisect.bisect_right([t for (t, _) in index], battle_time) - 1, 0)
+        self.stream.seek(index[position][1])
+        self.next_field = self.next_tick = None
+        while 1:
+            state = self.read_state()
+            if state is None or state[0] >= battle_time:
+                self.next_field = (state and self.get_field(*state))
+                return
+
+    def __iter__(self):
+        return iter(self.read_frame, None)
+
+class YamlReplay(object):
+    """
+    Read fields from a YAML dump (see dump_output.write_state).
+
+    Iterate the object to get fields in order, or use get_frame(tick) for
+    random access. The index of frames (get_frames) is built on first use
+    with a single pass over the lines (frames are not parsed).
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.start_offset = stream.tell()
+        self.frames = None
+        self.next_tick = None
+
+    def get_frames(self):
+        """Return list of (battle_time, offset) of all frames."""
+        if self.frames is None:
+            position = self.stream.tell()
+            self.stream.seek(self.start_offset)
+            self.frames = []
+            block_offset = None
+            while 1:
+                offset = self.stream.tell()
+                line = self.stream.readline()
+                if not line:
+                    break
+                elif not line.strip():
+                    block_offset = None
+                    continue
+                if block_offset is None:
+                    block_offset = offset
+                if line.startswith("battle_time:"):
+                    self.frames.append((float(line.split(":", 1)[1]), block_offset))
+            self.stream.seek(position)
+        return self.frames
+
+    def get_times(self):
+        """Return list of battle times of frames."""
+        return [battle_time for (battle_time, _) in self.get_frames()]
+
+    def get_frame(self, tick):
+        """Return field for frame number tick."""
+        if tick != self.next_tick:
+            self.stream.seek(self.get_frames()[tick][1])
+        field = self.read_frame()
+        self.next_tick = tick + 1
+        return field
+
+    def read_frame(self):
+        """Read next frame and return the field (None at the end)."""
+        self.next_tick = None
+        lines = []
+        while 1:
+            line = self.stream.readline()
+            if not line.strip():
+                if line and not lines:
+                    continue
+                break
+            lines.append(line)
+        return yaml.load("".join(lines))
+
+    def __iter__(self):
+        return iter(self.read_frame, None)
+
+def open_replay(stream):
+    """Return a reader (ReplayReader or YamlReplay) for a replay stream."""
+    if is_file_replay(stream):
+        return ReplayReader(stream)
+    return YamlReplay(stream)
+
+def read_fields(stream):
+    """Return an iterator of fields for a replay stream (binary or YAML dump)."""
+    return iter(open_replay(stream))
+
+MIN_SPEED, MAX_SPEED = 0.25, 64.0
+
+class Player(object):
+    """
+    Play a replay (see open_replay) at speed times the pace of the battle.
+
+    The player sleeps until the next frame is due; when drawing falls 
+    behind, frames are dropped (not even decoded for YAML dumps) to draw 
+    the last frame due. Playback may start at any battle time or tick.
+    """
+    def __init__(self, replay, draw_callbacks, speed=1.0, 
+                 clock=time.time, sleep=time.sleep):
+        if not MIN_SPEED <= speed <= MAX_SPEED:
+            raise ValueError, "speed must be between %s and %s" % (MIN_SPEED, MAX_SPEED)
+        self.replay = replay
+        self.draw_callbacks = draw_callbacks
+        self.speed = speed
+        self.clock = clock
+        self.sleep = sleep
+        self.dropped = 0
+
+    def get_tick(self, battle_time):
+        """Return tick of the first frame at or after battle_time."""
+        return bisect.bisect_left(self.replay.get_times(), battle_time)
+
+    def play(self, start_time=None, start_tick=None):
+        """Play the replay, return the number of frames drawn."""
+        times = self.replay.get_times()
+        tick = (self.get_tick(start_time) if start_time is not None 
+                else start_tick or 0)
+        if tick >= len(times):
+            return 0
+        start_clock, start_battle_time = self.clock(), times[tick]
+        drawn = 0
+        while tick < len(times):
+            battle_time = start_battle_time + (self.clock() - start_clock) * self.speed
+            last_due = bisect.bisect_right(times, battle_time) - 1
+            if last_due > tick:
+                self.dropped += last_due - tick
+                tick = last_due
+            elif times[tick] > battle_time:
+                self.sleep((times[tick] - battle_time) / self.speed)
+            field = self.replay.get_frame(tick)
+            for draw_callback in self.draw_callbacks:
+                draw_callback(field)
+            drawn += 1
+            tick += 1
+        return drawn
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+import os
+import cPickle
+import traceback
+import multiprocessing
+
+# App modules
+from langbots import battlefield
+
+# A snapshot is the full state of a battlefield.Battle (field with robot
+# timers, pending turret angles and bullets, initial field and engine state)
+# pickled with the binary protocol, prefixed by MAGIC.
+
+MAGIC = "LBSN\x01"
+
+def dumps(battle):
+    """Return snapshot (string) of a battle."""
+    return MAGIC + cPickle.dumps(battle, cPickle.HIGHEST_PROTOCOL)
+
+def loads(data):
+    """
+    Return a new Battle restored from a snapshot.
+
+    Snapshots are unpickled, which can run arbitrary code: only load
+    snapshots from trusted sources.
+    """
+    if not data.startswith(MAGIC):
+        raise ValueError, "not a battle snapshot"
+    battle = cPickle.loads(data[len(MAGIC):])
+    if not isinstance(battle, battlefield.Battle):
+        raise ValueError, "not a battle snapshot"
+    return battle
+
+def save(battle, filename):
+    """Save snapshot of battle to a file."""
+    with open(filename, "wb") as stream:
+        stream.write(dumps(battle))
+
+def load(filename):
+    """Return Battle restored from a snapshot file (must be trusted, see loads)."""
+    with open(filename, "rb") as stream:
+        return loads(stream.read())
+
+def _run_child(function, battle, arg, stream):
+    """Run function in a forked child and write its (pickled) result to stream."""
+    try:
+        result = (True, function(battle, arg))
+    except Exception:
+        result = (False, traceback.format_exc())
+    stream.write(cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL))
+    stream.close()
+
+def fork_map(battle, function, args, processes=None):
+    """
+    Return list of function(battle, arg) for each arg, each run on a fork.
+
+    Every call runs in a child process (os.fork) that gets a copy-on-write
+    copy of the battle, so it can step it freely (i.e. explore a "what if"
+    branch). Results must be picklable. At most processes (one per CPU by
+    default) children run at the same time.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    args = list(args)
+    results = []
+    for start in range(0, len(args), processes):
+        children = []
+        for arg in args[start:start + processes]:
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                try:
+                    _run_child(function, battle, arg, os.fdopen(write_fd, "wb"))
+                finally:
+                    os._exit(0)
+            os.close(write_fd)
+            children.append((pid, os.fdopen(read_fd, "rb")))
+        # Wait for all the children of the batch before raising errors
+        outputs = []
+        for pid, stream in children:
+            try:
+                outputs.append((pid, stream.read()))
+            finally:
+                stream.close()
+                os.waitpid(pid, 0)
+        for pid, data in outputs:
+            if not data:
+                raise RuntimeError, "forked battle died (pid %d)" % pid
+            ok, value = cPickle.loads(data)
+            if not ok:
+                raise RuntimeError, "forked battle failed:\n%s" % value
+            results.append(value)
+    return results
@@ -0,0 +1,305 @@
+#!/usr/bin/python
+import os
+import sys
+import optparse
+import itertools
+import traceback
+import multiprocessing
+
+# Third-party modules
+import yaml
+
+# App modules
+from langbots import lib
+from langbots import battlefield
+from langbots import commandlog
+from langbots import cache
+from langbots.inputmods import commands_input
+
+Bot = lib.struct("Bot", ["name", "executable", "protocol"])
+Match = lib.struct("Match", ["index", "bots", "seed", "config_file",
+                             "frame_rate", "max_time", "key", "replay", 
+                             "pool_bots"])
+Result = lib.struct("Result", ["match", "winner", "battle_time", "misses",
+                               "error", "replay", "cached"])
+
+def parse_bot(s):
+    """Return Bot for a string name:botpath[:protocol]."""
+    spline = s.split(":")
+    name, executable = spline[0], spline[1]
+    protocol = (spline[2] if len(spline) > 2 else "yaml")
+    if protocol not in commands_input.PROTOCOLS:
+        raise ValueError, "protocol not available: %s" % protocol
+    return Bot(name=name, executable=executable, protocol=protocol)
+
+get_start_positions = battlefield.get_start_positions
+
+def get_matches(bots, repetitions, config_file, frame_rate, max_time, seed=0,
+                pool_bots=False):
+    """
+    Return list of matches for all pairings of bots.
+
+    Each pairing is repeated the given times, swapping the start positions
+    on odd repetitions, so each bot plays from both positions (a new seed
+    is used every two repetitions). With pool_bots, bot processes are 
+    reused across the matches of a worker (see commands_input.BotPool).
+    """
+    matches = []
+    for bot1, bot2 in itertools.combinations(bots, 2):
+        for repetition in range(repetitions):
+            pair = ([bot1, bot2] if repetition % 2 == 0 else [bot2, bot1])
+            matches.append(Match(index=len(matches), bots=pair,
+                seed=seed + repetition // 2, config_file=config_file,
+                frame_rate=frame_rate, max_time=max_time, pool_bots=pool_bots))
+    return matches
+
+def set_match_keys(matches, replays_directory=None):
+    """
+    Set the key of matches (and the path of its replay, if a directory is given).
+
+    The key is a hash of the engine version (see cache), the contents of 
+    the config file, the name, protocol and hash of the executable of bots,
+    the seed, start positions, frame rate and maximum battle time. 
+    """
+    engine_version = cache.get_engine_version()
+    file_hashes = {}
+    def _get_hash(path):
+        if path not in file_hashes:
+            file_hashes[path] = cache.get_file_hash(path)
+        return file_hashes[path]
+    for match in matches:
+        config = yaml.load(open(match.config_file).read())
+        match.key = cache.get_key(dict(engine=engine_version,
+            config=_get_hash(match.config_file),
+            bots=[(bot.name, bot.protocol, _get_hash(bot.executable))
+                  for bot in match.bots],
+            seed=match.seed, 
+            positions=get_start_positions(config, match.seed, len(match.bots)),
+            frame_rate=match.frame_rate, max_time=match.max_time))
+        if replays_directory:
+            match.replay = os.path.join(replays_directory, match.key + ".log")
+
+# Pool of bot processes of this worker process (see get_bot_pool)
+bot_pool = None
+
+def get_bot_pool():
+    """Return the BotPool of this (worker) process."""
+    global bot_pool
+    if bot_pool is None:
+        bot_pool = commands_input.BotPool()
+    return bot_pool
+
+def run_match(match):
+    """Run a headless battle for match and return a Result."""
+    try:
+        return _run_match(match)
+    except Exception:
+        return Result(match=match, winner=None, battle_time=None, misses={},
+            error=traceback.format_exc(), replay=None, cached=False)
+
+def _run_match(match):
+    config = yaml.load(open(match.config_file).read())
+    bots_config = config.get("bots", {})
+    command_log = (match.replay and 
+        commandlog.CommandLogWriter(open(match.replay, "w")))
+    scheduler = commands_input.InputScheduler(bots_config.get("reply_timeout"),
+        bots_config.get("apply_late_replies", False),
+        bots_config.get("keyframe_interval", 50), command_log)
+    robot_width, robot_height = config["robot"]["size"]
+    positions = get_start_positions(config, match.seed, len(match.bots))
+    robots, input_callbacks, pooled = {}, {}, []
+    try:
+        for index, (bot, (x, y, angle)) in enumerate(zip(match.bots, positions)):
+            robots[bot.name] = battlefield.create_robot(name=bot.name, x=x, y=y,
+                angle=angle, shield=config["robot"]["shield"], width=robot_width,
+                height=robot_height)
+            bot_seed = 2 * match.seed + index
+            if match.pool_bots:
+                process = get_bot_pool().acquire(bot.executable, bot.protocol,
+                    match.config_file, bot_seed)
+                pooled.append(process)
+                input_callbacks[bot.name] = scheduler.get_input_callback(
+                    bot.name, process.stdin, process.stdout, bot.protocol)
+                continue
+            bot_args = ([bot.protocol] if bot.protocol != "yaml" else [])
+            env = dict(os.environ, LANGBOTS_SEED=str(bot_seed))
+            process = commands_input.init([bot.executable, match.config_file] +
+                bot_args, env)
+            input_callbacks[bot.name] = scheduler.get_input_callback(bot.name,
+                process.stdin, process.stdout, bot.protocol, process)
+        field = battlefield.Field(battle_time=0.0, config=config, robots=robots,
+            bullets=[], bullets_fired=0)
+        def _check_time(field):
+            if match.max_time and field.battle_time >= match.max_time:
+                raise battlefield.AbortBattle
+        delta_time = 1.0 / match.frame_rate
+        if command_log:
+            command_log.write_header(field, delta_time)
+        try:
+            winner = battlefield.run(field, input_callbacks, [_check_time],
+                delta_time)
+        except battlefield.AbortBattle:
+            # Battle time exhausted: draw
+            winner = None
+        return Result(match=match, winner=(winner and winner.name),
+            battle_time=field.battle_time, misses=scheduler.get_misses(),
+            error=None, replay=match.replay, cached=False)
+    finally:
+        scheduler.close()
+        for process in pooled:
+            get_bot_pool().release(process)
+        if command_log:
+            command_log.close()
+
+def get_cached_result(result_cache, match):
+    """
+    Return Result stored in cache for match (None if not found).
+
+    If the match needs a replay, results without that replay file (i.e. 
+    stored with no replay or another replays directory) are not used, so 
+    the match is run again to write it.
+    """
+    data = result_cache.get(match.key)
+    if data is None:
+        return
+    if match.replay and not (data["replay"] == match.replay and 
+                             os.path.exists(match.replay)):
+        return
+    return Result(match=match, winner=data["winner"], 
+        battle_time=data["battle_time"], misses=data["misses"], error=None, 
+        replay=data["replay"], cached=True)
+
+def run_matches(matches, processes=None, callback=None, result_cache=None):
+    """
+    Run matches on a pool of processes (one per CPU by default).
+
+    Return the list of results (in order of matches). callback, if given, is
+    called with each result as it finishes. If a result_cache (see 
+    cache.ResultCache) is given, matches with a stored result (by match key, 
+    see set_match_keys) are not run, and new results are stored.
+    """
+    results = []
+    pending = []
+    for match in matches:
+        result = (result_cache and get_cached_result(result_cache, match))
+        if result:
+            if callback:
+                callback(result)
+            results.append(result)
+        else:
+            pending.append(match)
+    if pending:
+        pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+        try:
+            for result in pool.imap_unordered(run_match, pending):
+                if result_cache and not result.error:
+                    result_cache.put(result.match.key, dict(winner=result.winner,
+                        battle_time=result.battle_time, misses=result.misses,
+                        replay=result.replay))
+                if callback:
+                    callback(result)
+                results.append(result)
+        finally:
+            pool.terminate()
+            pool.join()
+    return sorted(results, key=lambda result: result.match.index)
+
+def get_standings(bots, results):
+    """
+    Return list of dictionaries with the standings of bots (by points).
+
+    A win gives 3 points and a draw (no winner, see max_time) 1 point.
+    Matches with errors are not counted.
+    """
+    stats = dict((bot.name, dict(name=bot.name, played=0, wins=0, draws=0,
+        losses=0, points=0, errors=0)) for bot in bots)
+    for result in results:
+        for bot in result.match.bots:
+            bot_stats = stats[bot.name]
+            if result.error:
+                bot_stats["errors"] += 1
+                continue
+            bot_stats["played"] += 1
+            if result.winner is None:
+                bot_stats["draws"] += 1
+                bot_stats["points"] += 1
+            elif result.winner == bot.name:
+                bot_stats["wins"] += 1
+                bot_stats["points"] += 3
+            else:
+                bot_stats["losses"] += 1
+    return sorted(stats.values(), key=lambda s: (-s["points"], -s["wins"], s["name"]))
+
+def get_result_data(result):
+    """Return dictionary for a result (to be saved in the standings file)."""
+    return dict(robots=[bot.name for bot in result.match.bots],
+        seed=result.match.seed, winner=result.winner,
+        battle_time=result.battle_time, misses=result.misses,
+        error=result.error, replay=result.replay, cached=result.cached)
+
+def write_standings(stream, bots, results):
+    """Write standings and results of matches (YAML) to stream."""
+    data = dict(standings=get_standings(bots, results),
+        matches=map(get_result_data, results))
+    stream.write(yaml.safe_dump(data, default_flow_style=False))
+
+def main(args):
+    """Run a tournament (all pairings of bots)."""
+    usage = """usage: %prog [OPTIONS] -b name:botpath[:protocol] -b ...
+
+    Run a Language Wars tournament (headless battles on a process pool)"""
+    parser = optparse.OptionParser(usage)
+    parser.add_option('-b', '--bot', dest='bots', action="append",
+        default=[], help='Add a bot to the tournament (name:botpath[:yaml|json|text|delta])')
+    parser.add_option('-n', '--repetitions', dest='repetitions', type="int",
+        default=2, help='Battles for each pairing (sides are swapped on odd ones)')
+    parser.add_option('-f', '--framerate', dest='frame_rate', type="int",
+        default=25, help='Fixed framerate of battles')
+    parser.add_option('-m', '--max-time', dest='max_time', type="float",
+        default=300.0, help='Maximum battle time (seconds), then the match is a draw')
+    parser.add_option('-s', '--seed', dest='seed', type="int",
+        default=0, help='Seed of the first repetition (0: default positions)')
+    parser.add_option('-j', '--processes', dest='processes', type="int",
+        default=None, help='Number of processes (default: number of CPUs)')
+    parser.add_option('-o', '--output', dest='output', default="standings.yml",
+        help='Standings file (YAML)')
+    parser.add_option('-c', '--field-config-file', dest='config_file',
+        default="config/field.yml", help='Path to YAML config file')
+    parser.add_option('-C', '--cache', dest='cache', default=None,
+        help='Directory of the result cache (results of matches are reused)')
+    parser.add_option('-S', '--cache-size', dest='cache_size', type="float",
+        default=64.0, help='Maximum size of the result cache (MB)')
+    parser.add_option('-P', '--pool-bots', dest='pool_bots', 
+        action="store_true", default=False, 
+        help='Reuse bot processes across matches (bots using bots/python/lib.py)')
+    parser.add_option('-r', '--replays', dest='replays', default=None,
+        help='Directory to save command logs of matches (see commandlog)')
+    options, args0 = parser.parse_args(args)
+    bots = map(parse_bot, options.bots)
+    if len(bots) < 2:
+        parser.print_help()
+        return 2
+    elif len(set(bot.name for bot in bots)) < len(bots):
+        lib.error("Bot names must be unique")
+        return 1
+    matches = get_matches(bots, options.repetitions, options.config_file,
+        options.frame_rate, options.max_time, options.seed, options.pool_bots)
+    if options.replays and not os.path.isdir(options.replays):
+        os.makedirs(options.replays)
+    set_match_keys(matches, options.replays)
+    result_cache = (options.cache and 
+        cache.ResultCache(options.cache, int(options.cache_size * (1<<20))))
+    def _callback(result):
+        lib.debug("%s: %s%s" % (" vs ".join(bot.name for bot in result.match.bots),
+            ("error" if result.error else result.winner or "draw"),
+            (" (cached)" if result.cached else "")))
+    results = run_matches(matches, options.processes, _callback, result_cache)
+    with open(options.output, "w") as stream:
+        write_standings(stream, bots, results)
+    for position, stats in enumerate(get_standings(bots, results)):
+        print "%d. %s: %d points (%d wins, %d draws, %d losses)" % (position + 1,
+            stats["name"], stats["points"], stats["wins"], stats["draws"],
+            stats["losses"])
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,28 @@
+#!/usr/bin/python
+"""Benchmark batched battles (battle-ticks per second) against the scalar engine."""
+import sys
+import time
+
+from langbots import batch
+from langbots import battlefield
+
+from test_batch import get_fields
+
+def main(args):
+    steps = int(args[0]) if args else 200
+    start = time.time()
+    for field in get_fields(10):
+        battle = battlefield.Battle(field, 0.04)
+        for step in range(steps):
+            battle.step()
+    print "scalar: %d battle-ticks/s" % (10 * steps / (time.time() - start))
+    for count in [1, 10, 100, 1000, 10000]:
+        battles = batch.BatchBattle(get_fields(count), 0.04)
+        start = time.time()
+        for step in range(steps):
+            battles.step()
+        print "batch (%d battles): %d battle-ticks/s" % (count, 
+            count * steps / (time.time() - start))
+        
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,31 @@
+#!/usr/bin/python
+"""Benchmark collision tests of geometry (SAT vs. triangle decomposition)."""
+import sys
+import random
+import timeit
+
+from langbots import battlefield
+from langbots import geometry
+
+def get_random_polygons(n, seed=0):
+    rnd = random.Random(seed)
+    def _robot():
+        return battlefield.create_robot(name="r", x=rnd.uniform(0, 120),
+            y=rnd.uniform(0, 120), angle=rnd.uniform(-180, 180), width=36, height=38)
+    return [(battlefield.get_polygon_for_robot(_robot()), 
+             battlefield.get_polygon_for_robot(_robot())) for index in range(n)]
+
+def main(args):
+    n = int(args[0]) if args else 2000
+    pairs = get_random_polygons(n)
+    for name in ["check_collision_of_polygons_by_triangles", 
+                 "check_collision_of_polygons"]:
+        function = getattr(geometry, name)
+        elapsed = min(timeit.repeat(lambda: [function(p1, p2) for (p1, p2) in pairs],
+            number=1, repeat=5))
+        collisions = sum(1 for (p1, p2) in pairs if function(p1, p2))
+        print "%s: %.2f us/pair (%d collisions in %d pairs)" % (
+            name, 1e6 * elapsed / n, collisions, n)
+        
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
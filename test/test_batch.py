@@ -0,0 +1,72 @@
+#!/usr/bin/python
+import random
+import unittest
+
+import numpy
+
+from langbots import batch
+from langbots import battlefield
+
+from test_battlefield import create_field, get_state
+
+def get_fields(count):
+    """Return count fields of two robots (each on its own start positions)."""
+    fields = []
+    for index in range(count):
+        field = create_field(2)
+        robots = battlefield.get_robots(field.robots)
+        positions = battlefield.get_start_positions(field.config, index + 1)
+        for robot, (x, y, angle) in zip(robots, positions):
+            robot.x, robot.y, robot.angle = x, y, angle
+        fields.append(field)
+    return fields
+
+def get_commands(rnd, count):
+    """Return random commands for step (NaN: no command)."""
+    def _value(command):
+        if command == "fire":
+            return rnd.random() < 0.05
+        return (rnd.uniform(-250, 250) if rnd.random() < 0.1 else numpy.nan)
+    return dict((command, numpy.array([[_value(command) for column in range(2)] 
+            for index in range(count)]))
+        for command in batch.COMMANDS)
+
+def get_robot_commands(commands, index, column):
+    """Return commands of a robot in commands (see get_commands) for Battle.step."""
+    robot_commands = []
+    for command in batch.COMMANDS:
+        value = commands[command][index, column]
+        if command == "fire":
+            if value:
+                robot_commands.append(("fire",))
+        elif not numpy.isnan(value):
+            robot_commands.append((command, float(value)))
+    return robot_commands
+
+class TestBatchBattle(unittest.TestCase):
+    def test_same_results(self):
+        count = 8
+        rnd = random.Random(1)
+        battles = [battlefield.Battle(field, 0.04) for field in get_fields(count)]
+        batch_battle = batch.BatchBattle(get_fields(count), 0.04)
+        for step in range(3000):
+            commands = get_commands(rnd, count)
+            for index, battle in enumerate(battles):
+                if not battle.done:
+                    names = batch_battle.robot_names[index]
+                    battle.step(dict((name, get_robot_commands(commands, index, column))
+                        for (column, name) in enumerate(names)))
+            done = batch_battle.step(commands)
+            for index, battle in enumerate(battles):
+                if step % 10 and not done.all():
+                    continue
+                self.assertEqual(get_state(batch_battle.get_field(index)),
+                                 get_state(battle.field))
+            if done.all():
+                break
+        self.assertTrue(done.all())
+        self.assertEqual(batch_battle.get_winners(), 
+                         [(battle.winner and battle.winner.name) for battle in battles])
+
+if __name__ == '__main__':
+    unittest.main()
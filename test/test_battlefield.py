@@ -0,0 +1,247 @@
+#!/usr/bin/python
+import unittest
+import random
+
+from langbots import lib
+from langbots import battlefield
+from langbots import arrayfield
+
+def create_bullets():
+    return [battlefield.Bullet(x=x, y=y, angle=angle, speed=300.0, origin="r1")
+            for (x, y, angle) in [(10.0, 10.0, 0.0), (5.0, 5.0, 180.0),
+                                  (320.0, 240.0, 33.0), (630.0, 470.0, -45.0)]]
+
+class TestArrayField(unittest.TestCase):
+    def test_process_bullets(self):
+        screen_size = (640, 480)
+        bullets = create_bullets()
+        array = arrayfield.BulletArray(battlefield.Bullet, create_bullets())
+        for step in range(3):
+            bullets = battlefield.process_bullets(bullets, 0.04, screen_size)
+            array = battlefield.process_bullets(array, 0.04, screen_size)
+            self.assertEqual([(b.x, b.y, b.angle) for b in bullets],
+                             [(b.x, b.y, b.angle) for b in array])
+        self.assertEqual(len(array), 2)
+        array.remove([array[0]])
+        self.assertEqual([b.angle for b in array], [bullets[1].angle])
+
+    def test_get_collisions(self):
+        rnd = random.Random(4)
+        robots = [battlefield.create_robot(name="r%d" % index,
+                    x=rnd.uniform(100, 200), y=rnd.uniform(100, 200),
+                    angle=rnd.uniform(-180, 180), width=36, height=38)
+                  for index in range(8)]
+        bullets = [battlefield.Bullet(x=rnd.uniform(80, 220), y=rnd.uniform(80, 220),
+                     angle=0.0, speed=0.0, origin="r%d" % rnd.randrange(8), id=index)
+                   for index in range(400)]
+        array = arrayfield.BulletArray(battlefield.Bullet, bullets)
+        collisions = array.get_collisions(robots,
+            map(battlefield.get_polygon_for_robot, robots))
+        expected = [(bullet.id, robot.name) for bullet in bullets
+                    for robot in [battlefield.check_bullet_collision(robots, bullet)]
+                    if robot]
+        self.assertTrue(expected)
+        self.assertEqual([(b.id, r.name) for (b, r) in collisions], expected)
+        # Structs are only built for the bullets that hit
+        self.assertEqual(len(lib.compact(array._structs)), len(expected))
+        array.remove([bullet for (bullet, robot) in collisions])
+        self.assertEqual(len(array), len(bullets) - len(expected))
+        self.assertEqual([b.id for b in array], sorted(set(range(400)).difference(
+            id for (id, name) in expected)))
+
+    def test_process_robots(self):
+        robots = [battlefield.create_robot(name="r%d" % index, x=x, y=y,
+                    angle=angle, speed=200.0, rotation=50.0, width=36, height=38)
+                  for (index, (x, y, angle)) in
+                  enumerate([(20.0, 20.0, 135.0), (300.0, 200.0, 10.0)])]
+        expected = battlefield.process_robots(robots, 0.04, (640, 480))
+        vectorized = battlefield.process_robots(robots, 0.04, (640, 480), True)
+        self.assertEqual([(r.x, r.y, r.angle) for r in expected],
+                         [(r.x, r.y, r.angle) for r in vectorized])
+
+def create_field(nrobots=4):
+    config = {
+        "map": {"size": [640, 480]}, 
+        "robot": {"size": [36, 38], "shield": 2, "max_speed": [200.0, 100.0],
+                  "rotation_max_speed": 100.0, "turret_rotation_max_speed": 125.0,
+                  "fire_min_interval": 0.5, "bullet_speed": 300.0},
+    }
+    robots = dict((robot.name, robot) for robot in 
+        [battlefield.create_robot(name="r%d" % index, x=100.0 + 120 * index, 
+            y=100.0 + 60 * (index % 2), angle=45.0 * index, shield=2, 
+            speed=150.0, rotation=20.0 * (index - 2), width=36, height=38)
+         for index in range(nrobots)])
+    return battlefield.Field(config=config, robots=robots, bullets=[], 
+        battle_time=0.0)
+
+def get_robots(field):
+    return battlefield.get_robots(field.robots)
+
+def get_fire_angle(step):
+    """Return the turret angle robots fire to on a step of test battles."""
+    return (step * 37) % 360 - 180.0
+
+def get_fire_commands(field, step):
+    """Return commands for Battle.step: all robots fire (see get_fire_angle)."""
+    return dict((name, ("rotate-turret-to-angle-and-fire", get_fire_angle(step)))
+                for name in field.robots)
+
+def step_battle(battle, max_steps=2000, seed=0):
+    """
+    Step battle with robots firing to each other, return the events.
+
+    The battle starts on step seed of the firing script (see get_fire_commands).
+    """
+    events = []
+    for step in range(seed, seed + max_steps):
+        if battle.done:
+            break
+        observations, step_events, done = battle.step(
+            get_fire_commands(battle.field, step))
+        events.extend(step_events)
+    return events
+
+def get_state(field):
+    """Return the state of field (values of robots and bullets) to compare."""
+    robots = [[getattr(robot, attr) for attr in battlefield.Robot.attributes]
+              for robot in get_robots(field)]
+    bullets = [[getattr(bullet, attr) for attr in battlefield.Bullet.attributes]
+               for bullet in field.bullets]
+    return field.battle_time, robots, bullets
+
+def run_battle(field, max_frames=2000, **kwargs):
+    """Run a battle where robots fire to each other, return the list of frames."""
+    frames = []
+    def _input_callback(loop_id, field, robot):
+        if robot.fire_angle is None and not robot.time_to_fire:
+            robot.fire_angle = get_fire_angle(len(frames))
+            return [battlefield.StateChange(update_robots=[robot], new_bullets=[])]
+    def _draw_callback(field):
+        frames.append(([(r.name, r.x, r.y, r.angle, r.turret_angle, r.shield) 
+                        for (name, r) in sorted(field.robots.items())],
+                       [(b.x, b.y, b.origin) for b in field.bullets]))
+        if len(frames) >= max_frames:
+            raise battlefield.AbortBattle
+    input_callbacks = dict((name, _input_callback) for name in field.robots)
+    try:
+        battlefield.run(field, input_callbacks, [_draw_callback], 0.04, **kwargs)
+    except battlefield.AbortBattle:
+        pass
+    return frames
+
+class TestEngine(unittest.TestCase):
+    def test_in_place(self):
+        frames = run_battle(create_field())
+        self.assertTrue(any(bullets for (robots, bullets) in frames))
+        self.assertEqual(frames, run_battle(create_field(), in_place=True))
+
+    def test_arrays(self):
+        field = arrayfield.use_arrays(create_field(), battlefield.Bullet)
+        self.assertEqual(run_battle(create_field()), run_battle(field))
+
+class TestPose(unittest.TestCase):
+    def test_cache(self):
+        robot = create_field().robots["r1"]
+        pose = battlefield.get_pose(robot)
+        self.assertEqual(pose, battlefield.create_pose(robot))
+        self.assertTrue(battlefield.get_pose(robot) is pose)
+        for attribute in ["x", "y", "angle", "turret_angle"]:
+            setattr(robot, attribute, getattr(robot, attribute) + 7.5)
+            self.assertEqual(battlefield.get_pose(robot), 
+                             battlefield.create_pose(robot))
+        # Clones share the cached pose until they change
+        pose = battlefield.get_pose(robot)
+        clone = lib.clone_struct(robot)
+        self.assertTrue(battlefield.get_pose(clone) is pose)
+        clone.angle += 90.0
+        self.assertEqual(battlefield.get_pose(clone), battlefield.create_pose(clone))
+        self.assertTrue(battlefield.get_pose(robot) is pose)
+        # In-place updates of the struct
+        lib.update_struct(robot, clone)
+        self.assertEqual(battlefield.get_pose(robot), battlefield.create_pose(robot))
+
+    def test_battle(self):
+        # The cached pose follows robots updated in-place and replaced
+        for in_place in [False, True]:
+            battle = battlefield.Battle(create_field(), 0.04, in_place)
+            for step in range(50):
+                battle.step(get_fire_commands(battle.field, step))
+                for robot in battle.field.robots.itervalues():
+                    self.assertEqual(battlefield.get_pose(robot), 
+                                     battlefield.create_pose(robot))
+
+class TestBattle(unittest.TestCase):
+    def test_step(self):
+        battle = battlefield.Battle(create_field(2), 0.04)
+        observations, events, done = battle.step(get_fire_commands(battle.field, 0))
+        self.assertEqual(sorted(observations), sorted(battle.field.robots))
+        events += step_battle(battle, seed=1)
+        self.assertTrue(battle.done)
+        types = [event.type for event in events]
+        self.assertEqual(types.count("fire"), battle.field.bullets_fired)
+        self.assertEqual(types.count("hit"), 2)
+        self.assertEqual(types[-1], "destroyed")
+        self.assertNotEqual(battle.winner, None)
+
+    def test_reset(self):
+        battle = battlefield.Battle(create_field(2), 0.04)
+        observations = battle.reset(seed=3)
+        self.assertEqual(observations["r0"]["others"], [observations["r1"]["me"]])
+        events = step_battle(battle)
+        battle.reset(seed=3)
+        self.assertEqual(step_battle(battle), events)
+        battle.reset()
+        self.assertEqual(battle.field.battle_time, 0.0)
+        self.assertEqual(battle.field.robots["r0"].x, create_field(2).robots["r0"].x)
+
+    def test_skip(self):
+        def _play(skip):
+            rnd = random.Random(3)
+            battle = battlefield.Battle(create_field(2), 0.04)
+            for index in range(40):
+                battle.step({
+                    "r0": [("set-speed", rnd.uniform(-100, 200)), 
+                           ("set-rotation-speed", rnd.uniform(-50, 50)),
+                           ("rotate-turret-to-angle-and-fire", rnd.uniform(-180, 180))],
+                    "r1": [("set-speed", rnd.uniform(-100, 200)), ("fire",)]})
+                if skip:
+                    battle.skip(49)
+                else:
+                    for tick in range(49):
+                        if not battle.done:
+                            battle.advance()
+            field = battle.field
+            return (field.battle_time, field.bullets_fired, 
+                [(r.x, r.y, r.angle, r.turret_angle, r.shield, r.time_to_fire) 
+                 for r in get_robots(field)],
+                [(b.id, b.x, b.y) for b in field.bullets])
+        self.assertEqual(_play(True), _play(False))
+
+class TestBroadphase(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(1)
+        self.config = {"map": {"size": [640, 480]}, "robot": {"size": [36, 38]}}
+        self.robots = [battlefield.create_robot(name="r%d" % index, 
+                         x=rnd.uniform(0, 640), y=rnd.uniform(0, 480), 
+                         angle=rnd.uniform(-180, 180), width=36, height=38)
+                       for index in range(40)]
+
+    def test_find_collision(self):
+        spatial_hash = battlefield.get_spatial_hash(self.config)
+        for robots in [self.robots[:3], self.robots[:10], self.robots]:
+            self.assertEqual(battlefield.find_collision(robots),
+                             battlefield.find_collision(robots, spatial_hash))
+
+    def test_check_bullet_collision(self):
+        rnd = random.Random(2)
+        spatial_hash = battlefield.get_spatial_hash(self.config)
+        battlefield.fill_spatial_hash(spatial_hash, self.robots)
+        for index in range(500):
+            bullet = battlefield.Bullet(x=rnd.uniform(-10, 650), 
+                y=rnd.uniform(-10, 490), angle=0.0, speed=0.0, origin="r0")
+            self.assertEqual(
+                battlefield.check_bullet_collision(self.robots, bullet),
+                battlefield.check_bullet_collision(self.robots, bullet, spatial_hash))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+import os
+import shutil
+import tempfile
+import unittest
+
+from langbots import cache
+from langbots import tournament
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_put(self):
+        result_cache = cache.ResultCache(os.path.join(self.directory, "cache"))
+        key = cache.get_key(dict(seed=1, bots=["a", "b"]))
+        self.assertEqual(key, cache.get_key(dict(bots=["a", "b"], seed=1)))
+        self.assertEqual(result_cache.get(key), None)
+        result_cache.put(key, dict(winner="a", battle_time=10.5))
+        self.assertEqual(result_cache.get(key), dict(winner="a", battle_time=10.5))
+
+    def test_evict(self):
+        result_cache = cache.ResultCache(self.directory, max_size=1000)
+        def _put(index):
+            result_cache.put("key%d" % index, dict(data="x" * 100))
+            # Fake access times (least recently used results are removed first)
+            os.utime(os.path.join(self.directory, "key%d.yml" % index), (index, index))
+        for index in range(5):
+            _put(index)
+        result_cache.get("key0")
+        for index in range(5, 20):
+            _put(index)
+        self.assertTrue(sum(size for (_, size, _) in result_cache.get_entries()) <= 1000)
+        self.assertNotEqual(result_cache.get("key0"), None)
+        self.assertEqual(result_cache.get("key1"), None)
+        self.assertNotEqual(result_cache.get("key19"), None)
+
+    def test_scans(self):
+        # The directory is listed on the first put and when evicting
+        result_cache = cache.ResultCache(self.directory, max_size=1000)
+        scans = []
+        get_entries = result_cache.get_entries
+        def _get_entries():
+            scans.append(1)
+            return get_entries()
+        result_cache.get_entries = _get_entries
+        for index in range(7):
+            result_cache.put("key%d" % index, dict(data="x" * 100))
+        result_cache.put("key0", dict(data="x" * 50))
+        self.assertEqual(len(scans), 1)
+        self.assertEqual(result_cache.size, 
+                         sum(size for (_, size, _) in get_entries()))
+        for index in range(7, 20):
+            result_cache.put("key%d" % index, dict(data="x" * 100))
+        self.assertTrue(1 < len(scans) < 10)
+        self.assertTrue(result_cache.size <= 1000)
+
+    def test_match_keys(self):
+        config_file = os.path.join(self.directory, "field.yml")
+        with open(config_file, "w") as stream:
+            stream.write("map: {size: [640, 480]}\nrobot: {size: [36, 38]}\n")
+        paths = [os.path.join(self.directory, name) for name in ["a.py", "b.py"]]
+        for path in paths:
+            with open(path, "w") as stream:
+                stream.write("print 'bot'\n")
+        bots = [tournament.Bot(name=name, executable=path, protocol="yaml")
+                for (name, path) in zip(["a", "b"], paths)]
+        def _get_keys():
+            matches = tournament.get_matches(bots, 4, config_file, 25, 60.0)
+            tournament.set_match_keys(matches, self.directory)
+            return [match.key for match in matches]
+        keys = _get_keys()
+        self.assertEqual(len(set(keys)), 4)
+        self.assertEqual(keys, _get_keys())
+        with open(paths[1], "a") as stream:
+            stream.write("# changed\n")
+        self.assertEqual(set(keys) & set(_get_keys()), set())
+
+    def test_cached_replay(self):
+        result_cache = cache.ResultCache(os.path.join(self.directory, "cache"))
+        match = tournament.Match(index=0, key="key", replay=None)
+        result_cache.put("key", dict(winner="a", battle_time=10.5, misses={},
+            replay=None))
+        self.assertEqual(tournament.get_cached_result(result_cache, match).winner, "a")
+        # Results without the replay requested are run again
+        match.replay = os.path.join(self.directory, "key.log")
+        self.assertEqual(tournament.get_cached_result(result_cache, match), None)
+        result_cache.put("key", dict(winner="a", battle_time=10.5, misses={},
+            replay=match.replay))
+        self.assertEqual(tournament.get_cached_result(result_cache, match), None)
+        open(match.replay, "w").close()
+        result = tournament.get_cached_result(result_cache, match)
+        self.assertEqual((result.replay, result.cached), (match.replay, True))
+        # Replays in another directory are not reused
+        match.replay = os.path.join(self.directory, "other", "key.log")
+        self.assertEqual(tournament.get_cached_result(result_cache, match), None)
+
+if __name__ == '__main__':
+    unittest.main()
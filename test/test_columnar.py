@@ -0,0 +1,52 @@
+#!/usr/bin/python
+import os
+import shutil
+import tempfile
+import unittest
+import StringIO
+
+import numpy
+
+from langbots import replay
+from langbots import columnar
+
+from test_replay import record_battle
+
+class TestColumnar(unittest.TestCase):
+    def setUp(self):
+        stream = StringIO.StringIO()
+        writer, self.snapshots = record_battle(stream, max_frames=600)
+        writer.close()
+        stream.seek(0)
+        self.fields = list(replay.read_fields(stream))
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_export(self):
+        for path in ["battle.npz", "battle"]:
+            path = os.path.join(self.directory, path)
+            columnar.export_replay(self.fields, path)
+            data = columnar.load(path)
+            self.assertEqual(list(data["time"]), [f.battle_time for f in self.fields])
+            names = list(data["robot_names"])
+            self.assertEqual(names, sorted(self.fields[0].robots))
+            robot = self.fields[300].robots["r2"]
+            self.assertEqual(data["robot_x"][300, names.index("r2")], robot.x)
+            # Every bullet fired is spawned once, hits match shield losses
+            last = self.fields[-1]
+            self.assertEqual(sorted(data["spawn_id"]), range(last.bullets_fired))
+            self.assertEqual(len(data["despawn_id"]) + len(last.bullets), 
+                last.bullets_fired)
+            # Dead robots are NaN after the frame they are killed
+            shields = data["robot_shield"]
+            lost = numpy.nansum(shields[0]) - numpy.nansum(shields[-1])
+            self.assertEqual(data["despawn_hit"].sum(), lost)
+            # Bullets never seen in a frame (point-blank) get their origin
+            unseen = numpy.isnan(data["spawn_x"])
+            self.assertTrue(unseen.any())
+            self.assertTrue((data["spawn_origin"] >= 0).all())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+import unittest
+import random
+import StringIO
+
+from langbots import battlefield
+from langbots import commandlog
+from langbots.inputmods import commands_input
+
+from test_battlefield import create_field
+from test_replay import get_snapshot
+
+def play_battle(field, commands, max_frames=300):
+    """Re-simulate a battle from logged commands, return the list of frames."""
+    frames = []
+    def _draw_callback(field):
+        frames.append(get_snapshot(field))
+        if len(frames) >= max_frames:
+            raise battlefield.AbortBattle
+    try:
+        commandlog.play(field, 0.04, commands, [_draw_callback], realtime=False)
+    except battlefield.AbortBattle:
+        pass
+    return frames
+
+class TestCommandLog(unittest.TestCase):
+    def test_replay(self):
+        battlefield.add_yaml_representers()
+        battlefield.add_yaml_constructors()
+        rnd = random.Random(1)
+        stream = StringIO.StringIO()
+        writer = commandlog.CommandLogWriter(stream)
+        field = create_field()
+        field.bullets_fired = 0
+        writer.write_header(field, 0.04)
+        # Random commands, written to the log as the scheduler does
+        commands = {}
+        for loop in range(300):
+            for name in sorted(field.robots):
+                if rnd.random() < 0.3:
+                    command = rnd.choice([["set-speed", "%.1f" % rnd.uniform(-50, 200)],
+                        ["set-rotation-speed", "%.1f" % rnd.uniform(-100, 100)],
+                        ["rotate-turret-to-angle-and-fire", "%d" % rnd.randint(-180, 180)]])
+                    commands[(loop, name)] = [command]
+        frames = []
+        def _input_callback(loop_id, field, new_robot):
+            loop = len(frames) - 1
+            for command in commands.get((loop, new_robot.name), []):
+                writer.write(field, new_robot.name, command)
+                yield commands_input.process_command(field, new_robot, list(command))
+        def _draw_callback(field):
+            frames.append(get_snapshot(field))
+            if len(frames) >= 300:
+                raise battlefield.AbortBattle
+        input_callbacks = dict((name, _input_callback) for name in field.robots)
+        try:
+            battlefield.run(field, input_callbacks, [_draw_callback], 0.04)
+        except battlefield.AbortBattle:
+            pass
+        self.assertTrue(any(bullets for (_, _, _, bullets) in frames))
+
+        stream.seek(0)
+        self.assertTrue(commandlog.is_command_log(stream))
+        field, delta_time, logged = commandlog.read_command_log(stream)
+        self.assertEqual(delta_time, 0.04)
+        self.assertEqual(play_battle(field, logged), frames)
+
+        # Headless simulation (time skipped between commands)
+        stream.seek(0)
+        field, delta_time, logged = commandlog.read_command_log(stream)
+        self.assertEqual(commandlog.simulate(field, delta_time, logged, 
+            max_time=frames[-1][0]), None)
+        self.assertEqual(get_snapshot(field), frames[-1])
+        # Stop at max_time with logged commands after it
+        stream.seek(0)
+        field, delta_time, logged = commandlog.read_command_log(stream)
+        self.assertEqual(commandlog.simulate(field, delta_time, logged, 
+            max_time=frames[100][0]), None)
+        self.assertEqual(get_snapshot(field), frames[100])
+
+    def test_simulate_max_time(self):
+        field = create_field()
+        commands = {(0.0, "r0"): [["set-speed", "10"]],
+                    (8.0, "r0"): [["set-speed", "20"]]}
+        self.assertEqual(commandlog.simulate(field, 0.04, commands, max_time=2.0), None)
+        self.assertAlmostEqual(field.battle_time, 2.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,293 @@
+#!/usr/bin/python
+import os
+import time
+import json
+import errno
+import fcntl
+import unittest
+import threading
+import StringIO
+
+import yaml
+
+from langbots import battlefield
+from langbots.inputmods import commands_input
+from langbots.inputmods import python_input
+
+from test_battlefield import create_field as create_battle_field
+
+BOT_LIB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "bots", "python", "lib.py")
+
+def create_field(nbullets=3):
+    robots = dict((name, battlefield.create_robot(name=name, x=10.5 * index, 
+            y=20.25, angle=15.0 * index, shield=3, width=36, height=38)) 
+        for (index, name) in enumerate(["robot1", "robot2", "robot3"]))
+    bullets = [battlefield.Bullet(x=1.0 / (index + 3), y=2.0, angle=-45.0, 
+            speed=300.0, origin="robot1") for index in range(nbullets)]
+    return battlefield.Field(config={}, robots=robots, bullets=bullets, 
+        battle_time=0.12)
+
+class TestState(unittest.TestCase):
+    def test_yaml(self):
+        for field in [create_field(), create_field(nbullets=0)]:
+            shared_state = commands_input.SharedState(field)
+            for robot in field.robots.values():
+                data = commands_input.get_state_data(field, robot)
+                self.assertEqual(shared_state.get(robot, "yaml"),
+                    yaml.dump(data, default_flow_style=False).rstrip() + "\n\n")
+
+    def test_json(self):
+        field = create_field()
+        shared_state = commands_input.SharedState(field)
+        for robot in field.robots.values():
+            data = commands_input.get_state_data(field, robot)
+            state = shared_state.get(robot, "json")
+            self.assertEqual(state.count("\n"), 1)
+            self.assertEqual(json.loads(state), data)
+
+    def test_text(self):
+        field = create_field(nbullets=1)
+        state = commands_input.get_state(field, field.robots["robot2"], "text")
+        fields = state.split()
+        self.assertEqual(fields[:2], ["0.12", "0.12"])
+        nrobot = len(commands_input.ROBOT_ATTRIBUTES)
+        self.assertEqual(fields[2:2+nrobot], [repr(getattr(field.robots["robot2"], k)) 
+            for k in commands_input.ROBOT_ATTRIBUTES])
+        self.assertEqual(len(fields), 2 + 3*nrobot + 2 + 4)
+        
+    def test_bot_readers(self):
+        # States decoded by the bot library give back the state data
+        bot_lib = python_input.load_module(BOT_LIB)
+        for nbullets in [0, 3]:
+            field = create_field(nbullets)
+            for protocol in ["json", "text"]:
+                for robot in field.robots.values():
+                    state = commands_input.get_state(field, robot, protocol)
+                    update = bot_lib.READERS[protocol](StringIO.StringIO(state))
+                    self.assertEqual(update, 
+                        commands_input.get_state_data(field, robot))
+
+    def test_delta(self):
+        field = create_field(nbullets=2)
+        for index, bullet in enumerate(field.bullets):
+            bullet.id = index
+        state1 = commands_input.SharedState(field)
+        keyframe = json.loads(state1.get_delta(field.robots["robot1"]))
+        self.assertEqual((keyframe["keyframe"], keyframe["me"]), (1, "robot1"))
+        self.assertEqual(sorted(keyframe["bullets"]), ["0", "1"])
+        field.battle_time = 0.16
+        field.robots["robot2"].x += 1.0
+        del field.robots["robot3"]
+        field.bullets = field.bullets[1:] + [battlefield.Bullet(x=0.0, y=0.0, 
+            angle=90.0, speed=300.0, origin="robot2", id=2)]
+        state2 = commands_input.SharedState(field, state1)
+        delta = json.loads(state2.get_delta(field.robots["robot1"]))
+        self.assertEqual(delta["id"], "0.16")
+        self.assertEqual(delta["robots"], {"robot2": {"x": 11.5}})
+        self.assertEqual(delta["removed_robots"], ["robot3"])
+        self.assertEqual(delta["bullets"].keys(), ["2"])
+        self.assertEqual(delta["removed_bullets"], ["0"])
+
+class FakeBot(object):
+    """Bot on pipes: the test reads its states and writes its replies."""
+    def __init__(self, scheduler, robot_name, protocol="json"):
+        state_read, state_write = os.pipe()
+        reply_read, reply_write = os.pipe()
+        fcntl.fcntl(state_read, fcntl.F_SETFL, os.O_NONBLOCK)
+        self.state_fd, self.reply_fd = state_read, reply_write
+        self.streams = [os.fdopen(state_write, "w"), os.fdopen(reply_read)]
+        self.callback = scheduler.get_input_callback(robot_name, 
+            self.streams[0], self.streams[1], protocol)
+
+    def write(self, data):
+        os.write(self.reply_fd, data)
+
+    def reply(self, update_id, *commands):
+        """Write a reply for update_id (previous commands with "-" id)."""
+        self.write("".join("- %s\n" % command for command in commands[:-1]) +
+                   "%s %s\n" % (update_id, commands[-1]))
+
+    def read_states(self):
+        """Return the number of states received since the last call."""
+        data = ""
+        while 1:
+            try:
+                chunk = os.read(self.state_fd, 4096)
+            except OSError, exc:
+                if exc.errno == errno.EAGAIN:
+                    break
+                raise
+            if not chunk:
+                break
+            data += chunk
+        return data.count("\n")
+
+    def close_states(self):
+        """Stop reading states (the scheduler gets a broken pipe)."""
+        os.close(self.state_fd)
+        self.state_fd = None
+
+    def close_replies(self):
+        """Close the reply pipe (the scheduler gets EOF)."""
+        os.close(self.reply_fd)
+        self.reply_fd = None
+
+    def close(self):
+        for fd in [self.state_fd, self.reply_fd]:
+            if fd is not None:
+                os.close(fd)
+        for stream in self.streams:
+            try:
+                stream.close()
+            except IOError:
+                pass
+
+class CommandList(object):
+    """Command log that keeps (battle_time, robot_name, command) in a list."""
+    def __init__(self):
+        self.commands = []
+
+    def write(self, field, robot_name, command):
+        self.commands.append((field.battle_time, robot_name, " ".join(command)))
+
+def run_loops(field, bots, hooks):
+    """Run a battle with bots for a loop for each hook (called on loop start)."""
+    hooks = list(hooks)
+    def _draw_callback(field):
+        if not hooks:
+            raise battlefield.AbortBattle
+        hooks.pop(0)(field)
+    input_callbacks = dict((name, bot.callback) for (name, bot) in bots.iteritems())
+    try:
+        battlefield.run(field, input_callbacks, [_draw_callback], 0.04)
+    except battlefield.AbortBattle:
+        pass
+
+class TestInputScheduler(unittest.TestCase):
+    def setUp(self):
+        self.bots = {}
+
+    def tearDown(self):
+        for bot in self.bots.itervalues():
+            bot.close()
+
+    def create_bots(self, scheduler, names):
+        for name in names:
+            self.bots[name] = FakeBot(scheduler, name)
+        return [self.bots[name] for name in names]
+
+    def test_no_wait(self):
+        # A bot that never replies is missed at once with reply_timeout 0
+        scheduler = commands_input.InputScheduler(reply_timeout=0)
+        bot, = self.create_bots(scheduler, ["robot1"])
+        scheduler.exchange(create_field())
+        self.assertEqual(scheduler.get_misses(), {"robot1": 1})
+        self.assertEqual(bot.read_states(), 1)
+
+    def check_reply_timeout(self, apply_late_replies):
+        """Check the loops where commands of a bot that misses loop 0 land."""
+        command_log = CommandList()
+        scheduler = commands_input.InputScheduler(reply_timeout=0.05, 
+            apply_late_replies=apply_late_replies, command_log=command_log)
+        fast, slow = self.create_bots(scheduler, ["r0", "r1"])
+        clock, states = [], []
+        def _loop0(field):
+            clock.append(time.time())
+            fast.reply(str(field.battle_time), "set-speed 10")
+        def _loop1(field):
+            clock.append(time.time())
+            states.append(slow.read_states())
+            # Late reply of loop 0, after a line for another loop
+            slow.write("9.99 set-speed 55\n")
+            slow.reply("0.0", "set-speed 20")
+            fast.reply(str(field.battle_time), "set-speed 11")
+        def _loop2(field):
+            # The slow bot got no state on loop 1
+            states.append(slow.read_states())
+            fast.reply(str(field.battle_time), "set-speed 12")
+            slow.reply(str(field.battle_time), "set-speed 22")
+        run_loops(create_battle_field(2), self.bots, [_loop0, _loop1, _loop2])
+        states.append(slow.read_states())
+        self.assertTrue(0.05 <= clock[1] - clock[0] < 1.0)
+        self.assertEqual(states, [1, 0, 1])
+        late = ([(0.04, "r1", "set-speed 20")] if apply_late_replies else [])
+        self.assertEqual(command_log.commands, 
+            [(0.0, "r0", "set-speed 10"), (0.04, "r0", "set-speed 11")] + 
+            late + [(0.08, "r0", "set-speed 12"), (0.08, "r1", "set-speed 22")])
+        self.assertEqual(scheduler.get_misses(), {"r0": 0, "r1": 1})
+
+    def test_late_replies_dropped(self):
+        self.check_reply_timeout(apply_late_replies=False)
+
+    def test_late_replies_applied(self):
+        self.check_reply_timeout(apply_late_replies=True)
+
+    def test_exchange(self):
+        # Bots registered out of order, commands are applied in order of name
+        command_log = CommandList()
+        scheduler = commands_input.InputScheduler(command_log=command_log)
+        bot2, bot0, bot1 = self.create_bots(scheduler, ["r2", "r0", "r1"])
+        def _loop0(field):
+            update_id = str(field.battle_time)
+            bot2.reply(update_id, "set-speed 1")
+            # A reply split across reads
+            bot0.write("- set-rotation-speed 5\n%s set-sp" % update_id)
+            threading.Timer(0.05, bot0.write, ["eed 2\n"]).start()
+            bot1.reply(update_id, "set-speed 3")
+        def _loop1(field):
+            for index, bot in enumerate([bot0, bot1, bot2]):
+                bot.reply(str(field.battle_time), "set-speed %d" % (index + 4))
+        run_loops(create_battle_field(3), self.bots, [_loop0, _loop1])
+        self.assertEqual(command_log.commands, [
+            (0.0, "r0", "set-rotation-speed 5"), (0.0, "r0", "set-speed 2"),
+            (0.0, "r1", "set-speed 3"), (0.0, "r2", "set-speed 1"),
+            (0.04, "r0", "set-speed 4"), (0.04, "r1", "set-speed 5"),
+            (0.04, "r2", "set-speed 6")])
+        self.assertEqual([bot.read_states() for bot in [bot0, bot1, bot2]], 
+                         [2, 2, 2])
+
+    def test_closed_bot(self):
+        # Bots that close their pipes mid-battle are not waited for
+        command_log = CommandList()
+        scheduler = commands_input.InputScheduler(command_log=command_log)
+        bot0, bot1, bot2 = self.create_bots(scheduler, ["r0", "r1", "r2"])
+        def _loop0(field):
+            for bot in [bot0, bot1, bot2]:
+                bot.reply(str(field.battle_time), "set-speed 1")
+        def _loop1(field):
+            bot0.reply(str(field.battle_time), "set-speed 2")
+            bot1.close_replies()
+            bot2.close_states()
+        def _loop2(field):
+            bot0.reply(str(field.battle_time), "set-speed 3")
+        run_loops(create_battle_field(3), self.bots, [_loop0, _loop1, _loop2])
+        self.assertEqual(command_log.commands, [(0.0, "r0", "set-speed 1"), 
+            (0.0, "r1", "set-speed 1"), (0.0, "r2", "set-speed 1"),
+            (0.04, "r0", "set-speed 2"), (0.08, "r0", "set-speed 3")])
+        self.assertEqual([bot0.read_states(), bot1.read_states()], [3, 2])
+        self.assertEqual([scheduler.bots[name].closed for name in ["r0", "r1", "r2"]],
+                         [False, True, True])
+
+    def test_read_line(self):
+        read_fd, write_fd = os.pipe()
+        fcntl.fcntl(read_fd, fcntl.F_SETFL, os.O_NONBLOCK)
+        try:
+            os.write(write_fd, "new-")
+            threading.Timer(0.05, os.write, [write_fd, "battle\nend-"]).start()
+            line, buffer = commands_input.read_line(read_fd, "", time.time() + 5.0)
+            self.assertEqual((line, buffer), ("new-battle", "end-"))
+            # Timeout and EOF keep the partial line in the buffer
+            self.assertEqual(commands_input.read_line(read_fd, buffer, 
+                time.time() + 0.01), (None, "end-"))
+            os.close(write_fd)
+            write_fd = None
+            self.assertEqual(commands_input.read_line(read_fd, buffer, 
+                time.time() + 5.0), (None, "end-"))
+        finally:
+            for fd in [read_fd, write_fd]:
+                if fd is not None:
+                    os.close(fd)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+import unittest
+import StringIO
+
+from langbots import compression
+from langbots import replay
+
+from test_replay import record_battle, get_snapshot
+
+def compress(data, writes, method="zlib", chunk_size=100):
+    """Return data compressed in chunks (cut between writes)."""
+    stream = StringIO.StringIO()
+    writer = compression.ChunkedWriter(stream, method, chunk_size=chunk_size)
+    for index in range(0, len(data), writes):
+        writer.write(data[index:index+writes])
+    writer.write_chunk()
+    return stream.getvalue()
+
+class TestChunkedReader(unittest.TestCase):
+    def setUp(self):
+        self.data = "".join("line %d\n" % index for index in range(500))
+
+    def test_read(self):
+        for method in ["zlib", "bz2"]:
+            stream = StringIO.StringIO(compress(self.data, 37, method))
+            self.assertTrue(compression.is_compressed(stream))
+            reader = compression.ChunkedReader(stream)
+            self.assertEqual(reader.read(7), "line 0\n")
+            self.assertEqual(reader.readline(), "line 1\n")
+            self.assertEqual(reader.read(), self.data[len("line 0\nline 1\n"):])
+            self.assertEqual(reader.read(), "")
+
+    def test_lines(self):
+        reader = compression.ChunkedReader(StringIO.StringIO(compress(self.data, 37)))
+        self.assertEqual(list(reader), self.data.splitlines(True))
+        self.assertTrue(len(reader.get_chunks()) > 10)
+
+    def test_seek(self):
+        reader = compression.ChunkedReader(StringIO.StringIO(compress(self.data, 37)))
+        for offset in [0, 1500, 99, 3000, len(self.data) - 5, 7]:
+            reader.seek(offset)
+            self.assertEqual(reader.tell(), offset)
+            self.assertEqual(reader.read(20), self.data[offset:offset+20])
+        reader.seek(-5, 2)
+        self.assertEqual(reader.read(), self.data[-5:])
+
+    def test_truncated(self):
+        compressed = compress(self.data, 37)
+        reader = compression.ChunkedReader(StringIO.StringIO(compressed[:-10]))
+        data = reader.read()
+        self.assertTrue(0 < len(data) < len(self.data))
+        self.assertTrue(self.data.startswith(data))
+        reader.seek(0, 2)
+        self.assertEqual(reader.tell(), len(data))
+
+class TestCompressedReplay(unittest.TestCase):
+    def test_replay(self):
+        stream = StringIO.StringIO()
+        writer = compression.ChunkedWriter(stream, "zlib", chunk_size=4096)
+        replay_writer, snapshots = record_battle(writer)
+        replay_writer.close()
+        writer.write_chunk()
+        reader = compression.ChunkedReader(StringIO.StringIO(stream.getvalue()))
+        replay_reader = replay.ReplayReader(reader)
+        replay_reader.seek(snapshots[200][0])
+        self.assertEqual(map(get_snapshot, replay_reader), snapshots[200:])
+
+    def test_truncated_replay(self):
+        stream = StringIO.StringIO()
+        writer = compression.ChunkedWriter(stream, "zlib", chunk_size=4096)
+        replay_writer, snapshots = record_battle(writer)
+        replay_writer.close()
+        writer.write_chunk()
+        for cut in [10, 100, 1000]:
+            data = stream.getvalue()[:-cut]
+            reader = compression.ChunkedReader(StringIO.StringIO(data))
+            replay_reader = replay.ReplayReader(reader)
+            self.assertTrue(replay_reader.get_index())
+            fields = map(get_snapshot, replay_reader)
+            self.assertTrue(0 < len(fields) < len(snapshots))
+            self.assertEqual(fields, snapshots[:len(fields)])
+
+if __name__ == '__main__':
+    unittest.main()
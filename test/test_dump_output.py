@@ -0,0 +1,32 @@
+#!/usr/bin/python
+import unittest
+import StringIO
+
+from langbots import battlefield
+from langbots.outputmods import dump_output
+
+from test_battlefield import create_field
+
+class TestBackgroundWriter(unittest.TestCase):
+    def test_write(self):
+        battlefield.add_yaml_representers()
+        stream, expected = StringIO.StringIO(), StringIO.StringIO()
+        writer = dump_output.BackgroundWriter(stream, queue_size=4, batch_size=3)
+        field = create_field()
+        for index in range(20):
+            # Fields are changed in-place after the snapshot is queued
+            field.battle_time = index * 0.04
+            for robot in field.robots.itervalues():
+                robot.x += 1.0
+            dump_output.write_state(field, expected)
+            writer.put(dump_output.get_snapshot(field))
+        writer.close()
+        self.assertEqual(stream.getvalue(), expected.getvalue())
+
+    def test_error(self):
+        writer = dump_output.BackgroundWriter(None)
+        writer.put(create_field())
+        self.assertRaises(AttributeError, writer.close)
+
+if __name__ == '__main__':
+    unittest.main()
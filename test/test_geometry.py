@@ -37,6 +37,37 @@ class TestShapes(unittest.TestCase):
         self.assertTrue(geometry.check_collision_of_triangles(triangle1,
             [(-1.0, 0.0), (0.0, 1.0), (0.0, 2.0)]))
 
+    def test_check_point_in_polygon(self):
+        rhombus = [(-1.0, 0.0), (0.0, 1.0), (1.0, 0.0), (0.0, -1.0)]
+        for in_point in [(0.0, 0.0), (0.5, 0.4), (-0.9, 0.0), (1.0, 0.0)]:
+            self.assertTrue(geometry.check_point_in_polygon(in_point, rhombus))
+        for out_point in [(0.6, 0.6), (-1.01, 0.0), (0.0, -1.5)]:
+            self.assertFalse(geometry.check_point_in_polygon(out_point, rhombus))
+
+    def test_check_collision_of_polygons(self):
+        square = [(0.0, 0.0), (0.0, 2.0), (2.0, 2.0), (2.0, 0.0)]
+        self.assertTrue(geometry.check_collision_of_polygons(square,
+            [(1.0, 1.0), (1.0, 3.0), (3.0, 3.0), (3.0, 1.0)]))
+        self.assertFalse(geometry.check_collision_of_polygons(square,
+            [(2.1, 0.0), (3.0, 1.0), (4.0, 0.0), (3.0, -1.0)]))
+        # Edges intersect but no vertex is inside the other polygon
+        cross = [(-1.0, 0.5), (-1.0, 1.5), (3.0, 1.5), (3.0, 0.5)]
+        self.assertTrue(geometry.check_collision_of_polygons(square, cross))
+        self.assertFalse(
+            geometry.check_collision_of_polygons_by_triangles(square, cross))
+
+    def test_get_penetration_of_polygons(self):
+        square = [(0.0, 0.0), (0.0, 2.0), (2.0, 2.0), (2.0, 0.0)]
+        other = [(1.5, 0.5), (1.5, 1.5), (3.5, 1.5), (3.5, 0.5)]
+        depth, (ax, ay) = geometry.get_penetration_of_polygons(square, other)
+        self.assertAlmostEqual(depth, 0.5)
+        self.assertAlmostEqual(ax, 1.0)
+        self.assertAlmostEqual(ay, 0.0)
+        depth, (ax, ay) = geometry.get_penetration_of_polygons(other, square)
+        self.assertAlmostEqual(ax, -1.0)
+        self.assertEqual(geometry.get_penetration_of_polygons(square,
+            [(3.0, 0.0), (3.0, 1.0), (4.0, 1.0), (4.0, 0.0)]), None)
+
     def test_get_direction_for_rotation(self):
         self.assertEqual(geometry.get_direction_for_rotation(45, 60), +1)            
         self.assertEqual(geometry.get_direction_for_rotation(45, 160), +1)
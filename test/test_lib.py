@@ -0,0 +1,42 @@
+#!/usr/bin/python
+import unittest
+import pickle
+
+from langbots import lib
+
+Point = lib.struct("Point", ["x", "y"], ["cache"])
+Pair = lib.struct("Pair", ["first", "second"], immutable=True)
+
+class TestStruct(unittest.TestCase):
+    def test_init(self):
+        self.assertEqual((Point(1, 2).x, Point(1, 2).y), (1, 2))
+        point = Point(y=3)
+        self.assertEqual((point.x, point.y, point.cache), (None, 3, None))
+        self.assertEqual(lib.get_data_dict(point), {"x": None, "y": 3})
+        self.assertRaises(TypeError, Point, 1, 2, 3)
+
+    def test_clone_and_replace(self):
+        point = Point(x=1, y=2)
+        point.cache = "cached"
+        clone = lib.clone_struct(point)
+        self.assertFalse(clone is point)
+        self.assertEqual((clone.x, clone.y, clone.cache), (1, 2, "cached"))
+        clone.x = 5
+        self.assertEqual(point.x, 1)
+        replaced = point.replace(y=4)
+        self.assertEqual((replaced.x, replaced.y, point.y), (1, 4, 2))
+
+    def test_immutable(self):
+        pair = Pair(first=1)
+        self.assertEqual((pair.first, pair.second), (1, None))
+        self.assertTrue(pair.clone() is pair)
+        self.assertEqual(pair.replace(second=2), Pair(1, 2))
+        self.assertRaises(AttributeError, setattr, pair, "first", 3)
+
+    def test_pickle(self):
+        point = pickle.loads(pickle.dumps(Point(x=1, y=2), 2))
+        self.assertEqual((point.x, point.y), (1, 2))
+        self.assertEqual(pickle.loads(pickle.dumps(Pair(1, 2), 2)), Pair(1, 2))
+        
+if __name__ == '__main__':
+    unittest.main()
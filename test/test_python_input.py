@@ -0,0 +1,46 @@
+#!/usr/bin/python
+import os
+import unittest
+
+from langbots import battlefield
+from langbots.inputmods import python_input
+
+from test_battlefield import create_field
+
+SPARBOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "bots", "python", "sparbot.py")
+
+class TestPythonInput(unittest.TestCase):
+    def test_get_commands(self):
+        self.assertEqual(python_input.get_commands(None), [])
+        self.assertEqual(python_input.get_commands("set-speed 200 fire"),
+                         [["set-speed", "200", "fire"]])
+        self.assertEqual(python_input.get_commands(("set-speed", 0.1)),
+                         [["set-speed", "0.1"]])
+        self.assertEqual(python_input.get_commands(["fire", ("set-rotation-speed", 3)]),
+                         [["fire"], ["set-rotation-speed", "3"]])
+
+    def test_read_only_view(self):
+        field = create_field()
+        robot = field.robots.values()[0]
+        view = python_input.FieldView(field, robot, field.config)
+        self.assertEqual(view.me.x, robot.x)
+        self.assertEqual(len(view.others), len(field.robots) - 1)
+        self.assertRaises(AttributeError, setattr, view.me, "x", 0.0)
+        self.assertRaises(AttributeError, setattr, view, "time", 0.0)
+
+    def test_battle(self):
+        def _play():
+            field = create_field(2)
+            module = python_input.load_module(SPARBOT)
+            input_callbacks = dict((name, python_input.get_input_callback(name,
+                    python_input.get_control(module, field.config, name), field.config))
+                for name in field.robots)
+            winner = battlefield.run(field, input_callbacks, [], 0.04)
+            return winner.name, field.battle_time
+        winner_name, battle_time = _play()
+        self.assertTrue(battle_time > 0.0)
+        self.assertEqual(_play(), (winner_name, battle_time))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/python
+import unittest
+import StringIO
+
+from langbots import battlefield
+from langbots import replay
+from langbots.outputmods import dump_output
+
+from test_battlefield import create_field, get_fire_angle
+
+def get_snapshot(field):
+    robots = [(name, [getattr(robot, attr) for attr in battlefield.Robot.attributes])
+              for (name, robot) in sorted(field.robots.items())]
+    bullets = [[getattr(bullet, attr) for attr in battlefield.Bullet.attributes]
+               for bullet in field.bullets]
+    return field.battle_time, field.bullets_fired, robots, bullets
+
+def record_battle(stream, max_frames=400, keyframe_interval=25):
+    """Run a battle writing it to stream, return the snapshots of the frames."""
+    writer = replay.ReplayWriter(stream, keyframe_interval)
+    snapshots = []
+    def _input_callback(loop_id, field, robot):
+        if robot.fire_angle is None and not robot.time_to_fire:
+            robot.fire_angle = get_fire_angle(len(snapshots))
+            return [battlefield.StateChange(update_robots=[robot], new_bullets=[])]
+    def _draw_callback(field):
+        writer.write(field)
+        snapshots.append(get_snapshot(field))
+        if len(snapshots) >= max_frames:
+            raise battlefield.AbortBattle
+    field = create_field()
+    field.bullets_fired = 0
+    input_callbacks = dict((name, _input_callback) for name in field.robots)
+    try:
+        battlefield.run(field, input_callbacks, [_draw_callback], 0.04)
+    except battlefield.AbortBattle:
+        pass
+    return writer, snapshots
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.stream = StringIO.StringIO()
+        self.writer, self.snapshots = record_battle(self.stream)
+
+    def test_read(self):
+        self.writer.close()
+        self.stream.seek(0)
+        fields = list(replay.read_fields(self.stream))
+        self.assertEqual(map(get_snapshot, fields), self.snapshots)
+        self.assertTrue(any(field.bullets for field in fields))
+
+    def test_seek(self):
+        self.writer.close()
+        self.stream.seek(0)
+        reader = replay.ReplayReader(self.stream)
+        self.assertEqual(len(reader.get_index()), 16)
+        for frame in [0, 24, 25, 26, 399, 190, 3]:
+            reader.seek(self.snapshots[frame][0])
+            self.assertEqual(get_snapshot(iter(reader).next()), self.snapshots[frame])
+
+    def test_index_layout(self):
+        # Frames are followed by "X" + index, so scanners stop at the index
+        index_offset = self.writer.offset
+        self.writer.close()
+        data = self.stream.getvalue()
+        offset, magic = replay.TRAILER.unpack(data[-replay.TRAILER.size:])
+        self.assertEqual((offset, magic), (index_offset, replay.INDEX_MAGIC))
+        self.assertEqual(data[offset], "X")
+        count, = replay.UINT32.unpack_from(data, offset + 1)
+        self.assertEqual(count, 16)
+        reader = replay.ReplayReader(StringIO.StringIO(data))
+        self.assertEqual(len(reader.get_frames()), len(self.snapshots))
+
+    def test_without_index(self):
+        # Interrupted battle: no index nor trailer
+        self.stream.seek(0)
+        reader = replay.ReplayReader(self.stream)
+        reader.seek(self.snapshots[300][0])
+        self.assertEqual(map(get_snapshot, reader), self.snapshots[300:])
+
+    def test_get_frame(self):
+        self.writer.close()
+        self.stream.seek(0)
+        reader = replay.ReplayReader(self.stream)
+        self.assertEqual(reader.get_times(), [s[0] for s in self.snapshots])
+        for tick in [0, 1, 2, 399, 150, 151, 30, 24]:
+            self.assertEqual(get_snapshot(reader.get_frame(tick)), self.snapshots[tick])
+
+class TestYamlReplay(unittest.TestCase):
+    def test_get_frame(self):
+        battlefield.add_yaml_representers()
+        battlefield.add_yaml_constructors()
+        stream = StringIO.StringIO()
+        replay_stream = StringIO.StringIO()
+        writer, snapshots = record_battle(replay_stream, max_frames=50)
+        writer.close()
+        replay_stream.seek(0)
+        for field in replay.read_fields(replay_stream):
+            dump_output.write_state(field, stream)
+        stream.seek(0)
+        reader = replay.open_replay(stream)
+        self.assertEqual(reader.get_times(), [s[0] for s in snapshots])
+        for tick in [0, 1, 2, 49, 20, 21, 5]:
+            self.assertEqual(get_snapshot(reader.get_frame(tick)), snapshots[tick])
+
+class FakeClock(object):
+    def __init__(self):
+        self.time = 0.0
+    def __call__(self):
+        return self.time
+    def sleep(self, seconds):
+        self.time += seconds
+
+class TestPlayer(unittest.TestCase):
+    def setUp(self):
+        stream = StringIO.StringIO()
+        writer, self.snapshots = record_battle(stream, max_frames=100)
+        writer.close()
+        stream.seek(0)
+        self.reader = replay.ReplayReader(stream)
+        self.clock = FakeClock()
+
+    def play(self, speed, draw_time, **kwargs):
+        drawn = []
+        def _draw_callback(field):
+            drawn.append((self.clock(), field.battle_time))
+            self.clock.time += draw_time
+        player = replay.Player(self.reader, [_draw_callback], speed, 
+            self.clock, self.clock.sleep)
+        self.assertEqual(player.play(**kwargs), len(drawn))
+        return player, drawn
+
+    def test_speed(self):
+        player, drawn = self.play(4.0, 0.0, start_time=1.0)
+        self.assertEqual(len(drawn), 75)
+        for clock, battle_time in drawn:
+            self.assertAlmostEqual(clock, (battle_time - 1.0) / 4.0)
+        self.assertEqual(player.dropped, 0)
+
+    def test_drop_frames(self):
+        # Drawing takes 3 frames at 2x speed: only one out of 3 frames is drawn
+        player, drawn = self.play(2.0, 0.06, start_tick=10)
+        self.assertEqual(player.dropped + len(drawn), 90)
+        self.assertTrue(25 <= len(drawn) <= 35)
+        self.assertEqual(drawn[-1][1], self.snapshots[-1][0])
+
+if __name__ == '__main__':
+    unittest.main()
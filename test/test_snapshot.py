@@ -0,0 +1,60 @@
+#!/usr/bin/python
+import os
+import unittest
+
+from langbots import snapshot
+from langbots import battlefield
+
+from test_battlefield import create_field, step_battle, get_state
+
+def play(battle, steps, seed=0):
+    """Step battle with robots firing, return the state of its field."""
+    step_battle(battle, steps, seed)
+    return get_state(battle.field)
+
+def get_branch(battle, seed):
+    return play(battle, 200, seed)
+
+def fail_branch(battle, seed):
+    if seed == 0:
+        raise ValueError, "branch failed"
+    return get_branch(battle, seed)
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.battle = battlefield.Battle(create_field(3), 0.04)
+        step_battle(self.battle, 30)
+        robots = self.battle.field.robots.values()
+        self.assertTrue(self.battle.field.bullets)
+        self.assertTrue(any(robot.fire_angle is not None for robot in robots))
+
+    def test_dumps(self):
+        battle = snapshot.loads(snapshot.dumps(self.battle))
+        self.assertEqual(get_state(battle.field), get_state(self.battle.field))
+        self.assertEqual(play(battle, 500), play(self.battle, 500))
+        battle.reset()
+        self.assertEqual(get_state(battle.field), get_state(create_field(3)))
+        self.assertRaises(ValueError, snapshot.loads, "garbage")
+
+    def test_clone(self):
+        state = play(self.battle.clone(), 100, 5)
+        self.assertNotEqual(state, get_state(self.battle.field))
+        self.assertEqual(play(self.battle, 100, 5), state)
+
+    def test_fork_map(self):
+        results = snapshot.fork_map(self.battle, get_branch, range(3), processes=2)
+        self.assertEqual(results, [get_branch(self.battle.clone(), seed) 
+                                   for seed in range(3)])
+        self.assertNotEqual(results[0], results[1])
+        self.assertAlmostEqual(self.battle.field.battle_time, 30 * 0.04)
+
+    def test_fork_map_error(self):
+        # All children of the batch are reaped before the error is raised
+        fds = len(os.listdir("/proc/self/fd"))
+        self.assertRaises(RuntimeError, snapshot.fork_map, self.battle, 
+            fail_branch, range(3), processes=3)
+        self.assertEqual(len(os.listdir("/proc/self/fd")), fds)
+        self.assertRaises(OSError, os.waitpid, -1, os.WNOHANG)
+
+if __name__ == '__main__':
+    unittest.main()
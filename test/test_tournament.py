@@ -0,0 +1,100 @@
+#!/usr/bin/python
+import os
+import sys
+import math
+import shutil
+import tempfile
+import unittest
+
+from langbots import cache
+from langbots import tournament
+from langbots.inputmods import commands_input
+
+CONFIG = {"map": {"size": [640, 480]}, "robot": {"size": [36, 38]}}
+
+class TestTournament(unittest.TestCase):
+    def setUp(self):
+        self.bots = map(tournament.parse_bot, 
+            ["a:bots/a.py", "b:bots/b.py:json", "c:bots/c.py:text"])
+
+    def test_get_matches(self):
+        matches = tournament.get_matches(self.bots, 4, "field.yml", 25, 60.0, seed=10)
+        self.assertEqual(len(matches), 3 * 4)
+        self.assertEqual([[bot.name for bot in match.bots] for match in matches[:4]],
+                         [["a", "b"], ["b", "a"], ["a", "b"], ["b", "a"]])
+        self.assertEqual([match.seed for match in matches[:4]], [10, 10, 11, 11])
+
+    def test_get_start_positions(self):
+        self.assertEqual(tournament.get_start_positions(CONFIG, 0),
+                         [(320.0, 96.0, 0.0), (320.0, 384.0, 0.0)])
+        positions = tournament.get_start_positions(CONFIG, 5, 4)
+        self.assertEqual(positions, tournament.get_start_positions(CONFIG, 5, 4))
+        for index, (x1, y1, angle1) in enumerate(positions):
+            self.assertTrue(0 < x1 < 640 and 0 < y1 < 480)
+            for (x2, y2, angle2) in positions[index+1:]:
+                self.assertTrue(math.hypot(x2 - x1, y2 - y1) > 2 * math.hypot(36, 38))
+
+    def test_get_standings(self):
+        matches = tournament.get_matches(self.bots, 1, "field.yml", 25, 60.0)
+        results = [tournament.Result(match=match, winner=winner, error=error)
+                   for (match, winner, error) in zip(matches, 
+                       ["a", None, None], [None, None, "crashed"])]
+        standings = tournament.get_standings(self.bots, results)
+        self.assertEqual([(s["name"], s["points"], s["played"], s["errors"])
+                          for s in standings],
+                         [("a", 4, 2, 0), ("c", 1, 1, 1), ("b", 0, 1, 1)])
+
+class TestBotPool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.executable = os.path.join(self.directory, "simplebot.sh")
+        with open(self.executable, "w") as stream:
+            stream.write('#!/bin/sh\nexec %s %s "$@"\n' % (sys.executable,
+                os.path.join(root, "bots", "python", "simplebot.py")))
+        os.chmod(self.executable, 0755)
+        self.config_file = os.path.join(root, "config", "field.yml")
+        self.pool = tournament.get_bot_pool()
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.directory)
+
+    def test_reuse_processes(self):
+        bots = [tournament.Bot(name=name, executable=self.executable, 
+            protocol=protocol) for (name, protocol) in [("a", "json"), ("b", "json")]]
+        matches = tournament.get_matches(bots, 2, self.config_file, 25, 2.0,
+            pool_bots=True)
+        results = [tournament._run_match(match) for match in matches]
+        self.assertEqual([result.battle_time >= 2.0 for result in results], 
+                         [True, True])
+        self.assertEqual(self.pool.started, 2)
+        self.assertEqual(len(self.pool.idle[(self.executable, "json")]), 2)
+        # A crashed bot is replaced by a new process
+        processes = [self.pool.acquire(self.executable, "json", self.config_file)
+                     for index in range(2)]
+        processes[0].kill()
+        processes[0].wait()
+        for process in processes:
+            self.pool.release(process)
+        self.assertEqual(self.pool.recycled, 1)
+        self.assertEqual(len(self.pool.idle[(self.executable, "json")]), 1)
+
+    def test_run_matches(self):
+        bots = [tournament.Bot(name=name, executable=self.executable, 
+            protocol="json") for name in ["a", "b", "c"]]
+        matches = tournament.get_matches(bots, 1, self.config_file, 25, 1.0)
+        tournament.set_match_keys(matches)
+        result_cache = cache.ResultCache(os.path.join(self.directory, "cache"))
+        result_cache.put(matches[1].key, dict(winner=None, battle_time=1.0,
+            misses={}, replay=None))
+        results = tournament.run_matches(matches, processes=2, 
+            result_cache=result_cache)
+        # Cached and finished results are returned in order of matches
+        self.assertEqual([result.match.index for result in results], 
+                         range(len(matches)))
+        self.assertEqual([result.cached for result in results], 
+                         [index == 1 for index in range(len(matches))])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,7 @@
+#!/bin/bash
+export PYTHONPATH=. 
+python langbots/tournament.py "$@" \
+    -b simple1:bots/python/simplebot.py \
+    -b simple2:bots/python/simplebot.py:json \
+    -b simple3:bots/python/simplebot.py:text \
+    -n 4 -f 25 -o standings.yml